@@ -6,8 +6,11 @@ from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
+from .core.admission import MemoryAdmissionMiddleware
+from .core.logs import RequestContextMiddleware
+from .core.profiling import ProfilingMiddleware
 from .core.exceptions import AppException
-from .views import report_api
+from .views import report_api, admin_routes, MEMORY_BUDGET, PROFILER
 
 
 logger: logging.Logger = logging.getLogger("app")
@@ -21,7 +24,9 @@ def client_exc_handler(request: Request, exc: AppException):
     """Обработка исключений приложения"""
     exc_message = exc.args[0] if exc.args else ''
     logger.exception(exc.__doc__)
-    return JSONResponse(status_code=400, content={"detail": f"{exc.__doc__}. {exc_message}"})
+    return JSONResponse(
+        status_code=exc.status_code, content={"detail": f"{exc.__doc__}. {exc_message}"}, headers=exc.headers
+    )
 
 
 @app.exception_handler(Exception)
@@ -32,13 +37,16 @@ def unexpected_exc_handler(request: Request, exc: Exception):
     )
 
 
+app.add_middleware(ProfilingMiddleware, profiler=PROFILER)
+app.add_middleware(MemoryAdmissionMiddleware, budget=MEMORY_BUDGET, exempt_routes=admin_routes(app.routes))
+app.add_middleware(RequestContextMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[settings.ORIGINS or "*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Disposition"]
+    expose_headers=["Content-Disposition", "Retry-After", "X-Request-ID"]
 )
 
 uvicorn.run(app=app, host=settings.SERVICE_HOST, port=settings.SERVICE_PORT)
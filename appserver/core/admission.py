@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import tracemalloc
+from collections import deque
+from contextvars import ContextVar
+from typing import Iterable, Optional
+
+from dynaconf import settings
+from fastapi.responses import JSONResponse
+from starlette.routing import BaseRoute, Match
+
+from .exceptions import RequestsQueueFullException, ServerOverloadedException
+from .photos import PhotosPage
+
+
+current_reservation: ContextVar[Optional['MemoryReservation']] = ContextVar('current_reservation', default=None)
+
+
+def payload_cost(declared_size: Optional[int]) -> int:
+    """
+    Estimated memory of a request before its body is read: the body itself, objects parsed from it and
+    the rendered document grow with the declared body size
+    """
+    if declared_size is None:
+        declared_size = settings.ADMISSION.UNKNOWN_SIZE
+    return settings.ADMISSION.BASE_COST + int(declared_size * settings.ADMISSION.PAYLOAD_FACTOR)
+
+
+def photos_cost(pages: list[PhotosPage]) -> int:
+    """Estimated memory of decoding photos: pages are rendered one by one, so the largest page counts"""
+    return max(
+        (sum(photo.width * photo.height for photo in page.photos) for page in pages), default=0
+    ) * settings.ADMISSION.PIXEL_BYTES
+
+
+class MemoryReservation:
+    """Memory reserved by one request in the budget, `estimate` may exceed `cost` clamped by the budget limit"""
+
+    def __init__(self, budget: 'MemoryBudget', name: str, estimate: int):
+        self.name: str = name
+        self.estimate: int = estimate
+        self.cost: int = min(estimate, budget.limit)
+        self.baseline: int = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        self._budget: MemoryBudget = budget
+
+    def grow(self, estimate: int):
+        """
+        Add memory estimated once the request is parsed, never waits.
+
+        :raises ServerOverloadedException: the budget has no room for the addition
+        """
+        self._budget.grow(self, estimate)
+
+    def release(self):
+        self._budget.release(self)
+
+
+class MemoryBudget:
+    """
+    Global memory budget of requests being processed.
+
+    A request is admitted when the sum of estimates of admitted requests with its own estimate fits into
+    `limit`, otherwise it waits in a FIFO queue. A request with an estimate above the limit reserves the whole
+    budget and runs alone. Requests are rejected with 429 when `queue_size` requests are waiting already and with
+    503 when they wait longer than `queue_timeout` seconds.
+
+    With `trace_memory` the peak of memory traced by `tracemalloc` over the memory traced at admission is kept
+    for the last `reports_size` requests next to their estimates to tune the estimator. The peak is process-wide,
+    so it is exact only for requests processed alone: `concurrent` is the number of requests admitted
+    at the same time. Methods are called from the event loop.
+    """
+
+    def __init__(
+            self,
+            limit: int,
+            queue_size: int,
+            queue_timeout: float,
+            retry_after: int,
+            trace_memory: bool = False,
+            reports_size: int = 100
+    ):
+        self.logger: logging.Logger = logging.getLogger("admission")
+        self.limit: int = limit
+        self.queue_size: int = queue_size
+        self.queue_timeout: float = queue_timeout
+        self.retry_after: int = retry_after
+        self.used: int = 0
+        self.admitted: int = 0
+        self.rejected: int = 0
+        self.reports: deque[dict] = deque(maxlen=reports_size)
+        self._active: set[MemoryReservation] = set()
+        self._waiters: deque[tuple[MemoryReservation, asyncio.Future]] = deque()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    async def reserve(self, name: str, estimate: int) -> MemoryReservation:
+        """
+        :raises RequestsQueueFullException: too many requests are waiting
+        :raises ServerOverloadedException: the request waited for memory too long
+        """
+        reservation = MemoryReservation(self, name, estimate)
+        if not self._waiters and self.used + reservation.cost <= self.limit:
+            self._admit(reservation)
+            return reservation
+        if len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            raise RequestsQueueFullException(f'Ожидают {len(self._waiters)} запросов', self.retry_after)
+
+        waiter: tuple[MemoryReservation, asyncio.Future] = (reservation, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise ServerOverloadedException(
+                f'Запрос ожидал {self.queue_timeout:g} с, требуется {estimate} байт', self.retry_after
+            )
+        except BaseException:
+            if reservation in self._active:
+                self.release(reservation)
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self._wake()
+        return reservation
+
+    def grow(self, reservation: MemoryReservation, estimate: int):
+        cost: int = min(reservation.cost + estimate, self.limit)
+        if self.used - reservation.cost + cost > self.limit:
+            self.rejected += 1
+            raise ServerOverloadedException(f'Требуется еще {estimate} байт', self.retry_after)
+        self.used += cost - reservation.cost
+        reservation.cost = cost
+        reservation.estimate += estimate
+
+    def release(self, reservation: MemoryReservation):
+        if reservation not in self._active:
+            return
+        self._active.remove(reservation)
+        self.used -= reservation.cost
+        if tracemalloc.is_tracing():
+            peak: int = tracemalloc.get_traced_memory()[1] - reservation.baseline
+            report: dict = {
+                'request': reservation.name,
+                'estimate': reservation.estimate,
+                'peak': peak,
+                'concurrent': len(self._active) + 1
+            }
+            self.reports.append(report)
+            self.logger.info(
+                f'{reservation.name}: estimated {reservation.estimate} bytes, traced peak {peak} bytes, '
+                f'{report["concurrent"]} concurrent requests.'
+            )
+        self._wake()
+
+    def stats(self) -> dict:
+        return {
+            'limit': self.limit,
+            'used': self.used,
+            'active': len(self._active),
+            'queued': len(self._waiters),
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'reports': list(self.reports),
+        }
+
+    def _admit(self, reservation: MemoryReservation):
+        if tracemalloc.is_tracing() and not self._active:
+            tracemalloc.reset_peak()
+        self._active.add(reservation)
+        self.used += reservation.cost
+        self.admitted += 1
+
+    def _wake(self):
+        """Admit waiting requests in order while they fit into the budget"""
+        while self._waiters and self.used + self._waiters[0][0].cost <= self.limit:
+            reservation, future = self._waiters.popleft()
+            if future.done():
+                continue
+            self._admit(reservation)
+            future.set_result(reservation)
+
+
+class MemoryAdmissionMiddleware:
+    """
+    ASGI middleware admitting requests with a body through the memory budget before the body is read.
+
+    The reservation is available to the request handler in `current_reservation` and is released when
+    the response, including a streamed one, is sent. Requests of `exempt_routes` (admin endpoints diagnosing
+    an overloaded server) are not admitted through the budget.
+    """
+    methods: frozenset[str] = frozenset(('POST', 'PUT', 'PATCH'))
+
+    def __init__(self, app, budget: MemoryBudget, exempt_routes: Iterable[BaseRoute] = ()):
+        self.app = app
+        self.budget: MemoryBudget = budget
+        self.exempt_routes: tuple[BaseRoute, ...] = tuple(exempt_routes)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] not in self.methods or self._exempt(scope):
+            await self.app(scope, receive, send)
+            return
+        content_length: Optional[bytes] = dict(scope['headers']).get(b'content-length')
+        declared_size: Optional[int] = int(content_length) if content_length and content_length.isdigit() else None
+        try:
+            reservation: MemoryReservation = await self.budget.reserve(
+                f"{scope['method']} {scope['path']}", payload_cost(declared_size)
+            )
+        except ServerOverloadedException as e:
+            self.budget.logger.warning(f"{scope['method']} {scope['path']} rejected: {e.__doc__}. {e.args[0]}")
+            response = JSONResponse(
+                status_code=e.status_code, content={"detail": f"{e.__doc__}. {e.args[0]}"}, headers=e.headers
+            )
+            await response(scope, receive, send)
+            return
+
+        token = current_reservation.set(reservation)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_reservation.reset(token)
+            reservation.release()
+
+    def _exempt(self, scope) -> bool:
+        return any(route.matches(scope)[0] == Match.FULL for route in self.exempt_routes)
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import Any, Hashable, Optional
+
+from pydantic import BaseModel
+
+from .models import Base64File
+from .thermographs import LoggerReadings
+
+
+class LRUCache:
+    """
+    Thread safe least recently used cache limited by the total size of values in bytes.
+
+    Size of a value is its length unless given explicitly. Keeps hit/miss/eviction counters for monitoring.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size: int = max_size
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self._items: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item: Optional[tuple[Any, int]] = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value: Any, size: Optional[int] = None):
+        if size is None:
+            size = len(value)
+        if size > self.max_size:
+            return
+        with self._lock:
+            if key in self._items:
+                self.size -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            item: Optional[tuple[Any, int]] = self._items.pop(key, None)
+            if item is not None:
+                self.size -= item[1]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._items),
+                'size': self.size,
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def canonical_hash(value: Any) -> str:
+    """
+    SHA-256 of canonical JSON representation of a model, dict or list.
+
+    Keys are sorted and binary payloads (e.g. photos) are represented by hashes of their content.
+    """
+    if isinstance(value, BaseModel):
+        value = {'__model__': type(value).__name__, **value.dict()}
+    serialized: str = json.dumps(value, sort_keys=True, ensure_ascii=False, default=_canonical_default)
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+def _canonical_default(value: Any) -> Any:
+    if isinstance(value, (Base64File, LoggerReadings)):
+        return value.digest()
+    if isinstance(value, BytesIO):
+        return hashlib.sha256(value.getbuffer()).hexdigest()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
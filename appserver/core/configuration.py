@@ -9,8 +9,10 @@ import logging
 import logging.config
 
 from .exceptions import WrongDocumentTypeException
+from .logs import setup_queue_logging
 from .repository import AgentReportRepository
 from .document_daos import AbstractDocumentDAO
+from .storages import AbstractReportStorage, ShardedFileStorage, StorageCompactor
 
 
 class AgentReportRepositoryConfigurator:
@@ -29,8 +31,23 @@ class AgentReportRepositoryConfigurator:
             raise WrongDocumentTypeException
         return dao_class
 
+    @property
+    def storage(self) -> AbstractReportStorage:
+        return ShardedFileStorage(
+            settings.REPOSITORY.REPORTS_DIR,
+            extension=settings.DOC_TYPE,
+            shard_chars=settings.STORAGE.SHARD_CHARS,
+            compression_level=settings.STREAMING.COMPRESSION_LEVEL,
+            archive_preset=settings.STORAGE.ARCHIVE_PRESET
+        )
+
     def repository(self):
-        return AgentReportRepository(self.documents_dao)
+        storage: AbstractReportStorage = self.storage
+        if settings.STORAGE.ARCHIVE_AFTER_DAYS:
+            StorageCompactor(
+                storage, settings.STORAGE.ARCHIVE_AFTER_DAYS * 24 * 3600, settings.STORAGE.COMPACTION_INTERVAL
+            ).start()
+        return AgentReportRepository(self.documents_dao, storage)
 
     def __setup_logger(self, file_path: Optional[str]):
         if not file_path:
@@ -39,6 +56,11 @@ class AgentReportRepositoryConfigurator:
 
         if not os.path.exists(file_path):
             self.logger.warning(f"{file_path} does not exists. Logging configuration skipped.")
+            return
 
         with open(file_path) as f:
-            logging.config.dictConfig(toml.load(f))
+            config: dict = toml.load(f)
+        queue_config: Optional[dict] = config.pop('queue', None)
+        logging.config.dictConfig(config)
+        if queue_config is not None:
+            setup_queue_logging(**queue_config)
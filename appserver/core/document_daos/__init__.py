@@ -1,2 +1,4 @@
-from .abstract import AbstractDocumentDAO, Cell, Row, Column, Table, Style
+from .abstract import (
+    AbstractDocumentDAO, Cell, Row, Column, Table, TableGrid, Style, Fragment, DocumentStreamWriter, OptimizationReport
+)
 from .docx import DocxDocumentDAO
@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
-from typing import List, Iterator, BinaryIO, Final, Any
+from dataclasses import dataclass, field
+from typing import List, Iterator, BinaryIO, Final, Any, Optional
 
 
 class BaseAdapter(ABC):
@@ -56,6 +56,10 @@ class Table(ABC):
     def delete_row(self, row_number: int):
         ...
 
+    @abstractmethod
+    def reshape(self, rows_number: int, columns_number: int):
+        """Change the grid of the table keeping its width and height, all cells become copies of the first one"""
+
 
 @dataclass
 class Style:
@@ -68,6 +72,62 @@ class Style:
 DEFAULT_STYLE: Final[Style] = Style(alignment='center', italic=False, bold=True, font="Times New Roman")
 
 
+@dataclass
+class Fragment:
+    """Detached sequence of document body elements with pictures they refer to"""
+    elements: list[Any]
+    media: dict[str, bytes] = field(default_factory=dict)
+    size: int = 0
+
+
+@dataclass
+class TableGrid:
+    """
+    Texts of table cells placed on the grid of the table: `rows` hold indexes of `texts` by grid columns,
+    a cell merged horizontally or vertically has the same index in all its positions
+    """
+    texts: list[str]
+    rows: list[list[int]]
+
+
+@dataclass
+class OptimizationReport:
+    """
+    Result of document size optimization.
+
+    :param steps: number of changes made by each step of the optimization
+    :param skipped: steps which did not fit into the time budget
+    """
+    original_size: int
+    optimized_size: int
+    elapsed: float = 0.
+    steps: dict[str, int] = field(default_factory=dict)
+    skipped: list[str] = field(default_factory=list)
+
+
+class DocumentStreamWriter(ABC):
+    """
+    Append-only writer of a document into a stream.
+
+    Fragments appended to the end of the document are serialized at once and are not kept, so memory used
+    by the writer does not grow with the size of the document. The document is complete when the writer is closed.
+    """
+    @abstractmethod
+    def append_fragment(self, fragment: Fragment):
+        """Add a fragment to the end of the document"""
+
+    @abstractmethod
+    def close(self):
+        """Finish the document"""
+
+    def __enter__(self) -> 'DocumentStreamWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+
 class AbstractDocumentDAO(ABC):
     """Интерфейс класса доступа к документам"""
     def __init__(self, path: str):
@@ -81,6 +141,17 @@ class AbstractDocumentDAO(ABC):
     def save(self, doc_name: str):
         """Save document to storage"""
 
+    @abstractmethod
+    def write(self, stream: BinaryIO, compression_level: int = 6):
+        """Serialize document into a writable binary stream"""
+
+    @abstractmethod
+    def stream_writer(self, stream: BinaryIO, compression_level: int = 6) -> DocumentStreamWriter:
+        """
+        Writer serializing Doc into a writable binary stream with fragments appended to its end.
+        Content of Doc is moved into the writer, Doc must not be used afterwards.
+        """
+
     @abstractmethod
     def get_tables(self) -> Iterator[Table]:
         """Get list of tables of Doc"""
@@ -101,6 +172,21 @@ class AbstractDocumentDAO(ABC):
     def append_picture(self, picture: BinaryIO, height: float, width: float, alignment: str = 'center'):
         """Add a picture to the end of Doc"""
 
+    @abstractmethod
+    def detach_fragment(self, start: int = 0) -> Fragment:
+        """Remove body elements from `start` to the end of Doc and return them with pictures they refer to"""
+
+    @abstractmethod
+    def append_fragment(self, fragment: Fragment, bookmark: Optional[str] = None):
+        """Add copy of a fragment to the end of Doc, the copy is marked with a bookmark if its name is given"""
+
+    @abstractmethod
+    def replace_fragment(self, bookmark: str, fragment: Fragment) -> bool:
+        """
+        Replace body elements marked with a bookmark with copy of a fragment marked with the same bookmark,
+        False if Doc has no such bookmark
+        """
+
     @abstractmethod
     def add_page_break(self):
         """Add page break of Doc"""
@@ -113,11 +199,28 @@ class AbstractDocumentDAO(ABC):
     def get_page_size(self) -> tuple[float, float]:
         """"""
 
+    @classmethod
+    @abstractmethod
+    def read_pictures(cls, path: str) -> Iterator[tuple[str, bytes]]:
+        """Names and contents of pictures of a document file read without loading the document"""
+
+    @classmethod
+    @abstractmethod
+    def optimize(
+            cls, document: bytes, time_budget: float, compression_level: int = 9, workers: int = 4
+    ) -> tuple[bytes, OptimizationReport]:
+        """Smaller equivalent of a serialized document, made within `time_budget` seconds or the document itself"""
+
     @classmethod
     @abstractmethod
     def set_cell_style(cls, cell: Cell, style: Style = DEFAULT_STYLE):
         """Set table cell style shortcut"""
 
+    @classmethod
+    @abstractmethod
+    def get_table_grid(cls, table: Table) -> TableGrid:
+        """Texts and merges of table cells"""
+
     @classmethod
     @abstractmethod
     def insert_picture_into_cell(cls, cell: Cell, pic: BinaryIO, height: float, width: float):
@@ -1,12 +1,32 @@
-from typing import List, BinaryIO, Iterator
+import hashlib
+import re
+import shutil
+from copy import deepcopy
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from typing import Final, List, BinaryIO, Iterable, Iterator, Optional
+from zipfile import ZipFile, ZIP_DEFLATED
 
 import docx
-from docx.enum.table import WD_TABLE_ALIGNMENT
+from lxml import etree
+from docx.image.image import Image
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.oxml import CT_Relationships, serialize_part_xml
+from docx.opc.packuri import PackURI
+from docx.opc.pkgwriter import PackageWriter, _ContentTypesItem
+from docx.opc.spec import default_content_types
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
 from docx.enum.section import WD_ORIENTATION
-from docx.shared import Cm
+from docx.shared import Cm, Emu
+from docx.table import Table as PyDocxTable
 
-from .abstract import AbstractDocumentDAO, BaseAdapter, Table, Row, Column, Cell, Style, DEFAULT_STYLE
+from .abstract import (
+    AbstractDocumentDAO, BaseAdapter, Table, TableGrid, Row, Column, Cell, Style, Fragment, DocumentStreamWriter,
+    OptimizationReport, DEFAULT_STYLE
+)
+from .docx_optimizer import DocxOptimizer
 
 
 class DocxCellAdapter(Cell, BaseAdapter):
@@ -49,6 +69,14 @@ class DocxColumnAdapter(Column, BaseAdapter):
 
 class DocxTableAdapter(Table, BaseAdapter):
     """PyDocx table adapter class"""
+    def __deepcopy__(self, memo: dict):
+        """
+        Copy only the table element instead of the whole document the table belongs to.
+
+        The copy is bound to the source document until it is appended to another one.
+        """
+        return DocxTableAdapter(PyDocxTable(deepcopy(self._source._tbl, memo), self._source._parent))
+
     @property
     def columns(self) -> list[Column]:
         return [DocxColumnAdapter(column) for column in self._source.columns]
@@ -73,9 +101,182 @@ class DocxTableAdapter(Table, BaseAdapter):
         tr = self.rows[row_number]._source._tr
         tbl.remove(tr)
 
+    def reshape(self, rows_number: int, columns_number: int):
+        """Change the grid of the table keeping its width and height, all cells become copies of the first one"""
+        table: PyDocxTable = self._source
+        tbl = table._tbl
+        width: int = sum(column.width or 0 for column in table.columns)
+        height: int = sum(row.height or 0 for row in table.rows)
+        row_template = deepcopy(tbl.tr_lst[0])
+        for tc in row_template.tc_lst[1:]:
+            row_template.remove(tc)
+        for tr in tbl.tr_lst:
+            tbl.remove(tr)
+        for grid_column in tbl.tblGrid.gridCol_lst:
+            tbl.tblGrid.remove(grid_column)
+
+        for _ in range(columns_number):
+            tbl.tblGrid.add_gridCol().w = Emu(width // columns_number)
+        for _ in range(rows_number):
+            tr = deepcopy(row_template)
+            for _ in range(columns_number - 1):
+                tr.append(deepcopy(tr.tc_lst[0]))
+            tbl.append(tr)
+        for row in table.rows:
+            if height:
+                row.height = Emu(height // rows_number)
+            for cell in row.cells:
+                cell.width = Emu(width // columns_number)
+
+
+class DocxPackageStreamWriter:
+    """Physical package writer for PackageWriter with configurable zip compression level"""
+    def __init__(self, stream: BinaryIO, compression_level: int):
+        self._zipf = ZipFile(stream, 'w', compression=ZIP_DEFLATED, compresslevel=compression_level)
+
+    def write(self, pack_uri, blob: bytes):
+        self._zipf.writestr(pack_uri.membername, blob)
+
+    def open(self, pack_uri) -> BinaryIO:
+        """Writable file of a part for writing the part by chunks"""
+        return self._zipf.open(pack_uri.membername, 'w')
+
+    def close(self):
+        self._zipf.close()
+
+
+class DocxStreamWriter(DocumentStreamWriter):
+    """
+    Append-only writer of a .docx package into a stream.
+
+    All parts of the document except the main one are written to the package at once. Body elements are
+    serialized into a spooled file as fragments are appended, pictures of fragments are written straight into
+    the package (identical pictures once). The main document part and its relationships are written on close.
+    """
+    body_marker: Final[str] = 'streamed body'
+    namespace_declaration_pattern: Final[re.Pattern] = re.compile(rb'^<[^\s>/]+((?:\s+xmlns:\w+="[^"]*")+)')
+
+    def __init__(self, document: docx.Document, stream: BinaryIO, compression_level: int, spool_size: int = 1 << 24):
+        self._part = document.part
+        package = self._part.package
+        parts: list = list(package.parts)
+        for part in parts:
+            part.before_marshal()
+        self._writer = DocxPackageStreamWriter(stream, compression_level)
+        self._body = SpooledTemporaryFile(max_size=spool_size)
+        self._partnames: set[str] = {str(part.partname) for part in parts}
+        self._rels: dict[str, tuple[str, str]] = {}
+        self._images: dict[str, str] = {
+            hashlib.sha1(rel.target_part.blob).hexdigest(): rId
+            for rId, rel in self._part.rels.items() if rel.reltype == RT.IMAGE and not rel.is_external
+        }
+        self._next_id: int = self._part.next_id
+        self._root_namespaces: set[bytes] = {
+            f' xmlns:{prefix}="{uri}"'.encode() for prefix, uri in document.element.nsmap.items() if prefix
+        }
+
+        content_types = _ContentTypesItem.from_parts(parts)
+        for ext, content_type in default_content_types:
+            if content_type.startswith('image/'):
+                content_types._defaults[ext] = content_type
+        self._writer.write(PackURI('/[Content_Types].xml'), content_types.blob)
+        PackageWriter._write_pkg_rels(self._writer, package.rels)
+        PackageWriter._write_parts(self._writer, [part for part in parts if part is not self._part])
+
+        body = document.element.body
+        for element in [element for element in body.iterchildren() if element.tag != qn('w:sectPr')]:
+            self._body.write(self._serialize(element))
+            body.remove(element)
+        marker = etree.Comment(self.body_marker)
+        if body.sectPr is not None:
+            body.sectPr.addprevious(marker)
+        else:
+            body.append(marker)
+        self._prefix, self._suffix = serialize_part_xml(document.element).split(f'<!--{self.body_marker}-->'.encode())
+        body.remove(marker)
+
+    def append_fragment(self, fragment: Fragment):
+        rids: dict[str, str] = {rid: self._add_image(blob) for rid, blob in fragment.media.items()}
+        for element in fragment.elements:
+            self._next_id = _relink_element(element, rids, self._next_id)
+            self._body.write(self._serialize(element))
+
+    def close(self):
+        with self._writer.open(self._part.partname) as document_xml:
+            document_xml.write(self._prefix)
+            self._body.seek(0)
+            shutil.copyfileobj(self._body, document_xml)
+            document_xml.write(self._suffix)
+        self._body.close()
+
+        rels = CT_Relationships.new()
+        for rel in self._part.rels.values():
+            rels.add_rel(rel.rId, rel.reltype, rel.target_ref, rel.is_external)
+        for rId, (reltype, target_ref) in self._rels.items():
+            rels.add_rel(rId, reltype, target_ref, False)
+        self._writer.write(self._part.partname.rels_uri, rels.xml)
+        self._writer.close()
+
+    def _add_image(self, blob: bytes) -> str:
+        """Write a picture to the package unless it is there already, returns id of relationship to the picture"""
+        digest: str = hashlib.sha1(blob).hexdigest()
+        if digest not in self._images:
+            ext: str = Image.from_blob(blob).ext
+            number: int = 1
+            while f'/word/media/image{number}.{ext}' in self._partnames:
+                number += 1
+            partname = PackURI(f'/word/media/image{number}.{ext}')
+            self._partnames.add(partname)
+            self._writer.write(partname, blob)
+            rId: str = next(
+                f'rId{n}' for n in range(1, len(self._part.rels) + len(self._rels) + 2)
+                if f'rId{n}' not in self._part.rels and f'rId{n}' not in self._rels
+            )
+            self._rels[rId] = (RT.IMAGE, partname.relative_ref(self._part.partname.baseURI))
+            self._images[digest] = rId
+        return self._images[digest]
+
+    def _serialize(self, element) -> bytes:
+        """XML of a body element without namespace declarations already made by the document element"""
+        xml: bytes = etree.tostring(element, encoding='UTF-8', xml_declaration=False)
+        declarations = self.namespace_declaration_pattern.match(xml)
+        if not declarations:
+            return xml
+        kept: bytes = b''.join(
+            declaration for declaration in re.findall(rb'\s+xmlns:\w+="[^"]*"', declarations.group(1))
+            if b' ' + declaration.lstrip() not in self._root_namespaces
+        )
+        return xml[:declarations.start(1)] + kept + xml[declarations.end(1):]
+
+
+def _body_child(body, node):
+    """Element of the body containing the node"""
+    while node.getparent() is not body:
+        node = node.getparent()
+    return node
+
+
+def _relink_element(element, rids: dict[str, str], next_id: int) -> int:
+    """Point pictures of an element to relationships `rids` and renumber its drawings, returns the next drawing id"""
+    for node in element.iter(qn('a:blip')):
+        if node.get(qn('r:embed')) in rids:
+            node.set(qn('r:embed'), rids[node.get(qn('r:embed'))])
+    for doc_pr in element.iter(qn('wp:docPr')):
+        doc_pr.set('id', str(next_id))
+        if DocxDocumentDAO.picture_name_pattern.fullmatch(doc_pr.get('name', '')):
+            doc_pr.set('name', f'Picture {next_id}')
+        next_id += 1
+    return next_id
+
 
 class DocxDocumentDAO(AbstractDocumentDAO):
     """.docx documents access class"""
+    picture_name_pattern: Final[re.Pattern] = re.compile(r'Picture \d+')
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._bookmark_id: Optional[int] = None
+
     def load(self, path: str) -> docx.Document:
         """Load document form disc"""
         return docx.Document(path)
@@ -84,6 +285,20 @@ class DocxDocumentDAO(AbstractDocumentDAO):
         """Save document to storage"""
         self._document.save(doc_name)
 
+    def write(self, stream: BinaryIO, compression_level: int = 6):
+        """Serialize document into a writable binary stream, the stream is not required to be seekable"""
+        package = self._document.part.package
+        for part in package.parts:
+            part.before_marshal()
+        phys_writer = DocxPackageStreamWriter(stream, compression_level)
+        PackageWriter._write_content_types_stream(phys_writer, package.parts)
+        PackageWriter._write_pkg_rels(phys_writer, package.rels)
+        PackageWriter._write_parts(phys_writer, package.parts)
+        phys_writer.close()
+
+    def stream_writer(self, stream: BinaryIO, compression_level: int = 6) -> DocumentStreamWriter:
+        return DocxStreamWriter(self._document, stream, compression_level)
+
     def get_tables(self) -> Iterator[Table]:
         """Get list of tables of Doc"""
         for table in self._document.tables:
@@ -112,6 +327,126 @@ class DocxDocumentDAO(AbstractDocumentDAO):
         paragraph.alignment = getattr(WD_PARAGRAPH_ALIGNMENT, alignment.upper())
         paragraph.add_run().add_picture(picture, width=Cm(width), height=Cm(height))
 
+    def detach_fragment(self, start: int = 0) -> Fragment:
+        elements: list = self._body_elements()[start:]
+        for element in elements:
+            self._document.element.body.remove(element)
+        fragment: Fragment = self._fragment(elements)
+        self._drop_pictures(fragment.media)
+        return fragment
+
+    def _drop_pictures(self, rids: Iterable[str]):
+        """Pictures no longer referenced in Doc are dropped, so a reused scratch document does not accumulate them"""
+        part = self._document.part
+        referenced: set[str] = {node.get(qn('r:embed')) for node in part.element.iter(qn('a:blip'))}
+        dropped: list = []
+        for rid in rids:
+            if rid not in referenced:
+                dropped.append(part.related_parts[rid])
+                part.drop_rel(rid)
+        if dropped:
+            image_parts = part.package.image_parts
+            reachable: set = set(part.package.iter_parts())
+            for image_part in dropped:
+                if image_part in image_parts and image_part not in reachable:
+                    image_parts._image_parts.remove(image_part)
+
+    def _fragment(self, elements: list) -> Fragment:
+        media: dict[str, bytes] = {}
+        for element in elements:
+            for node in element.iter(qn('a:blip')):
+                rid = node.get(qn('r:embed'))
+                if rid and rid not in media:
+                    media[rid] = self._document.part.related_parts[rid].blob
+        size: int = sum(len(etree.tostring(element)) for element in elements) + sum(map(len, media.values()))
+        return Fragment(elements=elements, media=media, size=size)
+
+    def append_fragment(self, fragment: Fragment, bookmark: Optional[str] = None):
+        """
+        Add copy of a fragment to the end of Doc.
+
+        Pictures are added to the document the same way as by `append_picture`, drawing ids are renumbered,
+        so the result is the same as if the fragment elements were created in this document. The bookmark
+        is placed between body elements around the fragment.
+        """
+        body = self._document.element.body
+        elements: list = self._fragment_copy(fragment)
+        if bookmark is not None:
+            elements = self._bookmarked(elements, bookmark, self._next_bookmark_id())
+        for element in elements:
+            if body.sectPr is not None:
+                body.sectPr.addprevious(element)
+            else:
+                body.append(element)
+
+    def replace_fragment(self, bookmark: str, fragment: Fragment) -> bool:
+        """
+        Replace body elements marked with a bookmark with copy of a fragment.
+
+        Word may move bookmark marks between body elements into the neighbouring paragraphs or tables,
+        the body elements holding the marks are replaced then as well.
+        """
+        body = self._document.element.body
+        start = next(
+            (node for node in body.iter(qn('w:bookmarkStart')) if node.get(qn('w:name')) == bookmark), None
+        )
+        end = start is not None and next(
+            (node for node in body.iter(qn('w:bookmarkEnd')) if node.get(qn('w:id')) == start.get(qn('w:id'))), None
+        )
+        if start is None or end is None:
+            return False
+        children: list = list(body.iterchildren())
+        first: int = children.index(_body_child(body, start))
+        last: int = children.index(_body_child(body, end))
+        if last < first:
+            return False
+
+        elements: list = self._bookmarked(self._fragment_copy(fragment), bookmark, int(start.get(qn('w:id'))))
+        for element in children[first:last + 1]:
+            body.remove(element)
+        if last + 1 < len(children):
+            for element in elements:
+                children[last + 1].addprevious(element)
+        else:
+            body.extend(elements)
+        return True
+
+    def _fragment_copy(self, fragment: Fragment) -> list:
+        """Copy of fragment elements with pictures added to Doc and drawings renumbered"""
+        rids: dict[str, str] = {
+            rid: self._document.part.get_or_add_image(BytesIO(blob))[0] for rid, blob in fragment.media.items()
+        }
+        next_id: int = self._document.part.next_id
+        elements: list = []
+        for element in fragment.elements:
+            element = deepcopy(element)
+            next_id = _relink_element(element, rids, next_id)
+            elements.append(element)
+        return elements
+
+    @staticmethod
+    def _bookmarked(elements: list, bookmark: str, bookmark_id: int) -> list:
+        start = OxmlElement('w:bookmarkStart')
+        start.set(qn('w:id'), str(bookmark_id))
+        start.set(qn('w:name'), bookmark)
+        end = OxmlElement('w:bookmarkEnd')
+        end.set(qn('w:id'), str(bookmark_id))
+        return [start, *elements, end]
+
+    def _next_bookmark_id(self) -> int:
+        """Bookmark ids are unique in the document, the largest id is found once per loaded document"""
+        if self._bookmark_id is None:
+            self._bookmark_id = max(
+                (int(node.get(qn('w:id'))) for node in self._document.element.body.iter(qn('w:bookmarkStart'))
+                 if node.get(qn('w:id'), '').isdigit()),
+                default=0
+            )
+        self._bookmark_id += 1
+        return self._bookmark_id
+
+    def _body_elements(self) -> list:
+        return [element for element in self._document.element.body.iterchildren() if element.tag != qn('w:sectPr')]
+
     def add_page_break(self):
         self._document.add_page_break()
 
@@ -125,14 +460,48 @@ class DocxDocumentDAO(AbstractDocumentDAO):
         section = self._document.sections[-1]
         return section.page_height.cm, section.page_width.cm
 
+    @classmethod
+    def read_pictures(cls, path: str) -> Iterator[tuple[str, bytes]]:
+        """Names and contents of pictures of a document file read without loading the document"""
+        with ZipFile(path) as package:
+            for name in package.namelist():
+                if name.startswith('word/media/'):
+                    yield name[len('word/media/'):], package.read(name)
+
+    @classmethod
+    def optimize(
+            cls, document: bytes, time_budget: float, compression_level: int = 9, workers: int = 4
+    ) -> tuple[bytes, OptimizationReport]:
+        """
+        Smaller equivalent of a serialized .docx: run formatting folded into styles, unused parts, relationships
+        and styles dropped, media deduplicated and the package recompressed, see `DocxOptimizer`
+        """
+        return DocxOptimizer(time_budget, compression_level, workers).optimize(document)
+
     @classmethod
     def set_cell_style(cls, cell: Cell, style: Style = DEFAULT_STYLE):
         paragraph = next(cell.paragraphs)
-        paragraph.paragraph_format.alignment = getattr(WD_TABLE_ALIGNMENT, style.alignment.upper())
+        paragraph.paragraph_format.alignment = getattr(WD_PARAGRAPH_ALIGNMENT, style.alignment.upper())
         paragraph.runs[0].bold = style.bold
         paragraph.runs[0].italic = style.italic
         paragraph.runs[0].font.name = style.font
 
+    @classmethod
+    def get_table_grid(cls, table: BaseAdapter) -> TableGrid:
+        """Cells of the table are taken at once: python-docx resolves merges of the whole table for every row"""
+        cells: list = table._source._cells
+        columns: int = len(table._source.columns)
+        indexes: dict[int, int] = {}
+        texts: list[str] = []
+        for cell in cells:
+            if id(cell._tc) not in indexes:
+                indexes[id(cell._tc)] = len(texts)
+                texts.append(cell.text)
+        positions: list[int] = [indexes[id(cell._tc)] for cell in cells]
+        return TableGrid(
+            texts=texts, rows=[positions[start:start + columns] for start in range(0, len(cells), columns)]
+        )
+
     @classmethod
     def insert_picture_into_cell(cls, cell: Cell, pic: BinaryIO, height: float, width: float):
         next(cell.paragraphs).add_run().add_picture(pic, width=Cm(width), height=Cm(height))
@@ -0,0 +1,339 @@
+import hashlib
+import posixpath
+import re
+import time
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Callable, Final, Optional
+from urllib.parse import unquote
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
+
+from lxml import etree
+from docx.oxml.ns import nsmap, qn
+
+from .abstract import OptimizationReport
+
+
+RELATIONSHIPS_NS: Final[str] = 'http://schemas.openxmlformats.org/package/2006/relationships'
+CONTENT_TYPES_NS: Final[str] = 'http://schemas.openxmlformats.org/package/2006/content-types'
+CONTENT_TYPES_PART: Final[str] = '[Content_Types].xml'
+
+# Toggle properties of a character style are combined with the paragraph style instead of overriding it,
+# so they stay in direct formatting of runs
+TOGGLE_PROPERTIES: Final[frozenset[str]] = frozenset(qn(f'w:{name}') for name in (
+    'b', 'bCs', 'i', 'iCs', 'caps', 'smallCaps', 'strike', 'dstrike', 'outline', 'shadow', 'emboss', 'imprint', 'vanish'
+))
+STYLE_REFERENCES: Final[frozenset[str]] = frozenset(qn(f'w:{name}') for name in (
+    'pStyle', 'rStyle', 'tblStyle', 'numStyleLink', 'styleLink', 'clickAndTypeStyle', 'defaultTableStyle'
+))
+STYLE_LINKS: Final[tuple[str, ...]] = (qn('w:basedOn'), qn('w:next'), qn('w:link'))
+# Relationships which are needed only while the source part refers to their ids
+REFERENCED_RELATIONSHIPS: Final[frozenset[str]] = frozenset(('image', 'hyperlink'))
+
+
+class DocxOptimizer:
+    """
+    Size optimization of a serialized .docx package.
+
+    Steps are run in order while the time budget lasts, a step which does not fit into the budget is skipped:
+    identical media are kept once, relationships of pictures and hyperlinks nobody refers to and parts not
+    reachable from the package relationships are dropped, direct run formatting repeated in at least
+    `min_runs` runs is moved into hidden character styles and styles which are not used are dropped.
+    The package is repacked with entries compressed in parallel, entries which do not shrink are stored.
+    The original package is returned when the result is not smaller.
+    """
+    style_id_prefix: Final[str] = 'OptimizedRun'
+    story_pattern: Final[re.Pattern] = re.compile(r'word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml')
+
+    def __init__(self, time_budget: float, compression_level: int = 9, workers: int = 4, min_runs: int = 4):
+        self.time_budget: float = time_budget
+        self.compression_level: int = compression_level
+        self.workers: int = workers
+        self.min_runs: int = min_runs
+        self._deadline: float = 0.
+        self._parts: dict[str, bytes] = {}
+        self._infos: dict[str, ZipInfo] = {}
+        self._trees: dict[str, etree._Element] = {}
+
+    def optimize(self, document: bytes) -> tuple[bytes, OptimizationReport]:
+        started: float = time.monotonic()
+        self._deadline = started + self.time_budget
+        report = OptimizationReport(original_size=len(document), optimized_size=len(document))
+        with ZipFile(BytesIO(document)) as package:
+            self._infos = {info.filename: info for info in package.infolist()}
+            self._parts = {name: package.read(name) for name in self._infos}
+        self._trees = {}
+
+        steps: dict[str, Callable[[], int]] = {
+            'deduplicated_media': self._deduplicate_media,
+            'dropped_relationships': self._drop_unreferenced_relationships,
+            'dropped_parts': self._drop_unreachable_parts,
+            'folded_runs': self._fold_run_properties,
+            'dropped_styles': self._drop_unused_styles,
+        }
+        for name, step in steps.items():
+            if self._expired():
+                report.skipped.append(name)
+                continue
+            report.steps[name] = step()
+
+        if self._expired():
+            report.skipped.append('repack')
+        else:
+            optimized: bytes = self._repack()
+            if len(optimized) < len(document):
+                document = optimized
+        report.optimized_size = len(document)
+        report.elapsed = time.monotonic() - started
+        self._parts, self._infos, self._trees = {}, {}, {}
+        return document, report
+
+    def _expired(self) -> bool:
+        return time.monotonic() > self._deadline
+
+    def _xml(self, name: str) -> etree._Element:
+        """Parsed part, parts taken by this method are serialized again on repacking"""
+        if name not in self._trees:
+            self._trees[name] = etree.fromstring(
+                self._parts[name], etree.XMLParser(resolve_entities=False, huge_tree=True)
+            )
+        return self._trees[name]
+
+    def _remove_part(self, name: str):
+        self._parts.pop(name, None)
+        self._trees.pop(name, None)
+        self._parts.pop(_rels_name(name), None)
+        self._trees.pop(_rels_name(name), None)
+
+    def _relationships(self, external: bool = False) -> list[tuple[str, etree._Element]]:
+        """Source parts and relationships of all relationships parts of the package, external ones on demand"""
+        return [
+            (_source_part(name), relationship)
+            for name in list(self._parts) if name.endswith('.rels')
+            for relationship in self._xml(name).iter(f'{{{RELATIONSHIPS_NS}}}Relationship')
+            if external or relationship.get('TargetMode') != 'External'
+        ]
+
+    def _deduplicate_media(self) -> int:
+        kept: dict[str, str] = {}
+        duplicates: dict[str, str] = {}
+        for name, blob in self._parts.items():
+            if name.startswith('word/media/'):
+                duplicates[name] = kept.setdefault(hashlib.sha1(blob).hexdigest(), name)
+        duplicates = {name: original for name, original in duplicates.items() if name != original}
+        if not duplicates:
+            return 0
+        for source, relationship in self._relationships():
+            target: str = _resolve_target(source, relationship.get('Target'))
+            if target in duplicates:
+                relationship.set('Target', posixpath.relpath(duplicates[target], posixpath.dirname(source) or '.'))
+        for name in duplicates:
+            self._remove_part(name)
+        return len(duplicates)
+
+    def _drop_unreferenced_relationships(self) -> int:
+        dropped: int = 0
+        for source, relationship in self._relationships(external=True):
+            if relationship.get('Type', '').rsplit('/', 1)[-1] not in REFERENCED_RELATIONSHIPS:
+                continue
+            if source in self._parts and f'"{relationship.get("Id")}"'.encode() not in self._source_xml(source):
+                relationship.getparent().remove(relationship)
+                dropped += 1
+        return dropped
+
+    def _source_xml(self, name: str) -> bytes:
+        if name in self._trees:
+            return etree.tostring(self._trees[name])
+        return self._parts[name]
+
+    def _drop_unreachable_parts(self) -> int:
+        reachable: set[str] = set()
+        sources: list[str] = ['']
+        while sources:
+            source: str = sources.pop()
+            rels: str = _rels_name(source)
+            if rels not in self._parts:
+                continue
+            for relationship in self._xml(rels).iter(f'{{{RELATIONSHIPS_NS}}}Relationship'):
+                if relationship.get('TargetMode') == 'External':
+                    continue
+                target: str = _resolve_target(source, relationship.get('Target'))
+                if target not in reachable:
+                    reachable.add(target)
+                    sources.append(target)
+        unreachable: list[str] = [
+            name for name in self._parts
+            if name != CONTENT_TYPES_PART and not name.endswith('.rels') and name not in reachable
+        ]
+        for name in unreachable:
+            self._remove_part(name)
+        orphan_rels: list[str] = [
+            name for name in self._parts if name.endswith('.rels') and _source_part(name) not in {*self._parts, ''}
+        ]
+        for name in orphan_rels:
+            self._remove_part(name)
+
+        content_types: etree._Element = self._xml(CONTENT_TYPES_PART)
+        for override in list(content_types.iter(f'{{{CONTENT_TYPES_NS}}}Override')):
+            if override.get('PartName', '').lstrip('/') not in self._parts:
+                content_types.remove(override)
+        return len(unreachable)
+
+    def _fold_run_properties(self) -> int:
+        """Move non-toggle direct formatting repeated in runs into hidden character styles"""
+        if 'word/styles.xml' not in self._parts:
+            return 0
+        runs: dict[tuple, list[etree._Element]] = defaultdict(list)
+        for name in [name for name in self._parts if self.story_pattern.fullmatch(name)]:
+            for properties in self._xml(name).iter(qn('w:rPr')):
+                key: Optional[tuple] = _foldable_key(properties)
+                if key:
+                    runs[key].append(properties)
+
+        styles: etree._Element = self._xml('word/styles.xml')
+        style_ids: set[str] = {style.get(qn('w:styleId')) for style in styles.iter(qn('w:style'))}
+        number: int = 0
+        folded: int = 0
+        for key, properties_list in runs.items():
+            if len(properties_list) < self.min_runs:
+                continue
+            number += 1
+            while f'{self.style_id_prefix}{number}' in style_ids:
+                number += 1
+            style_id: str = f'{self.style_id_prefix}{number}'
+            styles.append(_character_style(style_id, properties_list[0]))
+            for properties in properties_list:
+                for child in list(properties):
+                    if child.tag not in TOGGLE_PROPERTIES:
+                        properties.remove(child)
+                properties.insert(0, etree.Element(qn('w:rStyle'), {qn('w:val'): style_id}))
+            folded += len(properties_list)
+        return folded
+
+    def _drop_unused_styles(self) -> int:
+        if 'word/styles.xml' not in self._parts:
+            return 0
+        used: set[str] = set()
+        for name in self._parts:
+            if name.startswith('word/') and name.endswith('.xml') and name != 'word/styles.xml':
+                used |= {
+                    element.get(qn('w:val'))
+                    for tag in STYLE_REFERENCES for element in self._story_references(name, tag)
+                }
+        styles: etree._Element = self._xml('word/styles.xml')
+        by_id: dict[str, etree._Element] = {style.get(qn('w:styleId')): style for style in styles.iter(qn('w:style'))}
+        pending: list[str] = [
+            style_id for style_id, style in by_id.items()
+            if style_id in used or style.get(qn('w:default')) in ('1', 'true')
+        ]
+        kept: set[str] = set()
+        while pending:
+            style_id: str = pending.pop()
+            if style_id in kept or style_id not in by_id:
+                continue
+            kept.add(style_id)
+            pending += [link.get(qn('w:val')) for tag in STYLE_LINKS for link in by_id[style_id].iter(tag)]
+        unused: list[etree._Element] = [style for style_id, style in by_id.items() if style_id not in kept]
+        for style in unused:
+            style.getparent().remove(style)
+        return len(unused)
+
+    def _story_references(self, name: str, tag: str) -> list[etree._Element]:
+        """Elements of a part with the tag, the part is not parsed when it has no such elements at all"""
+        if name not in self._trees and tag.rsplit('}', 1)[-1].encode() not in self._parts[name]:
+            return []
+        return list(self._xml(name).iter(tag))
+
+    def _repack(self) -> bytes:
+        for name, tree in self._trees.items():
+            if name in self._parts:
+                self._parts[name] = etree.tostring(tree, xml_declaration=True, encoding='UTF-8', standalone=True)
+        names: list[str] = [CONTENT_TYPES_PART] + [name for name in self._parts if name != CONTENT_TYPES_PART]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            entries: list[tuple[int, bytes]] = list(executor.map(self._compress, names))
+
+        output = BytesIO()
+        with ZipFile(output, 'w') as package:
+            for name, (compress_type, data) in zip(names, entries):
+                _write_compressed(package, self._infos[name], self._parts[name], compress_type, data)
+        return output.getvalue()
+
+    def _compress(self, name: str) -> tuple[int, bytes]:
+        """Raw deflate of a part, parts which do not shrink are stored. Fast compression after the deadline"""
+        data: bytes = self._parts[name]
+        level: int = 1 if self._expired() else self.compression_level
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, 9)
+        deflated: bytes = compressor.compress(data) + compressor.flush()
+        if len(deflated) < len(data):
+            return ZIP_DEFLATED, deflated
+        return ZIP_STORED, data
+
+
+def _rels_name(part: str) -> str:
+    """Relationships part of a part, '' is the package itself"""
+    directory, name = posixpath.split(part)
+    return posixpath.join(directory, '_rels', f'{name}.rels')
+
+
+def _source_part(rels: str) -> str:
+    directory, name = posixpath.split(rels)
+    return posixpath.join(posixpath.dirname(directory), name[:-len('.rels')])
+
+
+def _resolve_target(source: str, target: str) -> str:
+    target = unquote(target)
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join(posixpath.dirname(source), target))
+
+
+def _foldable_key(properties: etree._Element) -> Optional[tuple]:
+    """Key of non-toggle run properties of a run, None when the properties can not be moved into a style"""
+    if properties.getparent() is None or properties.getparent().tag != qn('w:r'):
+        return None
+    key: list[tuple] = []
+    for child in properties:
+        if not isinstance(child.tag, str) or len(child) or etree.QName(child).namespace != nsmap['w']:
+            return None
+        if child.tag in (qn('w:rStyle'), qn('w:rPrChange')):
+            return None
+        if child.tag not in TOGGLE_PROPERTIES:
+            key.append((child.tag, tuple(sorted(child.attrib.items()))))
+    return tuple(key) or None
+
+
+def _character_style(style_id: str, properties: etree._Element) -> etree._Element:
+    style = etree.Element(
+        qn('w:style'), {qn('w:type'): 'character', qn('w:customStyle'): '1', qn('w:styleId'): style_id}
+    )
+    etree.SubElement(style, qn('w:name'), {qn('w:val'): style_id})
+    etree.SubElement(style, qn('w:uiPriority'), {qn('w:val'): '99'})
+    etree.SubElement(style, qn('w:semiHidden'))
+    style_properties = etree.SubElement(style, qn('w:rPr'))
+    for child in properties:
+        if child.tag not in TOGGLE_PROPERTIES:
+            style_properties.append(etree.Element(child.tag, dict(child.attrib)))
+    return style
+
+
+def _write_compressed(package: ZipFile, original: ZipInfo, data: bytes, compress_type: int, compressed: bytes):
+    """
+    Add an entry compressed beforehand to a zip archive, the same way as ZipFile.write adds entries.
+    ZipFile has no public way to add compressed data, the archives are checked by tests/test_docx_optimizer.py
+    """
+    info = ZipInfo(original.filename, date_time=original.date_time)
+    info.external_attr = original.external_attr or 0o600 << 16
+    info.compress_type = compress_type
+    info.file_size = len(data)
+    info.compress_size = len(compressed)
+    info.CRC = zlib.crc32(data)
+    info.header_offset = package.fp.tell()
+    package._writecheck(info)
+    package._didModify = True
+    package.fp.write(info.FileHeader())
+    package.fp.write(compressed)
+    package.filelist.append(info)
+    package.NameToInfo[info.filename] = info
+    package.start_dir = package.fp.tell()
@@ -0,0 +1,191 @@
+import logging
+import sys
+import threading
+import uuid
+from dataclasses import dataclass
+from typing import Any, Optional, Type, Union
+
+from pydantic import BaseModel, ValidationError, parse_obj_as
+
+from .cache import LRUCache
+from .exceptions import DraftStateConflictException, DraftStateNotFoundException, ReportDataInvalidException
+from .json_patch import JsonPatchError, apply_patch
+from .models import BaseReport, TransportUnit
+
+
+@dataclass(frozen=True)
+class DraftState:
+    """Данные черновика: JSON клиента и проверенный по нему отчет, изменения создают новое состояние"""
+    draft_id: str
+    version: int
+    data: dict
+    report: BaseReport
+    units_sizes: tuple[int, ...]
+    size: int
+
+    def describe(self) -> dict:
+        return {'id': self.draft_id, 'version': self.version}
+
+
+class DraftStateStore:
+    """Данные черновиков в памяти сервера, изменяемые JSON Patch, повторно проверяются только измененные ТЕ"""
+
+    def __init__(self, models: list[Type[BaseReport]], max_size: int):
+        self.logger: logging.Logger = logging.getLogger("draft_states")
+        self.models: list[Type[BaseReport]] = models
+        self.states: LRUCache = LRUCache(max_size=max_size)
+        self._lock: threading.Lock = threading.Lock()
+
+    def create(self, data: Any) -> DraftState:
+        """
+        Состояние нового черновика, модель отчета - первая из `models`, которой соответствуют данные
+
+        :raises ReportDataInvalidException:
+        """
+        if not isinstance(data, dict):
+            raise ReportDataInvalidException('Отчет должен быть объектом')
+        report: BaseReport = _validated(lambda: parse_obj_as(Union[tuple(self.models)], data))
+        units: list = data.get('transport_units', [])
+        units_sizes: tuple[int, ...] = tuple(
+            _json_size(unit) + _model_size(parsed_unit) for unit, parsed_unit in zip(units, report.transport_units)
+        )
+        state = DraftState(
+            draft_id=uuid.uuid4().hex,
+            version=1,
+            data=data,
+            report=report,
+            units_sizes=units_sizes,
+            size=_report_size(data, report) + sum(units_sizes)
+        )
+        self.states.put(state.draft_id, state, size=state.size)
+        self.logger.info(f'Draft state {state.draft_id} of report "{report.number}" created, {state.size} bytes.')
+        return state
+
+    def get(self, draft_id: str) -> DraftState:
+        """
+        :raises DraftStateNotFoundException: состояние неизвестно или вытеснено из памяти
+        """
+        state: Optional[DraftState] = self.states.get(draft_id)
+        if state is None:
+            raise DraftStateNotFoundException(f'Черновик {draft_id}')
+        return state
+
+    def patch(self, draft_id: str, operations: list[dict], version: Optional[int] = None) -> DraftState:
+        """
+        Применение JSON Patch к данным черновика
+
+        :param version: версия состояния, для которой сделаны изменения, изменения другой версии отклоняются
+        :raises DraftStateNotFoundException:
+        :raises DraftStateConflictException: состояние другой версии
+        :raises ReportDataInvalidException: изменения не применимы или измененный отчет не проходит проверку
+        """
+        with self._lock:
+            state: DraftState = self.get(draft_id)
+            if version is not None and version != state.version:
+                raise DraftStateConflictException(f'Версия {state.version}, изменения сделаны для версии {version}')
+            units: list[Optional[TransportUnit]] = list(state.report.transport_units)
+            units_sizes: list[Optional[int]] = list(state.units_sizes)
+
+            def on_change(kind: str, path: list[str]):
+                if path and path[0] != 'transport_units':
+                    return
+                if len(path) < 2:
+                    units[:] = units_sizes[:] = []
+                    return
+                index: int = int(path[1])
+                if len(path) > 2 or kind == 'replace':
+                    units[index] = units_sizes[index] = None
+                elif kind == 'add':
+                    units.insert(index, None)
+                    units_sizes.insert(index, None)
+                else:
+                    del units[index], units_sizes[index]
+
+            try:
+                data: Any = apply_patch(state.data, operations, on_change)
+            except JsonPatchError as e:
+                raise ReportDataInvalidException(str(e))
+            patched: DraftState = self._validate(state, data, units, units_sizes)
+            self.states.put(draft_id, patched, size=patched.size)
+        return patched
+
+    def delete(self, draft_id: str):
+        self.states.discard(draft_id)
+
+    def stats(self) -> dict:
+        return self.states.stats()
+
+    def _validate(
+            self,
+            state: DraftState,
+            data: Any,
+            units: list[Optional[TransportUnit]],
+            units_sizes: list[Optional[int]]
+    ) -> DraftState:
+        """Состояние с измененными данными: проверяются измененные ТЕ, отчет собирается из проверенных ТЕ"""
+        model: Type[BaseReport] = type(state.report)
+        if not isinstance(data, dict) or not isinstance(data.get('transport_units'), list):
+            _validated(lambda: model.parse_obj(data))
+            raise ReportDataInvalidException('Отчет должен быть объектом со списком ТЕ')
+        raw_units: list = data['transport_units']
+        if len(units) != len(raw_units):
+            units = [None] * len(raw_units)
+            units_sizes = [None] * len(raw_units)
+        unit_model: Type[BaseModel] = model.__fields__['transport_units'].type_
+        for index, unit in enumerate(units):
+            if unit is None:
+                units[index] = _validated(lambda: unit_model.parse_obj(raw_units[index]), ('transport_units', index))
+                units_sizes[index] = _json_size(raw_units[index]) + _model_size(units[index])
+        report: BaseReport = _validated(lambda: model.parse_obj({**data, 'transport_units': units}))
+        return DraftState(
+            draft_id=state.draft_id,
+            version=state.version + 1,
+            data=data,
+            report=report,
+            units_sizes=tuple(units_sizes),
+            size=_report_size(data, report) + sum(units_sizes)
+        )
+
+
+def _validated(validate, location: tuple = ()) -> Any:
+    """
+    :raises ReportDataInvalidException: ошибки проверки с их расположением
+    """
+    try:
+        return validate()
+    except ValidationError as e:
+        raise ReportDataInvalidException('; '.join(
+            f"{'.'.join(str(key) for key in location + error['loc'] if key != '__root__')}: {error['msg']}"
+            for error in e.errors()
+        ))
+
+
+def _report_size(data: dict, report: BaseReport) -> int:
+    """Примерный размер данных отчета без ТЕ: JSON клиента и проверенная модель"""
+    return _json_size({**data, 'transport_units': []}) + _model_size({
+        name: value for name, value in report.__dict__.items() if name != 'transport_units'
+    })
+
+
+def _model_size(value: Any) -> int:
+    """Примерный размер объектов проверенной модели, строки общие с JSON клиента и не учитываются"""
+    if isinstance(value, BaseModel):
+        return sys.getsizeof(value) + _model_size(value.__dict__)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_model_size(item) for item in value.values())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(_model_size(item) for item in value)
+    if isinstance(value, str):
+        return 0
+    return sys.getsizeof(value)
+
+
+def _json_size(value: Any) -> int:
+    """Примерный размер JSON значения: почти весь размер занимают строки, в основном фотографии"""
+    if isinstance(value, str):
+        return len(value) + 2
+    if isinstance(value, dict):
+        return sum(len(key) + 4 + _json_size(item) for key, item in value.items()) + 2
+    if isinstance(value, list):
+        return sum(_json_size(item) + 1 for item in value) + 2
+    return 8
@@ -1,5 +1,10 @@
+from typing import Optional
+
+
 class AppException(Exception):
     """Базовое исключение приложения"""
+    status_code: int = 400
+    headers: Optional[dict[str, str]] = None
 
 
 class WrongDocumentTypeException(AppException):
@@ -16,3 +21,59 @@ class DocumentTemplateNotFoundException(AppException):
 
 class DocumentTemplateCorruptedException(AppException):
     """Шаблон документа поврежден"""
+
+
+class PhotoCorruptedException(AppException):
+    """Фотография повреждена или имеет неподдерживаемый формат"""
+
+
+class ReadingsCorruptedException(AppException):
+    """Показания датчика повреждены или имеют неподдерживаемый формат"""
+
+
+class ThumbnailNotFoundException(AppException):
+    """Миниатюра изображения не найдена"""
+    status_code: int = 404
+
+
+class ServerOverloadedException(AppException):
+    """Недостаточно памяти сервера для обработки запроса, повторите запрос позже"""
+    status_code: int = 503
+
+    def __init__(self, message: str = '', retry_after: int = 1):
+        super().__init__(message)
+        self.headers = {'Retry-After': str(retry_after)}
+
+
+class RequestsQueueFullException(ServerOverloadedException):
+    """Очередь запросов сервера заполнена, повторите запрос позже"""
+    status_code: int = 429
+
+
+class AdminAccessDeniedException(AppException):
+    """Доступ запрещен: неверный токен администратора"""
+    status_code: int = 403
+
+
+class ProfileNotFoundException(AppException):
+    """Профиль запроса не найден"""
+    status_code: int = 404
+
+
+class SectionNotFoundException(AppException):
+    """Раздел отчета не найден в черновике"""
+
+
+class DraftStateNotFoundException(AppException):
+    """Данные черновика не найдены на сервере, отправьте отчет целиком"""
+    status_code: int = 404
+
+
+class DraftStateConflictException(AppException):
+    """Данные черновика изменены другим запросом"""
+    status_code: int = 409
+
+
+class ReportDataInvalidException(AppException):
+    """Данные отчета не прошли проверку"""
+    status_code: int = 422
@@ -0,0 +1,177 @@
+from copy import copy, deepcopy
+from typing import Any, Callable, Optional, Union
+
+Container = Union[dict, list]
+
+
+class JsonPatchError(ValueError):
+    """Operation of a patch can not be applied to the document"""
+
+
+def parse_pointer(pointer: str) -> list[str]:
+    """
+    Reference tokens of a JSON Pointer (RFC 6901)
+
+    :raises JsonPatchError: not a JSON Pointer
+    """
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise JsonPatchError(f'"{pointer}" is not a JSON pointer')
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+
+def apply_patch(
+        document: Any,
+        operations: list[dict],
+        on_change: Optional[Callable[[str, list[str]], None]] = None
+) -> Any:
+    """
+    Apply operations of a JSON Patch (RFC 6902) and return the patched document, the document itself is not changed.
+
+    Only containers on paths of the operations are copied, the rest of the patched document is shared with
+    the original one, so the work is proportional to the patch and not to the document.
+    The patch is applied entirely or not at all.
+
+    :param on_change: called with the kind of change ('add', 'remove' or 'replace') and the path of every value
+        added, removed or replaced, in order; a move is a removal followed by an addition
+    :raises JsonPatchError: an operation is malformed, its path does not exist or its test fails
+    """
+    patched = _Patched(document)
+    notify: Callable[[str, list[str]], None] = on_change or (lambda kind, path: None)
+    for number, operation in enumerate(operations):
+        try:
+            _apply_operation(patched, operation, notify)
+        except JsonPatchError as e:
+            raise JsonPatchError(f'Operation {number}: {e}') from e
+    return patched.root
+
+
+class _Patched:
+    """Document being patched: containers are copied once on the first change under them"""
+
+    def __init__(self, document: Any):
+        self.root: Any = document
+        self._copies: list[Container] = []
+        self._copied_ids: set[int] = set()
+
+    def get(self, path: list[str]) -> Any:
+        value: Any = self.root
+        for token in path:
+            value = _child(value, token)
+        return value
+
+    def writable(self, path: list[str]) -> Container:
+        """Container at the path, copied together with containers above it if they are shared with the original"""
+        self.root = self._own(self.root)
+        container: Any = self.root
+        for token in path:
+            if not isinstance(container, (dict, list)):
+                raise JsonPatchError(f'"{token}" of a scalar value')
+            index: Union[str, int] = _index(container, token)
+            container[index] = self._own(container[index])
+            container = container[index]
+        if not isinstance(container, (dict, list)):
+            raise JsonPatchError('path of a scalar value')
+        return container
+
+    def _own(self, value: Any) -> Any:
+        if not isinstance(value, (dict, list)) or id(value) in self._copied_ids:
+            return value
+        value = copy(value)
+        self._copies.append(value)  # keeps ids of copies from being reused
+        self._copied_ids.add(id(value))
+        return value
+
+
+def _apply_operation(patched: _Patched, operation: dict, notify: Callable[[str, list[str]], None]):
+    if not isinstance(operation, dict):
+        raise JsonPatchError('an operation is not an object')
+    op: Any = operation.get('op')
+    path: list[str] = parse_pointer(_member(operation, 'path'))
+    if op == 'test':
+        if patched.get(path) != _member(operation, 'value'):
+            raise JsonPatchError(f'test of "{operation["path"]}" failed')
+    elif op == 'add':
+        _add(patched, path, deepcopy(_member(operation, 'value')), notify)
+    elif op == 'remove':
+        _remove(patched, path, notify)
+    elif op == 'replace':
+        value: Any = deepcopy(_member(operation, 'value'))
+        if not path:
+            patched.root = value
+        else:
+            patched.get(path)
+            container: Container = patched.writable(path[:-1])
+            container[_index(container, path[-1])] = value
+        notify('replace', path)
+    elif op in ('move', 'copy'):
+        source: list[str] = parse_pointer(_member(operation, 'from'))
+        if op == 'move' and path[:len(source)] == source and path != source:
+            raise JsonPatchError('a value can not be moved into itself')
+        if op == 'copy':
+            _add(patched, path, deepcopy(patched.get(source)), notify)
+        elif path != source:
+            _add(patched, path, _remove(patched, source, notify), notify)
+    else:
+        raise JsonPatchError(f'unknown operation "{op}"')
+
+
+def _add(patched: _Patched, path: list[str], value: Any, notify: Callable[[str, list[str]], None]):
+    if not path:
+        patched.root = value
+        notify('replace', path)
+        return
+    container: Container = patched.writable(path[:-1])
+    if isinstance(container, list):
+        index: int = len(container) if path[-1] == '-' else _list_index(container, path[-1], inclusive=True)
+        container.insert(index, value)
+        notify('add', path[:-1] + [str(index)])
+    else:
+        kind: str = 'replace' if path[-1] in container else 'add'
+        container[path[-1]] = value
+        notify(kind, path)
+
+
+def _remove(patched: _Patched, path: list[str], notify: Callable[[str, list[str]], None]) -> Any:
+    if not path:
+        raise JsonPatchError('the document can not be removed')
+    patched.get(path)
+    container: Container = patched.writable(path[:-1])
+    value: Any = container.pop(_index(container, path[-1]))
+    notify('remove', path)
+    return value
+
+
+def _member(operation: dict, name: str) -> Any:
+    if name not in operation:
+        raise JsonPatchError(f'"{name}" is missing')
+    return operation[name]
+
+
+def _child(value: Any, token: str) -> Any:
+    if isinstance(value, dict):
+        if token not in value:
+            raise JsonPatchError(f'no member "{token}"')
+        return value[token]
+    if isinstance(value, list):
+        return value[_list_index(value, token)]
+    raise JsonPatchError(f'"{token}" of a scalar value')
+
+
+def _index(container: Container, token: str) -> Union[str, int]:
+    if isinstance(container, list):
+        return _list_index(container, token)
+    if token not in container:
+        raise JsonPatchError(f'no member "{token}"')
+    return token
+
+
+def _list_index(container: list, token: str, inclusive: bool = False) -> int:
+    """Index of an array element, `inclusive` allows the index past the last element"""
+    if not (token.isascii() and token.isdigit()) or token != '0' and token.startswith('0'):
+        raise JsonPatchError(f'"{token}" is not an array index')
+    index: int = int(token)
+    if index > len(container) or index == len(container) and not inclusive:
+        raise JsonPatchError(f'index {index} is out of range')
+    return index
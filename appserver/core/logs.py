@@ -0,0 +1,201 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+
+
+class RequestContext:
+    """Data of the request being processed attached to log records: id, numbers of reports and stage durations"""
+
+    def __init__(self, request_id: str):
+        self.request_id: str = request_id
+        self.reports: list[str] = []
+        self.stages: dict[str, float] = {}
+        self.started: float = time.perf_counter()
+        self._lock: threading.Lock = threading.Lock()
+
+    def add_report(self, number: str):
+        if number not in self.reports:
+            self.reports.append(number)
+
+    def add_stage(self, name: str, duration: float):
+        """Stages run in several threads at once are summed up"""
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.) + duration
+
+    def stages_ms(self) -> dict[str, float]:
+        with self._lock:
+            return {name: round(duration * 1000, 1) for name, duration in self.stages.items()}
+
+
+current_request: ContextVar[Optional[RequestContext]] = ContextVar('current_request', default=None)
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach the request context to records in the thread logging them: the listener thread has no context"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context: Optional[RequestContext] = current_request.get()
+        record.request_id = context.request_id if context else ''
+        record.reports = list(context.reports) if context else []
+        record.stages = context.stages_ms() if context else {}
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep one of `rates[logger]` records of a logger (and its children) at `level` and below,
+    records of higher levels are always kept
+    """
+
+    def __init__(self, rates: Optional[dict[str, int]] = None, level: str = 'DEBUG'):
+        super().__init__()
+        self.rates: dict[str, int] = {name: max(1, int(rate)) for name, rate in (rates or {}).items()}
+        self.level: int = logging.getLevelName(level)
+        self._counters: dict[str, int] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.level or not self.rates:
+            return True
+        name: str = record.name
+        while name not in self.rates:
+            if '.' not in name:
+                return True
+            name = name.rsplit('.', 1)[0]
+        with self._lock:
+            count: int = self._counters.get(name, 0)
+            self._counters[name] = count + 1
+        return count % self.rates[name] == 0
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler which never waits: records are dropped when the queue is full, the number of dropped records
+    is reported by the next record written. The message is merged with arguments in the calling thread,
+    the traceback is formatted by the listener.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped: int = 0
+        self._dropped_lock: threading.Lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        with self._dropped_lock:
+            dropped: int = self.dropped
+            if dropped:
+                record.msg = f'{record.msg} [{dropped} log records dropped: log queue is full]'
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+                return
+            self.dropped -= dropped
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record with the request context attached by RequestContextFilter"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'location': f'{record.filename}:{record.lineno}',
+            'thread': record.threadName,
+        }
+        for key in ('request_id', 'reports', 'stages'):
+            value = getattr(record, key, None)
+            if value:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_queue_logging(size: int = 10000, sampling: Optional[dict] = None):
+    """
+    Move handlers of the root logger behind a queue: the calling thread only puts records into the queue,
+    a background listener thread writes them with the original handlers.
+
+    :param size: capacity of the queue, records are dropped when it is full
+    :param sampling: parameters of SamplingFilter: `rates` by logger names and `level`
+    """
+    global _listener
+    stop_queue_logging()
+    root: logging.Logger = logging.getLogger()
+    handlers: list[logging.Handler] = list(root.handlers)
+    log_queue: queue.Queue = queue.Queue(maxsize=size)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(**(sampling or {})))
+    queue_handler.addFilter(RequestContextFilter())
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_queue_logging():
+    """Write records left in the queue and stop the listener"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_queue_logging)
+
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware creating the request context, the id is taken from the X-Request-ID header or generated
+    and is returned in the same header. The end of every request is logged with its stage durations.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.logger: logging.Logger = logging.getLogger("requests")
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        request_id: str = dict(scope['headers']).get(b'x-request-id', b'').decode('latin-1')[:64] or uuid.uuid4().hex
+        context = RequestContext(request_id)
+        status: list[int] = [0]
+
+        async def send_with_id(message: dict):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+                message['headers'] = list(message.get('headers', [])) + [(b'x-request-id', request_id.encode())]
+            await send(message)
+
+        token = current_request.set(context)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            self.logger.info(
+                f"{scope['method']} {scope['path']} {status[0]} in {time.perf_counter() - context.started:.3f} s."
+            )
+            current_request.reset(token)
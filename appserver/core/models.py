@@ -1,23 +1,148 @@
 import datetime
+import hashlib
 import re
+from binascii import a2b_base64
 from io import BytesIO
-from base64 import b64decode
-from typing import List, Optional
+from typing import Any, Final, List, Optional
 from pydantic import BaseModel, validator
 
+from .exceptions import PhotoCorruptedException
+from .thermographs import LoggerReadings
+
+
+class Base64File:
+    """
+    Lazy file-like reference to a payload of base64 data URL.
+
+    Validation checks only the data URL header, the payload is decoded on first access to file methods.
+    The payload is kept as the string of the request, it is decoded by chunks for hashing and copied only
+    for decoding.
+    """
+    digest_chunk_size: Final[int] = 1 << 20
+    header_pattern: Final[re.Pattern] = re.compile(r"data:image/(\w+);base64,")
+
+    def __init__(self, source: str = '', offset: int = 0, image_type: str = ''):
+        self._source: str = source
+        self._offset: int = offset
+        self.image_type: str = image_type
+        self._file: Optional[BytesIO] = None
+        self._digest: Optional[str] = None
+
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+
+    @classmethod
+    def __modify_schema__(cls, field_schema: dict):
+        field_schema.update(type='string', format='data-url')
+
+    @classmethod
+    def validate(cls, value: Any) -> 'Base64File':
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, BytesIO):
+            file = cls()
+            file._file = value
+            return file
+        if not isinstance(value, str):
+            raise TypeError('base64 data URL string required')
+        header = cls.header_pattern.match(value)
+        if not header:
+            return cls()
+        return cls(value, header.end(), header.group(1))
+
+    @property
+    def file(self) -> BytesIO:
+        """
+        Decoded payload
+
+        :raises PhotoCorruptedException: the payload is not base64
+        """
+        if self._file is None:
+            self._file = BytesIO(self._decode(self._source[self._offset:]) if self._source else b'')
+        return self._file
+
+    def head(self, size: int) -> bytes:
+        """
+        At least `size` first bytes of the payload (or the whole payload) decoded without decoding the rest
+
+        :raises PhotoCorruptedException: the payload is not base64
+        """
+        if self._file is not None or not self._source:
+            return self.file.getbuffer()[:size].tobytes()
+        encoded_size: int = -(-size // 3) * 4
+        try:
+            return a2b_base64(self._source[self._offset:self._offset + encoded_size])
+        except ValueError:  # the slice is not aligned to base64 quanta when the payload has line breaks
+            return self.file.getbuffer()[:size].tobytes()
+
+    def release(self):
+        """Drop the decoded payload, it is decoded again on the next access"""
+        if self._source:
+            self._file = None
+
+    def digest(self) -> str:
+        """
+        SHA-256 of the decoded payload, the same for a data URL and a file of the same image.
+        The payload that is not base64 is hashed as text
+        """
+        if self._digest is None:
+            if self._file is not None or not self._source:
+                self._digest = hashlib.sha256(self.file.getbuffer()).hexdigest()
+            else:
+                self._digest = self._payload_digest()
+        return self._digest
+
+    def _payload_digest(self) -> str:
+        """SHA-256 of the payload decoded by chunks without keeping the decoded payload"""
+        digest = hashlib.sha256()
+        try:
+            for start in range(self._offset, len(self._source), self.digest_chunk_size):
+                digest.update(a2b_base64(self._source[start:start + self.digest_chunk_size]))
+            return digest.hexdigest()
+        except ValueError:  # chunks are not aligned to base64 quanta when the payload has line breaks
+            pass
+        try:
+            return hashlib.sha256(self._decode(self._source[self._offset:])).hexdigest()
+        except PhotoCorruptedException:
+            return hashlib.sha256(self._source[self._offset:].encode()).hexdigest()
+
+    @staticmethod
+    def _decode(payload: str) -> bytes:
+        try:
+            return a2b_base64(payload)
+        except ValueError as e:  # binascii.Error of malformed base64 and non-ASCII characters alike
+            raise PhotoCorruptedException('Данные фотографии не в формате base64') from e
+
+    def __deepcopy__(self, memo: dict) -> 'Base64File':
+        """Copy sharing the payload string of the request, the decoded payload is not copied"""
+        if not self._source:
+            return self.validate(BytesIO(self.file.getvalue()))
+        copy = Base64File(self._source, self._offset, self.image_type)
+        copy._digest = self._digest
+        return copy
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.file, name)
+
+    def __bool__(self) -> bool:
+        if self._file is not None:
+            return self._file.getbuffer().nbytes > 0
+        return len(self._source) > self._offset
+
+    def __str__(self) -> str:
+        return self._source
+
 
 class Photo(BaseModel):
     id: int
-    file: BytesIO
+    file: Base64File
     rotation: int = 0
 
     class Config:
-        arbitrary_types_allowed = True
-
-    @validator('file', pre=True)
-    def decode_base64_string_to_bytes(cls, value):
-        value = re.findall("data:image/\w+;base64,(.*)", value)
-        return BytesIO(b64decode(value[0]) if value else b'')
+        json_encoders = {Base64File: str}
 
 
 class FloatWithCustomStringification(float):
@@ -40,8 +165,12 @@ class ThermometerBoundaries(BaseModel):
 class ThermographData(ThermometerBoundaries):
     number: str
     graph: Optional[Photo]
+    readings: Optional[LoggerReadings] = None
     worked: str
 
+    class Config:
+        json_encoders = {LoggerReadings: str}
+
     @validator("worked")
     def set_worked_status(cls, value):
         statuses_mapping = {
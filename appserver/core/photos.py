@@ -0,0 +1,153 @@
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Final
+
+from more_itertools import chunked
+from PIL import Image, UnidentifiedImageError
+
+from .exceptions import PhotoCorruptedException
+from .models import Photo
+
+
+EXIF_ORIENTATION_TAG: Final[int] = 0x0112
+EXIF_ORIENTATION_TRANSPOSITIONS: Final[dict[int, tuple[int, ...]]] = {
+    2: (Image.FLIP_LEFT_RIGHT,),
+    3: (Image.ROTATE_180,),
+    4: (Image.FLIP_TOP_BOTTOM,),
+    5: (Image.TRANSPOSE,),
+    6: (Image.ROTATE_270,),
+    7: (Image.TRANSVERSE,),
+    8: (Image.ROTATE_90,),
+}
+CLOCKWISE_ROTATION_TRANSPOSITIONS: Final[dict[int, tuple[int, ...]]] = {
+    90: (Image.ROTATE_270,),
+    180: (Image.ROTATE_180,),
+    270: (Image.ROTATE_90,),
+}
+AXES_SWAPPING_TRANSPOSITIONS: Final[set[int]] = {Image.ROTATE_90, Image.ROTATE_270, Image.TRANSPOSE, Image.TRANSVERSE}
+
+PHOTOS_GRIDS: Final[dict[str, tuple[int, int]]] = {
+    'landscape': (2, 2),
+    'portrait': (1, 2),
+    'thumbnail': (3, 3),
+}
+
+
+@dataclass
+class PhotoInfo:
+    """
+    Photo dimensions read from the image header.
+
+    `width` and `height` are dimensions of the upright photo: after EXIF orientation and user rotation
+    are applied by `transpositions`.
+    """
+    photo: Photo
+    width: int
+    height: int
+    transpositions: tuple[int, ...] = ()
+    kind: str = 'landscape'
+
+
+@dataclass
+class PhotosPage:
+    """Photos placed on one page in a table of `rows` x `columns` cells"""
+    rows: int
+    columns: int
+    photos: list[PhotoInfo]
+
+
+def probe_photo(photo: Photo, header_size: int, thumbnail_max_side: int) -> PhotoInfo:
+    """
+    Read dimensions and EXIF orientation of a photo without decoding pixels.
+
+    Only the first `header_size` bytes of the payload are decoded from base64 when they hold the whole header.
+    """
+    try:
+        try:
+            image = Image.open(BytesIO(photo.file.head(header_size)))
+        except (UnidentifiedImageError, OSError, SyntaxError):
+            image = Image.open(photo.file.file)
+        width, height = image.size
+        orientation: int = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    except (UnidentifiedImageError, OSError, SyntaxError) as e:
+        raise PhotoCorruptedException(f"Фото {photo.id}") from e
+
+    transpositions: tuple[int, ...] = EXIF_ORIENTATION_TRANSPOSITIONS.get(orientation, ()) + \
+        CLOCKWISE_ROTATION_TRANSPOSITIONS.get(photo.rotation % 360, ())
+    if _swaps_axes(transpositions):
+        width, height = height, width
+    if max(width, height) < thumbnail_max_side:
+        kind: str = 'thumbnail'
+    else:
+        kind = 'portrait' if height > width else 'landscape'
+    return PhotoInfo(photo, width, height, transpositions, kind)
+
+
+def _swaps_axes(transpositions: tuple[int, ...]) -> bool:
+    return sum(transposition in AXES_SWAPPING_TRANSPOSITIONS for transposition in transpositions) % 2 == 1
+
+
+def plan_photos_pages(photos: list[PhotoInfo]) -> list[PhotosPage]:
+    """
+    Distribute photos among pages.
+
+    Landscape photos are placed 2 x 2, portrait ones 1 x 2 and small ones 3 x 3 per page, keeping the order
+    of photos of each kind. Incomplete last pages of different kinds are merged into one 2 x 2 page when it fits.
+    """
+    pages: list[PhotosPage] = []
+    leftovers: list[list[PhotoInfo]] = []
+    for kind, (rows, columns) in PHOTOS_GRIDS.items():
+        photos_of_kind: list[PhotoInfo] = [photo for photo in photos if photo.kind == kind]
+        chunks: list[list[PhotoInfo]] = list(chunked(photos_of_kind, rows * columns))
+        if chunks and len(chunks[-1]) < rows * columns:
+            leftovers.append(chunks.pop())
+        pages += [PhotosPage(rows, columns, chunk) for chunk in chunks]
+
+    merged: list[PhotoInfo] = [photo for chunk in leftovers for photo in chunk]
+    if len(leftovers) > 1 and len(merged) <= 4:
+        pages.append(PhotosPage(2, 2, merged))
+    else:
+        pages += [PhotosPage(*PHOTOS_GRIDS[chunk[0].kind], chunk) for chunk in leftovers]
+    return pages
+
+
+def render_photo(info: PhotoInfo, width: float, height: float, dpi: int, quality: int) -> tuple[BytesIO, float, float]:
+    """
+    Fit the upright photo into a box of `width` x `height` cm preserving the aspect ratio.
+
+    The photo is resampled once to the box size at `dpi` (never enlarged: small photos are stretched by
+    the document), JPEG photos are decoded already downscaled by the decoder. Rotations are applied
+    to the resampled pixels, as they do not require resampling.
+
+    :return: image file, its width and height in cm
+    :raises PhotoCorruptedException: the photo can not be decoded
+    """
+    scale: float = min(width / info.width, height / info.height)
+    display_width, display_height = info.width * scale, info.height * scale
+    pixels_scale: float = min(1., display_width / 2.54 * dpi / info.width)
+    target: tuple[int, int] = (
+        max(1, round(info.width * pixels_scale)), max(1, round(info.height * pixels_scale))
+    )
+    source_target: tuple[int, int] = target[::-1] if _swaps_axes(info.transpositions) else target
+
+    try:
+        image = Image.open(info.photo.file.file)
+        if image.format == 'JPEG':
+            image.draft('RGB', source_target)
+        transparent: bool = 'A' in image.getbands() or 'transparency' in image.info
+        image = image.convert('RGBA' if transparent else 'RGB')
+    except (UnidentifiedImageError, OSError, SyntaxError) as e:
+        raise PhotoCorruptedException(f"Фото {info.photo.id}") from e
+    if image.size != source_target:
+        image = image.resize(source_target, Image.LANCZOS, reducing_gap=3.)
+    for transposition in info.transpositions:
+        image = image.transpose(transposition)
+
+    picture = BytesIO()
+    if transparent:
+        image.save(picture, format='PNG', optimize=True)
+    else:
+        image.save(picture, format='JPEG', quality=quality)
+    picture.seek(0)
+    return picture, display_width, display_height
+
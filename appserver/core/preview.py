@@ -0,0 +1,288 @@
+import html
+from typing import Any, Callable, Optional, Type
+
+import numpy as np
+
+from .cache import LRUCache
+from .document_daos import AbstractDocumentDAO, TableGrid
+from .exceptions import DocumentTemplateCorruptedException, PhotoCorruptedException, ThumbnailNotFoundException
+from .models import BaseReport, Photo, TransportUnit, ThermographData
+from .report_sections import Section
+from .report_strategies import ReportSectionsMixin
+from .template_compiler import CompiledTemplate
+from .template_engine import TemplateEngine
+from .templates import TemplatesCache
+from .thumbnails import ThumbnailsCache
+
+STYLE: str = """
+body { font-family: "Times New Roman", serif; font-size: 12px; }
+table { border-collapse: collapse; width: 100%; margin: 8px 0; }
+td { border: 1px solid #444; padding: 2px 4px; text-align: center; vertical-align: middle; }
+.page-break { border: 0; border-top: 1px dashed #999; margin: 16px 0; }
+.justify td { text-align: justify; }
+.images { display: flex; flex-wrap: wrap; gap: 8px; }
+.images img { max-width: 320px; max-height: 320px; }
+"""
+
+
+class PreviewCell:
+    __slots__ = ('text',)
+
+    def __init__(self, text: str):
+        self.text: str = text
+
+
+class PreviewTable:
+    """Таблица шаблона по ее сетке, объединенная ячейка - один объект во всех своих позициях, как в python-docx"""
+
+    def __init__(self, grid: TableGrid):
+        cells: list[PreviewCell] = [PreviewCell(text) for text in grid.texts]
+        self.rows: list[list[PreviewCell]] = [[cells[index] for index in row] for row in grid.rows]
+
+    def add_row(self, texts: list[str]) -> list[PreviewCell]:
+        """Строка из отдельных ячеек, как строки, добавленные в таблицы документов"""
+        row: list[PreviewCell] = [PreviewCell(text) for text in texts]
+        self.rows.append(row)
+        return row
+
+    def delete_row(self, number: int):
+        del self.rows[number]
+
+    def replace(self, values: dict):
+        for cell in {id(cell): cell for row in self.rows for cell in row if '{{' in cell.text}.values():
+            cell.text = TemplateEngine.replace_text(cell.text, values)
+
+    def html(self, css_class: str = '') -> str:
+        rows: list[str] = []
+        emitted: set[int] = set()
+        for number, row in enumerate(self.rows):
+            cells: list[str] = []
+            column: int = 0
+            while column < len(row):
+                cell: PreviewCell = row[column]
+                colspan: int = 1
+                while column + colspan < len(row) and row[column + colspan] is cell:
+                    colspan += 1
+                if id(cell) not in emitted:
+                    emitted.add(id(cell))
+                    rowspan: int = 1
+                    while number + rowspan < len(self.rows) and column < len(self.rows[number + rowspan]) and \
+                            self.rows[number + rowspan][column] is cell:
+                        rowspan += 1
+                    spans: str = (f' colspan="{colspan}"' if colspan > 1 else '') + \
+                                 (f' rowspan="{rowspan}"' if rowspan > 1 else '')
+                    cells.append(f'<td{spans}>{_text(cell.text) if cell.text else ""}</td>')
+                column += colspan
+            rows.append(f"<tr>{''.join(cells)}</tr>")
+        return f'<table{f" class={chr(34)}{css_class}{chr(34)}" if css_class else ""}>{"".join(rows)}</table>'
+
+
+class SectionsReportPreview(ReportSectionsMixin):
+    """HTML-просмотр отчета из разделов по результатам компиляции шаблонов, без документов шаблонов"""
+    renderers: dict[str, str] = {
+        'rows': 'preview_rows_table',
+        'static': 'preview_static_table',
+        'values': 'preview_values_table',
+        'tally_account': 'preview_tally_account_and_pallets_tables',
+        'cargo_tables': 'preview_cargo_tables',
+        'thermographs': 'preview_pictures_of_thermographs',
+        'letter_of_protest': 'preview_letter_of_protest',
+    }
+
+    def __init__(
+            self,
+            document_dao: Type[AbstractDocumentDAO],
+            report: BaseReport,
+            templates: Optional[TemplatesCache],
+            thumbnails: ThumbnailsCache,
+            images: LRUCache,
+            thumbnails_url: str,
+            thumbnail_size: int = 320,
+            sections: Optional[list[Section]] = None
+    ):
+        super().__init__(document_dao, report, templates, sections=sections)
+        self.thumbnails: ThumbnailsCache = thumbnails
+        self.images: LRUCache = images
+        self.thumbnails_url: str = thumbnails_url
+        self.thumbnail_size: int = thumbnail_size
+        self._report_values: Optional[dict] = None
+        self._units_values: dict[int, dict] = {}
+        self._grids: dict[str, list[TableGrid]] = {}
+
+    def render_html(self) -> str:
+        """HTML-документ отчета: заголовок, разделы в порядке вывода и фотографии ТЕ"""
+        parts: list[str] = [
+            '<!DOCTYPE html><html><head><meta charset="utf-8">',
+            f'<title>{_text(self.report.number)}</title><style>{STYLE}</style></head><body>',
+        ]
+        header: PreviewTable = self._preview_table('header_template', 0)
+        header_values: dict = self.header_values()
+        for number, row in reversed(list(enumerate(header.rows))):
+            row_keys: set[str] = {
+                key[2:-2].strip().split('.')[0] for cell in row for key in TemplateEngine.key_pattern.findall(cell.text)
+            }
+            if row_keys - header_values.keys():
+                header.delete_row(number)
+        header.replace(header_values)
+        parts.append(f'<section data-section="header">{header.html()}</section>')
+
+        for section, scope in self._sections_scopes():
+            render: Callable[[list[str], Section, Any], None] = getattr(self, self.renderers[section.renderer])
+            section_parts: list[str] = []
+            render(section_parts, section, scope)
+            if section.page_break:
+                section_parts.append('<hr class="page-break">')
+            parts.append(f'<section data-section="{_text(section.name)}">{"".join(section_parts)}</section>')
+
+        for unit in self.report.transport_units:
+            photos: list[Photo] = [photo for photo in unit.photos if photo.file]
+            if photos:
+                images: str = ''.join(self._thumbnail_html(photo) for photo in photos)
+                parts.append(
+                    f'<section data-section="photos"><hr class="page-break"><p>{_text(unit.number)}</p>'
+                    f'<div class="images">{images}</div></section>'
+                )
+        parts.append('</body></html>')
+        return ''.join(parts)
+
+    def preview_rows_table(self, parts: list[str], section: Section, scope: Any):
+        table: PreviewTable = self._preview_table(section.template, section.table)
+        self._fill_rows(table, self._units(scope))
+        parts.append(table.html())
+
+    def preview_static_table(self, parts: list[str], section: Section, scope: Any):
+        parts.append(self._preview_table(section.template, section.table).html())
+
+    def preview_values_table(self, parts: list[str], section: Section, scope: Any):
+        table: PreviewTable = self._preview_table(section.template, section.table)
+        table.replace(self._unit_values(scope) if isinstance(scope, TransportUnit) else self._values())
+        parts.append(table.html())
+
+    def preview_tally_account_and_pallets_tables(self, parts: list[str], section: Section, scope: Any):
+        for container in self._units(scope):
+            values: dict = self._unit_values(container)
+            pallets_table: PreviewTable = self._preview_table(section.template, 0)
+            pallets_table.replace(values)
+            tally_account_table: PreviewTable = self._preview_table(section.template, 1)
+            last_row_texts: list[str] = [cell.text for cell in tally_account_table.rows[-1]]
+            tally_account_table.delete_row(-1)
+            for num in range(2, container.pallets + 1):
+                tally_account_table.add_row([str(num)] + [''] * (len(last_row_texts) - 1))
+            tally_account_table.add_row(last_row_texts)
+            tally_account_table.replace(values)
+            parts += [pallets_table.html(), tally_account_table.html(), '<hr class="page-break">']
+
+    def preview_cargo_tables(self, parts: list[str], section: Section, scope: Any):
+        cargos_in_template: list[str] = self._get_template_cargos(section.template)
+        for cargo, containers in [scope] if scope is not None else self._cargos_scopes():
+            for number in self.cargo_tables_numbers(section, cargos_in_template, cargo):
+                table: PreviewTable = self._preview_table(section.template, number)
+                self._fill_rows(table, containers)
+                parts.append(table.html())
+
+    def preview_pictures_of_thermographs(self, parts: list[str], section: Section, scope: Any):
+        for container in self._units(scope):
+            parts.append('<hr class="page-break">')
+            for thermograph in container.temperature.thermographs:
+                parts.append(f'<p>{_text(f"Контейнер: {container.number}")}<br>'
+                             f'{_text(f"Номер датчика:{thermograph.number}")}</p>')
+                if thermograph.graph:
+                    parts.append(f'<div class="images">{self._thumbnail_html(thermograph.graph)}</div>')
+                elif thermograph.readings:
+                    parts.append(self._chart_svg(thermograph, container))
+
+    def preview_letter_of_protest(self, parts: list[str], section: Section, scope: Any):
+        values: Optional[dict] = self.letter_of_protest_values(self._units(scope))
+        if values is None:
+            return
+        table: PreviewTable = self._preview_table(section.template, section.table)
+        table.replace(values)
+        parts += ['<hr class="page-break">', table.html('justify')]
+
+    def _preview_table(self, template_name: str, number: int) -> PreviewTable:
+        """Таблица шаблона из результата компиляции, из самого шаблона, если он изменился"""
+        if template_name not in self._grids:
+            path: str = self._template_path(template_name)
+            compiled: Optional[CompiledTemplate] = self.templates.compiled(path) if self.templates else None
+            self._grids[template_name] = compiled.grids if compiled else [
+                self.document_dao.get_table_grid(table) for table in self._get_tables_from_template(template_name)
+            ]
+        grids: list[TableGrid] = self._grids[template_name]
+        if number >= len(grids):
+            raise DocumentTemplateCorruptedException(f'Отсутствует таблица {number + 1} шаблона {template_name}')
+        return PreviewTable(grids[number])
+
+    def _fill_rows(self, table: PreviewTable, containers: list[TransportUnit]):
+        """Последняя строка таблицы заполняется для первой ТЕ и копируется для остальных"""
+        last_row_texts: list[str] = [cell.text for cell in table.rows[-1]]
+        first_values: dict = self._unit_values(containers[0]) if containers else {}
+        for cell in {id(cell): cell for cell in table.rows[-1]}.values():
+            cell.text = TemplateEngine.replace_text(cell.text, first_values)
+        for container in containers[1:]:
+            values: dict = self._unit_values(container)
+            table.add_row([TemplateEngine.replace_text(text, values) for text in last_row_texts])
+        table.replace(self._values())
+
+    def _values(self) -> dict:
+        if self._report_values is None:
+            self._report_values = self.report.dict(exclude={'transport_units': {'__all__': {'photos'}}})
+        return self._report_values
+
+    def _unit_values(self, unit: TransportUnit) -> dict:
+        if id(unit) not in self._units_values:
+            self._units_values[id(unit)] = unit.dict(exclude={'photos'})
+        return self._units_values[id(unit)]
+
+    def _thumbnail_html(self, photo: Photo) -> str:
+        """Миниатюра фотографии, фотография декодируется только при первом просмотре"""
+        digest: str = photo.file.digest()
+        key: Optional[str] = self.images.get(('thumbnail', digest))
+        try:
+            if key is not None:
+                self.thumbnails.get(key, self.thumbnail_size, self.thumbnails.formats[0])
+        except ThumbnailNotFoundException:
+            key = None
+        if key is None:
+            try:
+                key = self.thumbnails.add(photo.file.getvalue())
+            except PhotoCorruptedException:
+                return f'<p>{_text(PhotoCorruptedException.__doc__)}</p>'
+            finally:
+                photo.file.release()
+            self.images.put(('thumbnail', digest), key, size=len(key))
+        rotation: str = f' style="transform: rotate({photo.rotation}deg)"' if photo.rotation % 360 else ''
+        return f'<img src="{self.thumbnails_url}/{key}?size={self.thumbnail_size}&amp;format=' \
+               f'{self.thumbnails.formats[0]}" loading="lazy" alt=""{rotation}>'
+
+    def _chart_svg(self, thermograph: ThermographData, container: TransportUnit) -> str:
+        """График показаний датчика в SVG с границами рекомендуемой температуры"""
+        recommended: float = float(container.temperature.recommended)
+        key: tuple = ('chart', thermograph.readings.digest(), recommended)
+        svg: Optional[str] = self.images.get(key)
+        if svg is not None:
+            return svg
+        times, values, _ = self._analyze_readings(thermograph, container.temperature)
+        width, height = 600, 200
+        lower, upper = recommended - 2, recommended + 2
+        low: float = min(float(np.min(values)), lower - 1) if len(values) else lower - 1
+        high: float = max(float(np.max(values)), upper + 1) if len(values) else upper + 1
+        start, end = (float(times[0]), float(times[-1])) if len(times) else (0., 1.)
+
+        def x(moment: float) -> str:
+            return f'{(moment - start) / ((end - start) or 1.) * width:.1f}'
+
+        def y(value: float) -> str:
+            return f'{(high - value) / (high - low) * height:.1f}'
+
+        points: str = ' '.join(f'{x(moment)},{y(value)}' for moment, value in zip(times.tolist(), values.tolist()))
+        svg = f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" width="{width}" ' \
+              f'height="{height}"><title>{_text(thermograph.number)}</title>' + ''.join(
+                  f'<line x1="0" x2="{width}" y1="{y(bound)}" y2="{y(bound)}" stroke="#c00" stroke-dasharray="4"/>'
+                  for bound in (lower, upper)
+              ) + f'<polyline fill="none" stroke="#036" points="{points}"/></svg>'
+        self.images.put(key, svg)
+        return svg
+
+
+def _text(text: str) -> str:
+    return html.escape(str(text)).replace('\n', '<br>')
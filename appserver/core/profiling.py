@@ -0,0 +1,278 @@
+import asyncio
+import contextvars
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Callable, Final, Iterator, Optional
+
+from .exceptions import ProfileNotFoundException
+from .logs import RequestContext, current_request
+
+
+current_capture: ContextVar[Optional['ProfileCapture']] = ContextVar('current_capture', default=None)
+
+
+# Stages are entered by a thread or, in a thread running an event loop, by a task of the loop
+StagesKey = tuple[int, Optional[asyncio.Task]]
+
+
+class ProfileCapture:
+    """Samples of stacks of threads working on one request, grouped by stage"""
+
+    def __init__(self, profiler: 'SamplingProfiler', name: str, slower_than: Optional[float] = None):
+        self.profiler: SamplingProfiler = profiler
+        self.name: str = name
+        self.slower_than: Optional[float] = slower_than
+        self.reports: list[str] = []
+        self.samples: Counter[tuple[str, ...]] = Counter()
+        self.started: float = time.monotonic()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Attribute samples of the current thread or task to a stage of the request being profiled and add duration
+    of the stage to the request context of logs. Stages may be nested
+    """
+    capture: Optional[ProfileCapture] = current_capture.get()
+    context: Optional[RequestContext] = current_request.get()
+    if capture is None and context is None:
+        yield
+        return
+    entry: Optional[tuple[ProfileCapture, str]] = capture.profiler.enter(capture, name) if capture else None
+    started: float = time.perf_counter()
+    try:
+        yield
+    finally:
+        if entry is not None:
+            capture.profiler.leave(entry)
+        if context is not None:
+            context.add_stage(name, time.perf_counter() - started)
+
+
+def tag_report(number: str):
+    """Tag the request being profiled and its logs with the number of a report it works on"""
+    capture: Optional[ProfileCapture] = current_capture.get()
+    if capture is not None and number not in capture.reports:
+        capture.reports.append(number)
+    context: Optional[RequestContext] = current_request.get()
+    if context is not None:
+        context.add_report(number)
+
+
+def with_context(function: Callable) -> Callable:
+    """
+    The function running in a copy of the current context: threads do not inherit context variables,
+    so the request being profiled and the request context of logs are passed to them this way
+    """
+    context: contextvars.Context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(function, *args, **kwargs)
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler of requests, switched on at runtime.
+
+    Profiles the next `requests` requests or every request and keeps profiles of requests slower than
+    `slower_than` seconds. While requests are profiled, a background thread takes stacks of threads working
+    in a `stage` of a profiled request every `interval` seconds from `sys._current_frames`, the profiled code
+    itself is not instrumented. Stages entered in an event loop belong to tasks, a sample of the loop thread
+    goes to the request of the task running at the moment, so concurrent requests are not mixed.
+    Profiles are written into `directory` in the collapsed stacks format of flame graph tools, the first frame
+    of a stack is the stage, the file name holds the report number. The oldest profiles are removed above
+    `max_files`. Idle waits of the event loop are not sampled.
+    """
+    name_pattern: Final[re.Pattern] = re.compile(r'[\w.-]+\.collapsed')
+    idle_frames: Final[frozenset[tuple[str, str]]] = frozenset((('selectors.py', 'select'),))
+
+    def __init__(self, directory: str, interval: float = .005, max_depth: int = 128, max_files: int = 200):
+        self.logger: logging.Logger = logging.getLogger("profiler")
+        self.directory: str = directory
+        self.interval: float = interval
+        self.max_depth: int = max_depth
+        self.max_files: int = max_files
+        self.requests: int = 0
+        self.slower_than: Optional[float] = None
+        self._captures: set[ProfileCapture] = set()
+        self._stages: dict[StagesKey, list[tuple[ProfileCapture, str]]] = {}
+        self._loops: dict[int, asyncio.AbstractEventLoop] = {}
+        self._lock: threading.Lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def configure(self, requests: int = 0, slower_than: Optional[float] = None):
+        """Profile the next `requests` requests and requests slower than `slower_than`, zero and None switch off"""
+        with self._lock:
+            self.requests = requests
+            self.slower_than = slower_than
+        self.logger.info(f'Profiling of {requests} next requests, of requests slower than {slower_than} s.')
+
+    def status(self) -> dict:
+        return {
+            'requests': self.requests,
+            'slower_than': self.slower_than,
+            'active': len(self._captures),
+            'profiles': sorted(
+                entry.name for entry in os.scandir(self.directory) if self.name_pattern.fullmatch(entry.name)
+            )
+        }
+
+    def begin(self, name: str) -> Optional[ProfileCapture]:
+        """Capture of a request starting now or None if the request is not profiled"""
+        with self._lock:
+            if self.requests > 0:
+                self.requests -= 1
+                capture = ProfileCapture(self, name)
+            elif self.slower_than is not None:
+                capture = ProfileCapture(self, name, self.slower_than)
+            else:
+                return None
+            self._captures.add(capture)
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, name='profiler', daemon=True)
+                self._sampler.start()
+        return capture
+
+    def finish(self, capture: ProfileCapture) -> Optional[str]:
+        """Stop the capture and write its profile, returns path of the profile or None if it is not kept"""
+        with self._lock:
+            self._captures.discard(capture)
+            for key, stack in list(self._stages.items()):
+                stack[:] = [entry for entry in stack if entry[0] is not capture]
+                if not stack:
+                    self._forget(key)
+            samples: Counter[tuple[str, ...]] = Counter(capture.samples)
+        elapsed: float = time.monotonic() - capture.started
+        if capture.slower_than is not None and elapsed < capture.slower_than or not samples:
+            return None
+
+        reports: str = '-'.join(capture.reports[:3]) + ('-etc' if len(capture.reports) > 3 else '') or 'none'
+        filename: str = re.sub(
+            r'[^\w.-]+', '-', f"{datetime.now():%Y%m%d-%H%M%S}_{reports}_{elapsed * 1000:.0f}ms_{capture.name}"
+        ).strip('-')
+        path: str = f"{self.directory}/{filename}.collapsed"
+        with open(path, 'w', encoding='utf-8') as profile:
+            for stack, count in samples.most_common():
+                profile.write(f"{';'.join(stack)} {count}\n")
+        self.logger.info(f'{capture.name} of reports {capture.reports} took {elapsed:.3f} s, profile "{path}".')
+        self._remove_old_profiles()
+        return path
+
+    def path(self, name: str) -> str:
+        """
+        :raises ProfileNotFoundException:
+        """
+        path: str = f"{self.directory}/{name}"
+        if not self.name_pattern.fullmatch(name) or not os.path.exists(path):
+            raise ProfileNotFoundException(name)
+        return path
+
+    def enter(self, capture: ProfileCapture, stage_name: str) -> tuple[ProfileCapture, str]:
+        entry: tuple[ProfileCapture, str] = (capture, stage_name)
+        key: StagesKey = _stages_key()
+        with self._lock:
+            if key[1] is not None:
+                self._loops[key[0]] = key[1].get_loop()
+            self._stages.setdefault(key, []).append(entry)
+        return entry
+
+    def leave(self, entry: tuple[ProfileCapture, str]):
+        key: StagesKey = _stages_key()
+        with self._lock:
+            stack: list[tuple[ProfileCapture, str]] = self._stages.get(key, [])
+            for index in range(len(stack) - 1, -1, -1):
+                if stack[index] is entry:
+                    del stack[index]
+                    break
+            if not stack:
+                self._forget(key)
+
+    def _forget(self, key: StagesKey):
+        self._stages.pop(key, None)
+        if key[1] is not None and not any(thread == key[0] for thread, _ in self._stages):
+            self._loops.pop(key[0], None)
+
+    def _sample(self):
+        while True:
+            with self._lock:
+                if not self._captures:
+                    self._sampler = None
+                    return
+                threads: dict[int, tuple[ProfileCapture, str]] = {
+                    thread: stack[-1] for (thread, task), stack in self._stages.items()
+                    if stack and (task is None or task is asyncio.current_task(self._loops[thread]))
+                }
+            frames = sys._current_frames()
+            samples: list[tuple[ProfileCapture, tuple[str, ...]]] = []
+            for thread, (capture, stage_name) in threads.items():
+                frame = frames.get(thread)
+                stack: Optional[tuple[str, ...]] = self._stack(frame) if frame is not None else None
+                if stack:
+                    samples.append((capture, (stage_name,) + stack))
+            del frames
+            with self._lock:
+                for capture, stack in samples:
+                    if capture in self._captures:
+                        capture.samples[stack] += 1
+            time.sleep(self.interval)
+
+    def _stack(self, frame) -> Optional[tuple[str, ...]]:
+        """Frames from the outermost one as 'function (file)', None for an idle thread"""
+        if (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in self.idle_frames:
+            return None
+        stack: list[str] = []
+        while frame is not None and len(stack) < self.max_depth:
+            stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)})")
+            frame = frame.f_back
+        return tuple(reversed(stack))
+
+    def _remove_old_profiles(self):
+        profiles: list[os.DirEntry] = sorted(
+            (entry for entry in os.scandir(self.directory) if self.name_pattern.fullmatch(entry.name)),
+            key=lambda entry: entry.stat().st_mtime_ns
+        )
+        for entry in profiles[:max(0, len(profiles) - self.max_files)]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+
+
+def _stages_key() -> StagesKey:
+    try:
+        task: Optional[asyncio.Task] = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return threading.get_ident(), task
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests selected by the profiler, requests to the profiler are not profiled"""
+
+    def __init__(self, app, profiler: SamplingProfiler, excluded_prefix: str = '/report/profiler'):
+        self.app = app
+        self.profiler: SamplingProfiler = profiler
+        self.excluded_prefix: str = excluded_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'].startswith(self.excluded_prefix):
+            await self.app(scope, receive, send)
+            return
+        capture: Optional[ProfileCapture] = self.profiler.begin(f"{scope['method']} {scope['path']}")
+        if capture is None:
+            await self.app(scope, receive, send)
+            return
+        token = current_capture.set(capture)
+        try:
+            with stage('request'):
+                await self.app(scope, receive, send)
+        finally:
+            current_capture.reset(token)
+            self.profiler.finish(capture)
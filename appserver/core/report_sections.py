@@ -0,0 +1,112 @@
+from dataclasses import dataclass, field
+from typing import Final, Optional
+
+from dynaconf import settings
+
+from .template_compiler import TemplateSpec
+
+
+REPEATS: Final[tuple[str, ...]] = ('none', 'transport_unit', 'cargo')
+
+
+@dataclass
+class Section:
+    """
+    Part of a report rendered by one renderer of the report strategy.
+
+    :param name: name of the section
+    :param renderer: name of the strategy renderer filling the section
+    :param template: template name, the section takes table `table` of the template
+    :param table: index of the template table
+    :param repeat: 'none' - the section is rendered once for the report, 'transport_unit' or 'cargo' - once for
+        each transport unit or cargo of the report. Consecutive sections with the same repetition are output
+        unit by unit (cargo by cargo): all of them for the first one, then for the second one and so on.
+    :param page_break: page break after the section
+    :param cargo_tables_offset: for 'cargo_tables' renderer: paragraphs of the template are names of cargos, table
+        of a cargo has index of its paragraph plus the offset. Cargos not listed in the template get table 0 when
+        the offset is positive and are skipped otherwise.
+    :param cargo_extra_tables: for 'cargo_tables' renderer: number of additional tables following the table of a cargo
+    """
+    name: str
+    renderer: str
+    template: Optional[str] = None
+    table: int = 0
+    repeat: str = 'none'
+    page_break: bool = False
+    cargo_tables_offset: int = 0
+    cargo_extra_tables: dict[str, int] = field(default_factory=dict)
+
+    def __post_init__(self):
+        if self.repeat not in REPEATS:
+            raise ValueError(f'Section "{self.name}": unknown repetition "{self.repeat}"')
+        self.cargo_extra_tables = dict(self.cargo_extra_tables)
+
+    def template_spec(self) -> Optional[TemplateSpec]:
+        """Requirements of the section to its template"""
+        if self.template is None:
+            return None
+        if self.renderer == 'cargo_tables':
+            return TemplateSpec(
+                tables=self.cargo_tables_offset,
+                contexts=('transport_unit', 'report'),
+                cargo_tables_offset=self.cargo_tables_offset,
+                cargo_extra_tables=self.cargo_extra_tables
+            )
+        if self.renderer == 'tally_account':
+            return TemplateSpec(tables=2, contexts=('transport_unit',))
+        if self.renderer == 'letter_of_protest':
+            return TemplateSpec(contexts=('header',), extra_keys=('date', 'cargo', 'BL', 'vessel', 'result'))
+        contexts: dict[str, tuple[str, ...]] = {'rows': ('transport_unit', 'report'), 'values': ('report',)}
+        return TemplateSpec(tables=self.table + 1, contexts=contexts.get(self.renderer, ()))
+
+
+def report_sections(report_type: str) -> list[Section]:
+    """Sections of the report type in output order, from `report_types` and `report_sections` settings"""
+    structure: str = settings.REPORT_TYPES[report_type].sections
+    return [Section(**dict(section)) for section in settings.REPORT_SECTIONS[structure]]
+
+
+def templates_name(report_type: str) -> str:
+    """Name of templates directory of the report type, report types may share templates"""
+    return settings.REPORT_TYPES[report_type].get('templates', report_type)
+
+
+def templates_specs(sections: list[Section]) -> dict[str, TemplateSpec]:
+    """
+    Requirements to templates of the report: header and photos templates and templates of sections.
+
+    Requirements of sections sharing a template are merged. Header rows with keys absent in the header
+    of the report type are dropped, so the header template may be shared by report types.
+    """
+    specs: dict[str, TemplateSpec] = {
+        'header_template': TemplateSpec(contexts=('header',), optional_rows=True),
+        'photos_template': TemplateSpec(),
+    }
+    for section in sections:
+        spec: Optional[TemplateSpec] = section.template_spec()
+        if spec is None:
+            continue
+        merged: Optional[TemplateSpec] = specs.get(section.template)
+        if merged is not None:
+            spec = TemplateSpec(
+                tables=max(merged.tables, spec.tables),
+                contexts=tuple(dict.fromkeys(merged.contexts + spec.contexts)),
+                extra_keys=tuple(dict.fromkeys(merged.extra_keys + spec.extra_keys)),
+                cargo_tables_offset=merged.cargo_tables_offset if spec.cargo_tables_offset is None
+                else spec.cargo_tables_offset,
+                cargo_extra_tables={**merged.cargo_extra_tables, **spec.cargo_extra_tables}
+            )
+        specs[section.template] = spec
+    return specs
+
+
+def group_sections(sections: list[Section]) -> list[list[Section]]:
+    """Consecutive sections with the same repetition, sections rendered once form groups of one section"""
+    groups: list[list[Section]] = []
+    for section in sections:
+        if groups and section.repeat != 'none' and groups[-1][-1].repeat == section.repeat:
+            groups[-1].append(section)
+        else:
+            groups.append([section])
+    return groups
+
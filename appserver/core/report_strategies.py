@@ -1,248 +1,573 @@
 from abc import ABC, abstractmethod
+import hashlib
+import itertools
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
+from dataclasses import asdict
 from datetime import datetime
-from typing import Generator, Optional, Type, Iterator
+from typing import Any, Callable, Generator, Optional, Type, Iterator, Union
+import numpy as np
 from dynaconf import settings
 from num2words import num2words
 
-from .document_daos import AbstractDocumentDAO, Table, Row, Style
-from .exceptions import DocumentTemplateCorruptedException, DocumentTemplateNotFoundException
-from .models import BaseReport, SelfImportReport, Container, TemperatureData
+from .cache import LRUCache, canonical_hash
+from .document_daos import AbstractDocumentDAO, Fragment, Table, Row, Style
+from .exceptions import (
+    DocumentTemplateCorruptedException, DocumentTemplateNotFoundException, SectionNotFoundException
+)
+from .models import BaseReport, FloatWithCustomStringification, TransportUnit, TemperatureData, ThermographData
+from .profiling import stage, with_context
+from .report_sections import Section, group_sections, report_sections, templates_name
 from .template_engine import TemplateEngine
+from .templates import TemplatesCache
+from .thermographs import ExcursionAnalyzer, Excursions, downsample_readings, render_chart
 
 
-class ReportCreationBaseStrategy(ABC):
-    """ Интерфейс стратегий создания отчета. """
+CargoScope = tuple[str, list[TransportUnit]]
+
+
+class ReportTemplatesMixin:
+    """
+    Данные отчета и шаблоны его типа.
+
+    Шаблоны отчета читаются из каталога шаблонов типа отчета, один каталог может использоваться несколькими
+    типами отчетов (настройка `report_types`).
+    """
     logger: logging.Logger
     document_dao: Type[AbstractDocumentDAO]
     report: BaseReport
+    templates: Optional[TemplatesCache]
 
-    def __init__(self, document_dao: Type[AbstractDocumentDAO], report: SelfImportReport):
+    def __init__(
+            self,
+            document_dao: Type[AbstractDocumentDAO],
+            report: BaseReport,
+            templates: Optional[TemplatesCache] = None
+    ):
         self.logger: logging.Logger = logging.getLogger("report_strategy")
         self.document_dao: Type[AbstractDocumentDAO] = document_dao
-        self.report: SelfImportReport = report
-
-    @abstractmethod
-    def execute(self, report_doc: AbstractDocumentDAO) -> AbstractDocumentDAO:
-        ...
+        self.report: BaseReport = report
+        self.templates: Optional[TemplatesCache] = templates
+        self.templates_name: str = templates_name(type(report).__name__)
 
-    def fill_header_table(self, report_doc: AbstractDocumentDAO):
-        header: Table = next(report_doc.get_tables(), None)
-        if not header:
-            raise DocumentTemplateCorruptedException('Отсутствует таблица-заголовок')
+    def header_values(self) -> dict:
+        """Значения заголовка отчета, английские названия грузов ТЕ берутся из словарей настроек"""
+        vegetables, fruits = settings.VEGETABLES.to_dict(), settings.FRUITS.to_dict()
         for unit in self.report.transport_units:
             unit.cargo_in_english = [
-                settings.VEGETABLES.get(cargo.lower()) or settings.FRUITS.get(cargo.lower(), '') for cargo in unit.cargo
+                vegetables.get(cargo.lower()) or fruits.get(cargo.lower(), '') for cargo in unit.cargo
             ]
-        TemplateEngine.replace_in_table(
-            table=header, values=self.report.header, cell_handler=self.document_dao.set_cell_style
-        )
+        return self.report.header
 
     def _get_template_dao(self, template_name: str) -> AbstractDocumentDAO:
+        """Документ шаблона, общий для всех отчетов при кэше шаблонов, поэтому он не должен изменяться"""
+        path: str = self._template_path(template_name)
+        if self.templates:
+            return self.templates.get(path)
         try:
-            return self.document_dao(
-                f"{settings.REPOSITORY.TEMPLATES_DIR}/{type(self.report).__name__}/{template_name}.{settings.DOC_TYPE}"
-            )
+            return self.document_dao(path)
         except FileNotFoundError as e:
             raise DocumentTemplateNotFoundException from e
 
+    def _templates_dir(self) -> str:
+        return f"{settings.REPOSITORY.TEMPLATES_DIR}/{self.templates_name}"
+
+    def _template_path(self, template_name: str) -> str:
+        return f"{self._templates_dir()}/{template_name}.{settings.DOC_TYPE}"
+
     def _get_tables_from_template(self, template_name: str) -> Iterator[Table]:
         return self._get_template_dao(template_name).get_tables()
 
+    def _get_template_table(self, template_name: str, number: int) -> Table:
+        """Копия таблицы шаблона для заполнения"""
+        table: Optional[Table] = next(
+            (table for n, table in enumerate(self._get_tables_from_template(template_name)) if n == number), None
+        )
+        if not table:
+            raise DocumentTemplateCorruptedException(f'Отсутствует таблица {number + 1} шаблона {template_name}')
+        return deepcopy(table)
+
+    def _get_template_cargos(self, template_name: str, template: Optional[AbstractDocumentDAO] = None) -> list[str]:
+        """
+        Названия грузов из абзацев шаблона: из результата компиляции шаблона, если шаблон не изменился,
+        документ шаблона открывается только без результата компиляции
+        """
+        compiled = self.templates.compiled(self._template_path(template_name)) if self.templates else None
+        if compiled:
+            return compiled.cargos
+        template = template or self._get_template_dao(template_name)
+        return [paragraph.lower().strip() for paragraph in template.get_paragraphs() if paragraph.strip()]
 
-class SelfImportReportCreationStrategy(ReportCreationBaseStrategy):
-    """ Стратегия создания отчета по собственному импорту. """
 
+class ReportCreationBaseStrategy(ReportTemplatesMixin, ABC):
+    """Интерфейс стратегий создания отчета."""
+    fragments: Optional[LRUCache]
+
+    def __init__(
+            self,
+            document_dao: Type[AbstractDocumentDAO],
+            report: BaseReport,
+            templates: Optional[TemplatesCache] = None,
+            fragments: Optional[LRUCache] = None
+    ):
+        super().__init__(document_dao, report, templates)
+        self.fragments: Optional[LRUCache] = fragments
+
+    @abstractmethod
     def execute(self, report_doc: AbstractDocumentDAO) -> AbstractDocumentDAO:
+        ...
+
+    @abstractmethod
+    def update_section(
+            self, report_doc: AbstractDocumentDAO, section_name: str, units: list[str]
+    ) -> AbstractDocumentDAO:
         """
-        Создание отчета для собственного импорта.
+        Повторное заполнение раздела в созданном отчете для ТЕ `units` (для всех ТЕ, если список пуст),
+        остальное содержимое документа не изменяется.
 
-        Заполняются таблицы данных о температуре в каждой транспортной единице (ТЕ), добавляются графики датчиков,
-        определяются нарушения температурного режима (при их наличии создается письмо протеста), создаются шаблоны
-        таблиц тальманского счета по каждой ТЕ, таблицы результатов инспекции, замера калибров, заключения, времени
-        жизни и данных о исполнителе.
+        :raises SectionNotFoundException: раздела нет в отчете или в черновике
         """
-        self.fill_header_table(report_doc)
+        ...
 
-        self.add_temperature_table(report_doc)
-        report_doc.add_page_break()
+    def fill_header_table(self, report_doc: AbstractDocumentDAO):
+        """
+        Заполнение таблицы-заголовка. Строки с ключами, которых нет в заголовке типа отчета (например,
+        коносамент в отчете по автомобилям), удаляются.
+        """
+        header: Table = next(report_doc.get_tables(), None)
+        if not header:
+            raise DocumentTemplateCorruptedException('Отсутствует таблица-заголовок')
+        header_values: dict = self.header_values()
+        for number, row in reversed(list(enumerate(header.rows))):
+            row_keys: set[str] = {
+                key[2:-2].strip().split('.')[0]
+                for cell in row.cells for key in TemplateEngine.key_pattern.findall(cell.text)
+            }
+            if row_keys - header_values.keys():
+                header.delete_row(number)
+        TemplateEngine.replace_in_table(
+            table=header, values=header_values, cell_handler=self.document_dao.set_cell_style
+        )
 
-        tally_account_and_pallets_tables = self._get_tables_from_template('tally_account_template')
-        pallets_table_template: Optional[Table] = next(tally_account_and_pallets_tables, None)
-        if not pallets_table_template:
-            raise DocumentTemplateCorruptedException('Отсутствует шаблон таблицы паллетов')
-        tally_account_table_template: Optional[Table] = next(tally_account_and_pallets_tables, None)
-        if not tally_account_table_template:
-            raise DocumentTemplateCorruptedException('Отсутствует шаблон таблицы тальманского счета')
-        self.add_tally_account_and_pallets_tables(report_doc, pallets_table_template, tally_account_table_template)
 
-        self.add_inspection_result_tables(report_doc, self._get_template_dao('inspection_result_template'))
+class ReportSectionsMixin(ReportTemplatesMixin):
+    """Разделы отчета и разбор показаний датчиков, общие для стратегии создания отчета из разделов и предпросмотра"""
+    renderers: dict[str, str]
 
-        conclusion_template = self._get_tables_from_template('conclusion_template')
-        calibre_table: Optional[Table] = deepcopy(next(conclusion_template, None))
-        conclusion_table: Optional[Table] = deepcopy(next(conclusion_template, None))
-        shelf_life_table: Optional[Table] = deepcopy(next(conclusion_template, None))
-        executor_table: Optional[Table] = deepcopy(next(conclusion_template, None))
-        if not calibre_table or not conclusion_table or not shelf_life_table or not executor_table:
-            raise DocumentTemplateCorruptedException('Отсутствует один из шаблонов таблиц заключения')
+    def __init__(self, *args, sections: Optional[list[Section]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sections: list[Section] = sections if sections is not None else report_sections(
+            type(self.report).__name__
+        )
+        for section in self.sections:
+            if section.renderer not in self.renderers:
+                raise ValueError(f'Section "{section.name}": unknown renderer "{section.renderer}"')
+        self._readings_analyses: dict[tuple[str, float], tuple[np.ndarray, np.ndarray, Excursions]] = {}
+        self._readings_locks: dict[tuple[str, float], threading.Lock] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def _sections_scopes(self) -> list[tuple[Section, Any]]:
+        """Разделы в порядке вывода с ТЕ или грузом, для которых они заполняются"""
+        scopes: dict[str, list] = {
+            'none': [None],
+            'transport_unit': list(self.report.transport_units),
+            'cargo': self._cargos_scopes(),
+        }
+        return [
+            (section, scope)
+            for group in group_sections(self.sections) for scope in scopes[group[0].repeat] for section in group
+        ]
 
-        self.add_calibre_table(report_doc, calibre_table)
-        self.add_conclusion_table(report_doc, conclusion_table)
-        self.add_shelf_life_table(report_doc, shelf_life_table)
-        self.add_executor_table(report_doc, executor_table)
-        self.add_pictures_of_thermographs(report_doc)
+    def _cargos_scopes(self) -> list[CargoScope]:
+        """Грузы в порядке их появления в ТЕ с ТЕ, в которых они есть"""
+        cargos: dict[str, None] = dict.fromkeys(cargo for unit in self.report.transport_units for cargo in unit.cargo)
+        return [(cargo, [unit for unit in self.report.transport_units if cargo in unit.cargo]) for cargo in cargos]
+
+    def _units(self, scope: Union[None, TransportUnit, CargoScope]) -> list[TransportUnit]:
+        if scope is None:
+            return list(self.report.transport_units)
+        if isinstance(scope, TransportUnit):
+            return [scope]
+        return scope[1]
+
+    @staticmethod
+    def cargo_tables_numbers(section: Section, cargos_in_template: list[str], cargo: str) -> range:
+        """Номера таблиц груза в шаблоне раздела, груз без таблицы пропускается"""
+        if cargo in cargos_in_template:
+            tbl_number: int = cargos_in_template.index(cargo) + section.cargo_tables_offset
+        elif section.cargo_tables_offset:
+            tbl_number = 0
+        else:
+            return range(0)  # a cargo isn't mentioned in the template, so it doesn't need the table
+        return range(tbl_number, tbl_number + 1 + section.cargo_extra_tables.get(cargo, 0))
+
+    def _analyze_readings(
+            self, thermograph: ThermographData, temperature: TemperatureData
+    ) -> tuple[np.ndarray, np.ndarray, Excursions]:
+        """
+        Разбор показаний датчика за один проход: ряд точек для графика и отклонения от рекомендуемой температуры ±2°C.
 
+        Результат запоминается, так как используется и для графика, и для письма протеста, которые заполняются
+        параллельно: показания одного датчика разбираются один раз.
+        """
+        key: tuple[str, float] = (thermograph.readings.digest(), float(temperature.recommended))
+        with self._lock:
+            lock: threading.Lock = self._readings_locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._readings_analyses:
+                analyzer = ExcursionAnalyzer(
+                    lower=temperature.recommended - 2,
+                    upper=temperature.recommended + 2,
+                    activation_energy=settings.THERMOGRAPHS.ACTIVATION_ENERGY
+                )
+                times, values = downsample_readings(
+                    thermograph.readings,
+                    points=settings.THERMOGRAPHS.POINTS,
+                    max_points=settings.THERMOGRAPHS.MAX_POINTS,
+                    chunk_size=settings.THERMOGRAPHS.CHUNK_SIZE,
+                    analyzer=analyzer
+                )
+                self._readings_analyses[key] = times, values, analyzer.result()
+        return self._readings_analyses[key]
+
+    def letter_of_protest_values(self, units: list[TransportUnit]) -> Optional[dict]:
+        """Значения письма протеста по ТЕ с нарушением температурного режима, None, если нарушений нет"""
         def has_violations(temp: TemperatureData) -> bool:
             violations_in_thermographs: bool = any(
-                map(lambda th: abs(th.min - temp.recommended) > 2 or abs(th.max - temp.recommended) > 2,
+                map(lambda th: self._analyze_readings(th, temp)[2].violated if th.readings else
+                    abs(th.min - temp.recommended) > 2 or abs(th.max - temp.recommended) > 2,
                     temp.thermographs)
             )
             return violations_in_thermographs or abs(temp.pulp.min - temp.recommended) > 2 or \
-                   abs(temp.pulp.max - temp.recommended) > 2
+                abs(temp.pulp.max - temp.recommended) > 2
 
-        containers_with_violations: list[Container] = [
-            unit for unit in self.report.transport_units if has_violations(unit.temperature)
+        containers_with_violations: list[TransportUnit] = [
+            unit for unit in units if has_violations(unit.temperature)
         ]
-        if containers_with_violations:
-            self.add_letter_of_protest(report_doc, containers_with_violations)
+        if not containers_with_violations:
+            return None
+
+        LoP_varaibles: dict = self.report.header
+        LoP_varaibles["date"] = datetime.now().strftime("%d.%m.%Y")
+        LoP_varaibles["cargo"] = ", ".join(self.report.all_cargos_in_english)
+        LoP_varaibles["BL"] = ", ".join(LoP_varaibles.get("BL") or LoP_varaibles.get("CMR") or [])
+        LoP_varaibles.setdefault("vessel", "")
+        LoP_varaibles["result"] = ""
+        for container in containers_with_violations:
+            thermographs = container.temperature.thermographs
+            bounds: list[tuple[float, float]] = [
+                self._thermograph_bounds(thermograph, container.temperature) for thermograph in thermographs
+            ]
+            LoP_varaibles["result"] += f"""
+{num2words(len(thermographs)).capitalize()} thermograph(s) found in the container \
+{container.number} and according to {"it's" if len(thermographs) == 1 else "their"} record(s) the temperature during \
+transportation was from {min(low for low, _ in bounds)}°C to {max(high for _, high in bounds)}°C.\n
+Container {container.number} was opened on {self.report.inspection_date.split(' - ')[0]} and temperature inside was \
+{container.temperature.pulp.min}°C/{container.temperature.pulp.max}°C.\n\n"""
+            for thermograph in filter(lambda th: th.readings, thermographs):
+                excursions: Excursions = self._analyze_readings(thermograph, container.temperature)[2]
+                LoP_varaibles["result"] += self._excursions_text(thermograph.number, container.temperature, excursions)
+
+        return LoP_varaibles
+
+    def _thermograph_bounds(
+            self, thermograph: ThermographData, temperature: TemperatureData
+    ) -> tuple[FloatWithCustomStringification, FloatWithCustomStringification]:
+        """Минимальная и максимальная температура датчика: по его показаниям, если они загружены, иначе введенные"""
+        if thermograph.readings:
+            excursions: Excursions = self._analyze_readings(thermograph, temperature)[2]
+            if excursions.readings:
+                return FloatWithCustomStringification(excursions.minimum), \
+                    FloatWithCustomStringification(excursions.maximum)
+        return thermograph.min, thermograph.max
+
+    @staticmethod
+    def _excursions_text(number: str, temperature: TemperatureData, excursions: Excursions) -> str:
+        def duration(seconds: float) -> str:
+            minutes: int = round(seconds / 60)
+            return f"{minutes // 60} h {minutes % 60} min"
+
+        text: str = f"According to the logger data of thermograph {number} ({excursions.readings} readings) the " \
+                    f"temperature was above {temperature.recommended + 2:g}°C for {duration(excursions.time_above)} " \
+                    f"and below {temperature.recommended - 2:g}°C for {duration(excursions.time_below)}"
+        if excursions.violated:
+            text += f", the longest continuous excursion lasted {duration(excursions.longest)}"
+        if excursions.mean_kinetic_temperature is not None:
+            text += f". Mean kinetic temperature was {excursions.mean_kinetic_temperature:.1f}°C"
+        return text + ".\n\n"
+
+
+class SectionsReportCreationStrategy(ReportSectionsMixin, ReportCreationBaseStrategy):
+    """
+    Стратегия создания отчета из разделов.
+
+    Структура отчета - упорядоченный список разделов типа отчета из настроек `report_sections`: шаблон, номер
+    таблицы шаблона, заполняющий раздел метод стратегии и повторение раздела для каждой ТЕ или каждого груза.
+    """
+    renderers: dict[str, str] = {
+        'rows': 'add_rows_table',
+        'static': 'add_static_table',
+        'values': 'add_values_table',
+        'tally_account': 'add_tally_account_and_pallets_tables',
+        'cargo_tables': 'add_cargo_tables',
+        'thermographs': 'add_pictures_of_thermographs',
+        'letter_of_protest': 'add_letter_of_protest',
+    }
+
+    def __init__(
+            self,
+            document_dao: Type[AbstractDocumentDAO],
+            report: BaseReport,
+            templates: Optional[TemplatesCache] = None,
+            fragments: Optional[LRUCache] = None,
+            sections: Optional[list[Section]] = None
+    ):
+        super().__init__(document_dao, report, templates, fragments, sections=sections)
+        self._scratches: threading.local = threading.local()
+
+    def execute(self, report_doc: AbstractDocumentDAO) -> AbstractDocumentDAO:
+        """
+        Создание отчета.
 
+        Заголовок заполняется в документе отчета. Разделы независимы друг от друга, поэтому заполняются
+        параллельно в черновых документах и добавляются в отчет в порядке разделов по мере готовности.
+        Разделы ТЕ и грузов берутся из кэша фрагментов, если они уже заполнялись по тем же данным.
+        """
+        with stage('header'):
+            self.fill_header_table(report_doc)
+        sections_scopes: list[tuple[Section, Any]] = self._sections_scopes()
+        templates_version: Optional[str] = self._templates_version()
+        with ThreadPoolExecutor(max_workers=settings.SECTIONS.WORKERS) as executor:
+            fragments: Iterator[Fragment] = executor.map(
+                with_context(self._render_section), sections_scopes, itertools.repeat(templates_version)
+            )
+            for (section, scope), fragment in zip(sections_scopes, fragments):
+                with stage('append'):
+                    report_doc.append_fragment(fragment, bookmark=self._bookmark(section, scope))
         return report_doc
 
-    def add_temperature_table(self, report_doc: AbstractDocumentDAO):
-        temperature_table_template: Optional[Table] = next(self._get_tables_from_template('temperature_template'), None)
-        if not temperature_table_template:
-            raise DocumentTemplateCorruptedException('Отсутствует шаблон таблицы температурных данных')
-        self._fill_table_with_row_for_container(self.report.transport_units, temperature_table_template)
-        report_doc.append_table(temperature_table_template)
+    def update_section(
+            self, report_doc: AbstractDocumentDAO, section_name: str, units: list[str]
+    ) -> AbstractDocumentDAO:
+        """
+        Повторное заполнение раздела в черновике.
 
-    def add_tally_account_and_pallets_tables(
-            self, report_doc: AbstractDocumentDAO, pallets_table_template: Table, tally_account_table_template: Table
-    ):
-        for container in self.report.transport_units:
-            pallets_table = deepcopy(pallets_table_template)
-            TemplateEngine.replace_in_table(table=pallets_table, values=container,
-                                            cell_handler=self.document_dao.set_cell_style)
-            report_doc.append_table(pallets_table)
-
-            tally_account_table = deepcopy(tally_account_table_template)
-            last_row_texts: list[str] = [cell.text for cell in tally_account_table_template.rows[-1].cells]
-            tally_account_table.delete_row(-1)
-            for num in range(2, container.pallets + 1):
-                row: Row = tally_account_table.add_row()
-                row.cells[0].text = str(num)
-            last_row: Row = tally_account_table.add_row()
-            for (n, cell) in enumerate(last_row.cells):
-                cell.text = last_row_texts[n]
-
-            TemplateEngine.replace_in_table(
-                table=tally_account_table, values=container, cell_handler=self.document_dao.set_cell_style
+        Каждый раздел в отчете отмечен закладкой по имени раздела и ТЕ или грузу, для которых он заполнен:
+        заполняются только разделы ТЕ `units` (разделы грузов, которые есть в этих ТЕ), и содержимое закладки
+        заменяется новым фрагментом. Разделы, которые выводятся один раз для отчета, заполняются целиком.
+        Значения заголовка заполняются, как при создании отчета, поэтому совпадают и ключи кэша фрагментов.
+        """
+        if not any(section.name == section_name for section in self.sections):
+            raise SectionNotFoundException(f'Раздела "{section_name}" нет в отчете')
+        unknown_units: set[str] = set(units) - {unit.number for unit in self.report.transport_units}
+        if unknown_units:
+            raise SectionNotFoundException(f'ТЕ {", ".join(sorted(unknown_units))} нет в отчете')
+        self.header_values()
+        sections_scopes: list[tuple[Section, Any]] = [
+            (section, scope) for section, scope in self._sections_scopes()
+            if section.name == section_name and
+            (not units or any(unit.number in units for unit in self._units(scope)))
+        ]
+        templates_version: Optional[str] = self._templates_version()
+        with ThreadPoolExecutor(max_workers=settings.SECTIONS.WORKERS) as executor:
+            fragments: Iterator[Fragment] = executor.map(
+                with_context(self._render_section), sections_scopes, itertools.repeat(templates_version)
             )
-            report_doc.append_table(tally_account_table)
-            report_doc.add_page_break()
+            for (section, scope), fragment in zip(sections_scopes, fragments):
+                with stage('replace'):
+                    if not report_doc.replace_fragment(self._bookmark(section, scope), fragment):
+                        raise SectionNotFoundException(
+                            f'Раздел "{section_name}" не отмечен в черновике, черновик нужно создать заново'
+                        )
+        return report_doc
 
-    def add_inspection_result_tables(
-            self,
-            report_doc: AbstractDocumentDAO,
-            inspection_result_template: AbstractDocumentDAO
-    ):
-        cargos_in_inspection_result_template = list(
-            filter(lambda pr: pr, map(lambda pr: pr.lower().strip(), inspection_result_template.get_paragraphs()))
-        )
-        cargos_in_report: set[str] = set((cargo for TU in self.report.transport_units for cargo in TU.cargo))
-        containers_by_cargo: dict[str, list[Container]] = {
-            cargo: [cont for cont in self.report.transport_units if cargo in cont.cargo] for cargo in cargos_in_report
-        }
-        inspection_result_template_tables: list[Table] = list(inspection_result_template.get_tables())
-        for cargo, containers in containers_by_cargo.items():
-            try:
-                tbl_number: int = cargos_in_inspection_result_template.index(cargo) + 1
-            except ValueError:
-                tbl_number = 0
+    @staticmethod
+    def _bookmark(section: Section, scope: Union[None, TransportUnit, CargoScope]) -> str:
+        """
+        Имя закладки раздела: скрытая закладка Word (начинается с подчеркивания) не длиннее 40 символов
+        из хэша имени раздела и номера ТЕ или названия груза
+        """
+        scope_name: str = '' if scope is None else scope.number if isinstance(scope, TransportUnit) else scope[0]
+        return '_section_' + hashlib.sha1(f'{section.name}/{scope_name}'.encode()).hexdigest()[:12]
+
+    def _render_section(self, section_scope: tuple[Section, Any], templates_version: Optional[str]) -> Fragment:
+        """Заполнение раздела в черновом документе потока, фрагмент из черновика удаляется"""
+        section, scope = section_scope
+        with stage(f'section {section.name}'):
+            key: Optional[str] = self._fragment_key(section, scope, templates_version)
+            if key is not None:
+                fragment: Optional[Fragment] = self.fragments.get(key)
+                if fragment is not None:
+                    return fragment
+            scratch: AbstractDocumentDAO = self._scratch()
+            render: Callable[[AbstractDocumentDAO, Section, Any], None] = getattr(
+                self, self.renderers[section.renderer]
+            )
+            render(scratch, section, scope)
+            if section.page_break:
+                scratch.add_page_break()
+            fragment = scratch.detach_fragment()
+            if key is not None:
+                self.fragments.put(key, fragment, size=fragment.size)
+            return fragment
+
+    def _scratch(self) -> AbstractDocumentDAO:
+        """Черновой документ потока: шаблон заголовка без содержимого, с теми же стилями и параметрами страницы"""
+        scratch: Optional[AbstractDocumentDAO] = getattr(self._scratches, 'document', None)
+        if scratch is None:
             try:
-                table = deepcopy(inspection_result_template_tables[tbl_number])
-            except IndexError:
-                raise DocumentTemplateCorruptedException(f'Отсутствует таблица результатов для {cargo}')
+                scratch = self.document_dao(self._template_path('header_template'))
+            except FileNotFoundError as e:
+                raise DocumentTemplateNotFoundException from e
+            scratch.detach_fragment()
+            self._scratches.document = scratch
+        return scratch
+
+    def _templates_version(self) -> Optional[str]:
+        """Версия шаблонов для ключей кэша фрагментов, вычисляется один раз для заполнения отчета или раздела"""
+        if self.fragments is None or not self.templates:
+            return None
+        return self.templates.version(self._templates_dir())
+
+    def _fragment_key(
+            self, section: Section, scope: Union[None, TransportUnit, CargoScope], templates_version: Optional[str]
+    ) -> Optional[str]:
+        """
+        Ключ кэша фрагментов для разделов ТЕ и грузов: данные раздела, ТЕ и общие данные отчета и версия шаблонов.
+        Разделы отчета целиком не кэшируются, их повторное заполнение покрывается кэшем отчетов.
+        """
+        if self.fragments is None or scope is None:
+            return None
+        cargo: Optional[str] = None if isinstance(scope, TransportUnit) else scope[0]
+        return canonical_hash([
+            type(self).__name__,
+            self.document_dao.__name__,
+            templates_version,
+            asdict(section),
+            self.report.dict(exclude={'transport_units'}),
+            cargo,
+            [unit.dict(exclude={'photos'}) for unit in self._units(scope)]
+        ])
+
+    def add_rows_table(self, report_doc: AbstractDocumentDAO, section: Section, scope: Any):
+        """Таблица со строкой для каждой ТЕ раздела"""
+        table: Table = self._get_template_table(section.template, section.table)
+        self._fill_table_with_row_for_container(self._units(scope), table)
+        report_doc.append_table(table)
 
-            self._fill_table_with_row_for_container(containers, table)
-            report_doc.append_table(table)
-            self.add_colors_tables(report_doc, cargo, containers, self._get_template_dao('colors_tables_template'))
+    def add_static_table(self, report_doc: AbstractDocumentDAO, section: Section, scope: Any):
+        """Таблица шаблона без изменений"""
+        report_doc.append_table(self._get_template_table(section.template, section.table))
 
-    def add_colors_tables(
-            self,
-            report_doc: AbstractDocumentDAO,
-            cargo: str,
-            containers_with_cargo: list[Container],
-            colors_tables_template: AbstractDocumentDAO
-    ):
-        cargos_in_colors_tables_template = list(
-            filter(lambda pr: pr, map(lambda pr: pr.lower().strip(), colors_tables_template.get_paragraphs()))
+    def add_values_table(self, report_doc: AbstractDocumentDAO, section: Section, scope: Any):
+        """Таблица, заполненная данными ТЕ раздела или данными отчета"""
+        table: Table = self._get_template_table(section.template, section.table)
+        TemplateEngine.replace_in_table(
+            table=table,
+            values=scope if isinstance(scope, TransportUnit) else self.report,
+            cell_handler=self.document_dao.set_cell_style
         )
-        colors_tables_template_tables: list[Table] = list(colors_tables_template.get_tables())
-        try:
-            tbl_number: int = cargos_in_colors_tables_template.index(cargo)
-        except ValueError:
-            return  # if that cargo isn't mentioned in colors_tables_template we don't need to insert color table
-        try:
-            table = deepcopy(colors_tables_template_tables[tbl_number])
-        except IndexError:
-            raise DocumentTemplateCorruptedException(f'Отсутствует таблица цветности для {cargo}')
-        self._fill_table_with_row_for_container(containers_with_cargo, table)
         report_doc.append_table(table)
-        if cargo == 'яблоко':
-            table = deepcopy(colors_tables_template_tables[tbl_number + 1])
-            self._fill_table_with_row_for_container(containers_with_cargo, table)
-            report_doc.append_table(table)
 
-    def add_calibre_table(self, report_doc: AbstractDocumentDAO, calibre_table: Table):
-        self._fill_table_with_row_for_container(self.report.transport_units, calibre_table)
-        report_doc.append_table(calibre_table)
-
-    def add_conclusion_table(self, report_doc: AbstractDocumentDAO, conclusion_table: Table):
-        report_doc.append_table(conclusion_table)
+    def add_tally_account_and_pallets_tables(self, report_doc: AbstractDocumentDAO, section: Section, scope: Any):
+        tables: Iterator[Table] = self._get_tables_from_template(section.template)
+        pallets_table_template: Optional[Table] = next(tables, None)
+        if not pallets_table_template:
+            raise DocumentTemplateCorruptedException('Отсутствует шаблон таблицы паллетов')
+        tally_account_table_template: Optional[Table] = next(tables, None)
+        if not tally_account_table_template:
+            raise DocumentTemplateCorruptedException('Отсутствует шаблон таблицы тальманского счета')
+        for container in self._units(scope):
+            self.add_container_tally_account_and_pallets_tables(
+                report_doc, container, pallets_table_template, tally_account_table_template
+            )
 
-    def add_shelf_life_table(self, report_doc: AbstractDocumentDAO, shelf_life_table: Table):
-        self._fill_table_with_row_for_container(self.report.transport_units, shelf_life_table)
-        report_doc.append_table(shelf_life_table)
+    def add_container_tally_account_and_pallets_tables(
+            self,
+            report_doc: AbstractDocumentDAO,
+            container: TransportUnit,
+            pallets_table_template: Table,
+            tally_account_table_template: Table
+    ):
+        pallets_table = deepcopy(pallets_table_template)
+        TemplateEngine.replace_in_table(table=pallets_table, values=container,
+                                        cell_handler=self.document_dao.set_cell_style)
+        report_doc.append_table(pallets_table)
+
+        tally_account_table = deepcopy(tally_account_table_template)
+        last_row_texts: list[str] = [cell.text for cell in tally_account_table_template.rows[-1].cells]
+        tally_account_table.delete_row(-1)
+        for num in range(2, container.pallets + 1):
+            row: Row = tally_account_table.add_row()
+            row.cells[0].text = str(num)
+        last_row: Row = tally_account_table.add_row()
+        for (n, cell) in enumerate(last_row.cells):
+            cell.text = last_row_texts[n]
 
-    def add_executor_table(self, report_doc: AbstractDocumentDAO, executor_table: Table):
         TemplateEngine.replace_in_table(
-            table=executor_table, values=self.report, cell_handler=self.document_dao.set_cell_style
+            table=tally_account_table, values=container, cell_handler=self.document_dao.set_cell_style
         )
-        report_doc.append_table(executor_table)
-
-    def add_pictures_of_thermographs(self, report_doc: AbstractDocumentDAO):
-        for TU in self.report.transport_units:
-            report_doc.add_page_break()
-            for thermograph in TU.temperature.thermographs:
-                report_doc.append_paragraph(f"Контейнер: {TU.number}\nНомер датчика:{thermograph.number}\n")
-                if thermograph.graph:
-                    page_size: tuple[float, float] = report_doc.get_page_size()
-                    report_doc.append_picture(thermograph.graph.file, height=page_size[0] * .3, width=page_size[1] * .7)
-
-    def add_letter_of_protest(self, report_doc: AbstractDocumentDAO, containers_with_violations: list[Container]):
-        letter_of_protest: Table = deepcopy(next(self._get_tables_from_template('letter_of_protest'), None))
-        if not letter_of_protest:
-            raise DocumentTemplateCorruptedException('Отсутствует шаблон письма протеста')
+        report_doc.append_table(tally_account_table)
         report_doc.add_page_break()
-        report_doc.append_table(letter_of_protest)
-        letter_of_protest: Table = list(report_doc.get_tables())[-1]
 
-        LoP_varaibles: dict = self.report.header
-        LoP_varaibles["date"] = datetime.now().strftime("%d.%m.%Y")
-        LoP_varaibles["cargo"] = ", ".join(self.report.all_cargos_in_english)
-        LoP_varaibles["BL"] = ", ".join(LoP_varaibles["BL"])
-        LoP_varaibles["result"] = ""
-        for container in containers_with_violations:
-            thermographs = container.temperature.thermographs
-            LoP_varaibles["result"] += f"""
-{num2words(len(thermographs)).capitalize()} thermograph(s) found in the container \
-{container.number} and according to {"it's" if len(thermographs) == 1 else "their"} record(s) the temperature during \
-transportation was from {min((th.min for th in thermographs))}°C to {max((th.max for th in thermographs))}°C.\n
-Container {container.number} was opened on {self.report.inspection_date.split(' - ')[0]} and temperature inside was \
-{container.temperature.pulp.min}°C/{container.temperature.pulp.max}°C.\n\n"""
+    def add_cargo_tables(self, report_doc: AbstractDocumentDAO, section: Section, scope: Any):
+        """
+        Таблицы грузов раздела (например, результатов инспекции или цветности) со строкой для каждой ТЕ с грузом.
 
-        LoP_varaibles["result"] = LoP_varaibles["result"]
+        Таблица груза выбирается по списку грузов в абзацах шаблона.
+        """
+        template: AbstractDocumentDAO = self._get_template_dao(section.template)
+        cargos_in_template: list[str] = self._get_template_cargos(section.template, template)
+        template_tables: list[Table] = list(template.get_tables())
+        for cargo, containers in [scope] if scope is not None else self._cargos_scopes():
+            for number in self.cargo_tables_numbers(section, cargos_in_template, cargo):
+                try:
+                    table = deepcopy(template_tables[number])
+                except IndexError:
+                    raise DocumentTemplateCorruptedException(f'Отсутствует таблица {section.template} для {cargo}')
+                self._fill_table_with_row_for_container(containers, table)
+                report_doc.append_table(table)
+
+    def add_pictures_of_thermographs(self, report_doc: AbstractDocumentDAO, section: Section, scope: Any):
+        for TU in self._units(scope):
+            self.add_container_pictures_of_thermographs(report_doc, TU)
+
+    def add_container_pictures_of_thermographs(self, report_doc: AbstractDocumentDAO, container: TransportUnit):
+        """
+        Графики датчиков ТЕ: загруженное изображение графика или график, построенный по показаниям датчика.
+        """
+        report_doc.add_page_break()
+        for thermograph in container.temperature.thermographs:
+            report_doc.append_paragraph(f"Контейнер: {container.number}\nНомер датчика:{thermograph.number}\n")
+            page_size: tuple[float, float] = report_doc.get_page_size()
+            height, width = page_size[0] * .3, page_size[1] * .7
+            if thermograph.graph:
+                report_doc.append_picture(thermograph.graph.file, height=height, width=width)
+            elif thermograph.readings:
+                times, values, _ = self._analyze_readings(thermograph, container.temperature)
+                pixels_per_cm: float = settings.THERMOGRAPHS.DPI / 2.54
+                chart = render_chart(
+                    times,
+                    values,
+                    width=round(width * pixels_per_cm),
+                    height=round(height * pixels_per_cm),
+                    lower=container.temperature.recommended - 2,
+                    upper=container.temperature.recommended + 2,
+                    title=thermograph.number
+                )
+                report_doc.append_picture(chart, height=height, width=width)
+
+    def add_letter_of_protest(self, report_doc: AbstractDocumentDAO, section: Section, scope: Any):
+        """Письмо протеста, если в ТЕ раздела нарушен температурный режим"""
+        LoP_varaibles: Optional[dict] = self.letter_of_protest_values(self._units(scope))
+        if LoP_varaibles is None:
+            return
+        letter_of_protest: Table = self._get_template_table(section.template, section.table)
+        report_doc.add_page_break()
+        report_doc.append_table(letter_of_protest)
+        letter_of_protest: Table = list(report_doc.get_tables())[-1]
         TemplateEngine.replace_in_table(
             table=letter_of_protest,
             values=LoP_varaibles,
@@ -251,19 +576,21 @@ Container {container.number} was opened on {self.report.inspection_date.split('
             )
         )
 
-    def _fill_table_with_row_for_container(self, containers: list[Container], table: Table):
+    def _fill_table_with_row_for_container(self, containers: list[TransportUnit], table: Table):
         cells_content: list[str] = []
-        containers: Generator[Container] = (container for container in containers)
-        first_container: Container = next(containers, {})
+        containers: Generator[TransportUnit] = (container for container in containers)
+        first_container: TransportUnit = next(containers, {})
 
+        first_values: dict = first_container.dict() if first_container else {}
         for cell in table.rows[-1].cells:
             cells_content.append(cell.text)
-            cell.text = TemplateEngine.replace_text(cell.text, first_container)
+            cell.text = TemplateEngine.replace_text(cell.text, first_values)
 
         for container in containers:
+            values: dict = container.dict()
             row: Row = table.add_row()
             for number, cell in enumerate(row.cells):
-                cell.text = TemplateEngine.replace_text(cells_content[number], container)
+                cell.text = TemplateEngine.replace_text(cells_content[number], values)
                 self.document_dao.set_cell_style(cell)
 
         TemplateEngine.replace_in_table(table=table, values=self.report, cell_handler=self.document_dao.set_cell_style)
@@ -1,26 +1,42 @@
+import json
 import logging
-import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, Future
 from copy import deepcopy
+from dataclasses import asdict
+from datetime import date, datetime
 from io import BytesIO
-from typing import List, Type, Optional, Union
+from typing import BinaryIO, Iterable, Iterator, List, Type, Optional, Union
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
 from fastapi import UploadFile
 from fastapi.responses import FileResponse
 from dynaconf import settings
-from more_itertools import chunked
 from pydantic import BaseModel
-from PIL import Image
 from urllib.parse import unquote
 
-from .document_daos import AbstractDocumentDAO, Table
-from .exceptions import DraftDocumentNotFoundException, DocumentTemplateCorruptedException
-from .models import BaseReport, SelfImportReport, SelfImportOnAutoReport, PickupFromSupplierReport, Photo
-from .report_strategies import ReportCreationBaseStrategy, SelfImportReportCreationStrategy
+from .admission import MemoryReservation, current_reservation, photos_cost
+from .cache import LRUCache, canonical_hash
+from .document_daos import AbstractDocumentDAO, Fragment, Table
+from .draft_states import DraftState, DraftStateStore
+from .exceptions import (
+    AppException, DraftDocumentNotFoundException, DocumentTemplateCorruptedException, PhotoCorruptedException
+)
+from .models import BaseReport, SelfImportReport, SelfImportOnAutoReport, PickupFromSupplierReport
+from .photos import PhotoInfo, plan_photos_pages, probe_photo, render_photo
+from .preview import SectionsReportPreview
+from .profiling import stage, tag_report, with_context
+from .report_sections import report_sections, templates_name, templates_specs
+from .report_strategies import ReportCreationBaseStrategy, SectionsReportCreationStrategy
+from .storages import AbstractReportStorage
+from .streaming import CopyingStream, DocumentStreamingResponse
+from .template_compiler import TemplateCompiler
+from .templates import TemplatesCache
+from .thumbnails import ThumbnailsCache
 
 
 # TODO
 
 # таблицы цветности - после таблиы результатов
-# поворот картинок-  альбомная ориентация и растягивание
 # как составлять таблицы с паллетами/коробками. отличия для разных типов СО
 # логика тальманского отчета. заполнение
 # отличия таблиц температуры для разных СО
@@ -28,104 +44,476 @@ from .report_strategies import ReportCreationBaseStrategy, SelfImportReportCreat
 # picture cropping
 
 
-# TODO растягивать фото если оно меньше чем ячейка и переворачивать вертикальные
-
-
 class AgentReportRepository:
     """Репозиторий бизнес-логики приложения"""
 
-    def __init__(self, document_dao: Type[AbstractDocumentDAO]):
+    def __init__(self, document_dao: Type[AbstractDocumentDAO], storage: AbstractReportStorage):
         self.logger: logging.Logger = logging.getLogger("repository")
         self.document_dao: Type[AbstractDocumentDAO] = document_dao
+        self.storage: AbstractReportStorage = storage
+        self.templates: TemplatesCache = TemplatesCache(document_dao, extension=settings.DOC_TYPE)
+        self.render_cache: LRUCache = LRUCache(max_size=settings.RENDER_CACHE.MAX_SIZE)
+        self.fragments_cache: LRUCache = LRUCache(max_size=settings.FRAGMENTS_CACHE.MAX_SIZE)
+        self.preview_cache: LRUCache = LRUCache(max_size=settings.PREVIEW.MAX_SIZE)
+        self._templates_versions: dict[str, str] = {}
+        self._templates_versions_lock: threading.Lock = threading.Lock()
+        self.thumbnails: ThumbnailsCache = ThumbnailsCache(
+            directory=settings.REPOSITORY.THUMBNAILS_DIR,
+            sizes=settings.THUMBNAILS.SIZES,
+            formats=settings.THUMBNAILS.FORMATS,
+            max_size=settings.THUMBNAILS.MAX_SIZE,
+            quality=settings.THUMBNAILS.QUALITY
+        )
         self.doc_filling_strategies_mapping: dict[Type[BaseModel], Type[ReportCreationBaseStrategy]] = {
-            SelfImportReport: SelfImportReportCreationStrategy,
-            SelfImportOnAutoReport: ...,
-            PickupFromSupplierReport: ...,
+            SelfImportReport: SectionsReportCreationStrategy,
+            SelfImportOnAutoReport: SectionsReportCreationStrategy,
+            PickupFromSupplierReport: SectionsReportCreationStrategy,
         }
+        self.draft_states: DraftStateStore = DraftStateStore(
+            list(self.doc_filling_strategies_mapping), max_size=settings.DRAFT_STATES.MAX_SIZE
+        )
+        self.template_compiler: TemplateCompiler = TemplateCompiler(
+            document_dao, settings.REPOSITORY.TEMPLATES_DIR, settings.DOC_TYPE
+        )
+        self._preload_templates()
+
+    def _preload_templates(self):
+        """
+        Загрузка скомпилированных шаблонов всех типов отчетов при запуске сервера.
 
-    def create_report(self, report: BaseReport) -> FileResponse:
+        Устаревшие шаблоны компилируются заново, ошибки в шаблонах прерывают запуск, а не создание отчета.
+        """
+        for report_model in self.doc_filling_strategies_mapping:
+            report_type: str = report_model.__name__
+            templates: str = templates_name(report_type)
+            compiled = self.template_compiler.load(
+                report_model, templates, templates_specs(report_sections(report_type))
+            )
+            self.templates.preload(f"{settings.REPOSITORY.TEMPLATES_DIR}/{templates}", compiled.values())
+            self.logger.info(f"Templates of {report_type} loaded: {', '.join(compiled)}.")
+
+    def create_report(self, report: BaseReport, compression_level: Optional[int] = None) -> DocumentStreamingResponse:
         """
         Метод создания черновика отчета.
 
         Метод создает черновик и заполняет его заголовок.
         Заполнение остальных данных происходит в соответствующих стратегиях.
+        Повторный запрос с теми же данными возвращает сохраненный в кэше документ без повторного заполнения.
 
         :param report: данные заявки
-        :return str: название файла черновика отчета
+        :param compression_level: уровень сжатия документа, по умолчанию из настроек
+        :return DocumentStreamingResponse: файл черновика отчета
         """
-        doc = self.document_dao(
-            path=f"{settings.REPOSITORY.TEMPLATES_DIR}/{type(report).__name__}/header_template.{settings.DOC_TYPE}"
-        )
-        self.doc_filling_strategies_mapping[type(report)](self.document_dao, report).execute(doc)
-
+        if compression_level is None:
+            compression_level = settings.STREAMING.COMPRESSION_LEVEL
+        tag_report(report.number)
         filename: str = self._build_report_name(report)
+        cache_key: tuple = self._render_cache_key(report, compression_level)
+        cached_doc: Optional[bytes] = self.render_cache.get(cache_key)
+        if cached_doc is not None:
+            self.logger.info(f'Render cache hit for "{filename}".')
+            return self._stream_cached_document(cached_doc, filename)
 
-        doc.save(f'{settings.REPOSITORY.REPORTS_DIR}/{filename}')
-        self.logger.info(f'Doc saved to "{settings.REPOSITORY.REPORTS_DIR}/" with name "{filename}".')
-        return FileResponse(
-            f"{settings.REPOSITORY.REPORTS_DIR}/{filename}",
-            filename=filename,
-            media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        doc: AbstractDocumentDAO = self._render_report(report)
+        return self._stream_document(doc, filename, compression_level, cache_key=cache_key)
+
+    def create_reports(
+            self, reports: List[BaseReport], compression_level: Optional[int] = None
+    ) -> DocumentStreamingResponse:
+        """
+        Пакетное создание черновиков отчетов.
+
+        Отчеты создаются параллельно с общими шаблонами, каждый черновик сохраняется как при создании отчета.
+        Клиенту возвращается zip-архив с готовыми документами и файлом manifest.json со статусом каждого отчета,
+        ошибка в одном отчете не прерывает создание остальных.
+
+        :param reports: данные заявок
+        :param compression_level: уровень сжатия документов, по умолчанию из настроек
+        :return DocumentStreamingResponse: архив отчетов
+        """
+        if compression_level is None:
+            compression_level = settings.STREAMING.COMPRESSION_LEVEL
+        self.logger.info(f'Batch of {len(reports)} reports requested.')
+        return DocumentStreamingResponse(
+            lambda stream: self._write_reports_archive(stream, reports, compression_level),
+            filename=f"reports_{datetime.now().strftime('%d.%m.%Y_%H-%M-%S')}.zip",
+            chunk_size=settings.STREAMING.CHUNK_SIZE,
+            media_type="application/zip"
         )
 
+    def draft_path(self, report: BaseReport) -> str:
+        """
+        Путь к файлу черновика отчета в локальной файловой системе.
+
+        :raises DraftDocumentNotFoundException: черновик отчета не создан
+        """
+        return self.storage.path(self._build_report_name(report))
+
+    def render_cache_stats(self) -> dict:
+        """Метрики кэшей отчетов, фрагментов отчетов и данных черновиков"""
+        return {
+            **self.render_cache.stats(),
+            'fragments': self.fragments_cache.stats(),
+            'draft_states': self.draft_states.stats(),
+            'preview': self.preview_cache.stats()
+        }
+
+    def create_draft_state(self, data: dict) -> dict:
+        """
+        Сохранение данных отчета на сервере: дальше клиент отправляет только изменения данных и создает
+        документы по идентификатору черновика.
+
+        :return: идентификатор и версия данных черновика
+        """
+        return self.draft_states.create(data).describe()
+
+    def get_draft_state(self, draft_id: str) -> dict:
+        """Данные отчета черновика в том виде, в котором их отправил клиент, с версией"""
+        state: DraftState = self.draft_states.get(draft_id)
+        return {**state.describe(), 'report': state.data}
+
+    def update_draft_state(self, draft_id: str, operations: list[dict], version: Optional[int] = None) -> dict:
+        """
+        Изменение данных отчета черновика в формате JSON Patch (RFC 6902).
+
+        Проверяются только измененные ТЕ и общие данные отчета.
+
+        :param version: версия данных, для которой сделаны изменения, изменения другой версии отклоняются
+        :return: идентификатор и новая версия данных черновика
+        """
+        return self.draft_states.patch(draft_id, operations, version).describe()
+
+    def delete_draft_state(self, draft_id: str):
+        self.draft_states.delete(draft_id)
+
+    def draft_report(self, draft_id: str) -> BaseReport:
+        """Отчет по сохраненным данным черновика: копия, которую можно изменять при заполнении документа"""
+        return self.draft_states.get(draft_id).report.copy(deep=True)
+
     def get_report(self, filename: str) -> Union[List[dict], FileResponse]:
-        report_files = os.scandir(settings.REPOSITORY.REPORTS_DIR)
+        """Список черновиков отчетов или файл черновика, архивный черновик восстанавливается из архива"""
         if not filename:
-            return [{'name': file.name,
-                     'size': file.stat().st_size,
-                     'modified': file.stat().st_mtime} for file in report_files]
+            return [asdict(report) for report in self.storage.list()]
         filename = unquote(filename)
-        if filename not in (file.name for file in report_files):
-            raise DraftDocumentNotFoundException
         return FileResponse(
-            f"{settings.REPOSITORY.REPORTS_DIR}/{filename}",
+            self.storage.path(filename),
             filename=filename,
             media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
         )
 
     def update_report(self, filename: str, report_file: UploadFile) -> str:
         filename = unquote(filename)
-        if filename not in os.listdir(settings.REPOSITORY.REPORTS_DIR):
+        if not self.storage.exists(filename):
             raise DraftDocumentNotFoundException
-        with open(f"{settings.REPOSITORY.REPORTS_DIR}/{filename}", "wb") as doc:
-            doc.write(report_file.file.read())
+        self.storage.write(filename, report_file.file.read())
         return filename
 
-    def add_pictures(self, report: BaseReport) -> FileResponse:
+    def add_thumbnails(self, image_file: UploadFile) -> dict:
+        """
+        Создание миниатюр загруженного изображения (фотографии или графика датчика) всех размеров и форматов.
+
+        :return: хэш изображения, по которому запрашиваются миниатюры, доступные размеры и форматы
+        """
+        image_hash: str = self.thumbnails.add(image_file.file.read())
+        return {'hash': image_hash, 'sizes': self.thumbnails.sizes, 'formats': self.thumbnails.formats}
+
+    def get_thumbnail(self, image_hash: str, size: int, image_format: str) -> FileResponse:
+        """Миниатюра изображения ближайшего не меньшего размера. Миниатюры не меняются, поэтому кэшируются клиентом"""
+        path: str = self.thumbnails.get(image_hash, size, image_format)
+        return FileResponse(
+            path,
+            media_type=f"image/{image_format}",
+            headers={"Cache-Control": "public, max-age=31536000, immutable"}
+        )
+
+    def get_draft_thumbnails(self, filename: str) -> list[dict]:
+        """Миниатюры изображений черновика отчета без загрузки документа клиентом"""
+        return [
+            {'name': name, 'hash': self.thumbnails.add(picture)}
+            for name, picture in self.document_dao.read_pictures(self.storage.path(unquote(filename)))
+        ]
+
+    def add_pictures(self, report: BaseReport, compression_level: Optional[int] = None) -> DocumentStreamingResponse:
         """
         Добавление фотографий к отчету.
 
-        Фотографии добавляются в таблице 2 на 2, по одной таблице на страницу отчета.
+        Фотографии добавляются по одной таблице на страницу отчета. Размеры и ориентация фотографий читаются
+        из заголовков изображений: горизонтальные фотографии размещаются в таблице 2 на 2, вертикальные 1 на 2,
+        небольшие 3 на 3.
+
+        Страницы фотографий заполняются по одной во время передачи документа и сразу записываются в него,
+        поэтому используемая память не растет с числом фотографий. Память для декодирования фотографий
+        наибольшей страницы добавляется к резервированию запроса до начала работы.
 
         :param report:
-        :return FileResponse: файл отчета
+        :param compression_level: уровень сжатия документа, по умолчанию из настроек
+        :return DocumentStreamingResponse: файл отчета
         """
+        tag_report(report.number)
         doc_filename: str = self._build_report_name(report)
-        if doc_filename not in os.listdir(settings.REPOSITORY.REPORTS_DIR):
-            raise DraftDocumentNotFoundException(f"Искомое имя: {doc_filename}")
-
-        doc = self.document_dao(f'{settings.REPOSITORY.REPORTS_DIR}/{doc_filename}')
+        doc = self.document_dao(self.storage.path(doc_filename))
         doc.add_section(horizontal=True)
 
-        photos_table_template: Optional[Table] = next(self.document_dao(
-            f"{settings.REPOSITORY.TEMPLATES_DIR}/{type(report).__name__}/photos_template.{settings.DOC_TYPE}"
-        ).get_tables(), None)
+        photos_template_path: str = f"{self._templates_dir(report)}/photos_template.{settings.DOC_TYPE}"
+        photos_table_template: Optional[Table] = next(self.templates.get(photos_template_path).get_tables(), None)
 
         if not photos_table_template:
             raise DocumentTemplateCorruptedException('Отсутствует шаблон таблицы фотографий')
 
-        for transport_unit in report.transport_units:
-            doc.append_paragraph(transport_unit.number)
-            for images_chunk in chunked(transport_unit.photos, 4):
-                photos_table = doc.append_table(deepcopy(photos_table_template))
-                self._fill_pictures_table(photos_table, images_chunk)
-                doc.add_page_break()
+        transport_units_photos: list[tuple[str, list[PhotoInfo]]] = [
+            (
+                transport_unit.number,
+                [
+                    probe_photo(photo, settings.PHOTOS.HEADER_SIZE, settings.PHOTOS.THUMBNAIL_MAX_SIDE)
+                    for photo in transport_unit.photos if photo.file
+                ]
+            )
+            for transport_unit in report.transport_units
+        ]
+        reservation: Optional[MemoryReservation] = current_reservation.get()
+        if reservation is not None:
+            reservation.grow(photos_cost(
+                [page for _, photos in transport_units_photos for page in plan_photos_pages(photos)]
+            ))
+        return self._stream_document(
+            doc,
+            doc_filename,
+            compression_level,
+            fragments=self._photos_pages(photos_template_path, photos_table_template, transport_units_photos)
+        )
 
-        doc.save(f"{settings.REPOSITORY.REPORTS_DIR}/{doc_filename}")
-        return FileResponse(
-            f"{settings.REPOSITORY.REPORTS_DIR}/{doc_filename}",
-            filename=doc_filename,
-            media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+    def update_section(
+            self,
+            report: BaseReport,
+            section_name: str,
+            units: Optional[list[str]] = None,
+            compression_level: Optional[int] = None
+    ) -> DocumentStreamingResponse:
+        """
+        Повторное заполнение раздела отчета в черновике.
+
+        Заполняется только раздел `section_name` для ТЕ `units` (для всех ТЕ, если они не указаны) и заменяет
+        свою прежнюю версию в черновике, изменения, внесенные в остальные части черновика вручную, сохраняются.
+
+        :param report: данные заявки
+        :param section_name: имя раздела из настроек `report_sections`
+        :param units: номера ТЕ
+        :param compression_level: уровень сжатия документа, по умолчанию из настроек
+        :return DocumentStreamingResponse: файл черновика отчета
+        """
+        tag_report(report.number)
+        filename: str = self._build_report_name(report)
+        doc = self.document_dao(self.storage.path(filename))
+        with stage('render'):
+            self.doc_filling_strategies_mapping[type(report)](
+                self.document_dao, report, templates=self.templates, fragments=self.fragments_cache
+            ).update_section(doc, section_name, units or [])
+        self.logger.info(f'Section "{section_name}" of "{filename}" updated for units {units or "all"}.')
+        return self._stream_document(doc, filename, compression_level)
+
+    def preview_report(self, report: BaseReport, thumbnails_url: str) -> str:
+        """
+        HTML-просмотр отчета: разделы заполняются по данным заявки и текстам таблиц скомпилированных шаблонов
+        без создания документа, фотографии и графики показываются миниатюрами.
+
+        :param report: данные заявки
+        :param thumbnails_url: адрес миниатюр относительно страницы просмотра
+        :return: HTML-страница отчета
+        """
+        tag_report(report.number)
+        with stage('preview'):
+            return SectionsReportPreview(
+                self.document_dao,
+                report,
+                templates=self.templates,
+                thumbnails=self.thumbnails,
+                images=self.preview_cache,
+                thumbnails_url=thumbnails_url,
+                thumbnail_size=settings.PREVIEW.THUMBNAIL_SIZE
+            ).render_html()
+
+    def _photos_pages(
+            self,
+            photos_template_path: str,
+            photos_table_template: Table,
+            transport_units_photos: list[tuple[str, list[PhotoInfo]]]
+    ) -> Iterator[Fragment]:
+        """Страницы фотографий ТЕ, заполняются по очереди в одном черновом документе из шаблона фотографий"""
+        scratch: AbstractDocumentDAO = self.document_dao(photos_template_path)
+        scratch.detach_fragment()
+        for number, photos in transport_units_photos:
+            title: Optional[str] = number
+            for page in plan_photos_pages(photos) or [None]:
+                with stage('photos'):
+                    if title is not None:
+                        scratch.append_paragraph(title)
+                        title = None
+                    if page is not None:
+                        photos_table: Table = deepcopy(photos_table_template)
+                        photos_table.reshape(page.rows, page.columns)
+                        photos_table = scratch.append_table(photos_table)
+                        self._fill_pictures_table(photos_table, page.photos)
+                        scratch.add_page_break()
+                        for photo in page.photos:
+                            photo.photo.file.release()
+                    fragment: Fragment = scratch.detach_fragment()
+                yield fragment
+
+    def _render_report(self, report: BaseReport) -> AbstractDocumentDAO:
+        with stage('render'):
+            doc = self.document_dao(
+                path=f"{self._templates_dir(report)}/header_template.{settings.DOC_TYPE}"
+            )
+            self.doc_filling_strategies_mapping[type(report)](
+                self.document_dao, report, templates=self.templates, fragments=self.fragments_cache
+            ).execute(doc)
+        return doc
+
+    def _render_and_save_report(self, report: BaseReport, compression_level: int) -> tuple[str, bytes]:
+        tag_report(report.number)
+        filename: str = self._build_report_name(report)
+        cache_key: tuple = self._render_cache_key(report, compression_level)
+        serialized_doc: Optional[bytes] = self.render_cache.get(cache_key)
+        if serialized_doc is None:
+            doc_stream = BytesIO()
+            self._render_report(report).write(doc_stream, compression_level)
+            serialized_doc = self._optimize_document(doc_stream.getvalue(), filename)
+            self.render_cache.put(cache_key, serialized_doc)
+        self.storage.write(filename, serialized_doc)
+        return filename, serialized_doc
+
+    def _render_cache_key(self, report: BaseReport, compression_level: int) -> tuple:
+        """
+        Ключ кэша отчетов: хэш данных заявки (фотографии хэшируются по содержимому), версия шаблонов,
+        уровень сжатия и текущая дата, попадающая в письмо протеста.
+
+        При изменении шаблонов кэш очищается.
+        """
+        report_type: str = type(report).__name__
+        templates_version: str = self.templates.version(self._templates_dir(report))
+        with self._templates_versions_lock:
+            if self._templates_versions.setdefault(report_type, templates_version) != templates_version:
+                self.logger.info(f'Templates of {report_type} changed, render caches cleared.')
+                self.render_cache.clear()
+                self.fragments_cache.clear()
+                self._templates_versions[report_type] = templates_version
+        return canonical_hash(report), templates_version, compression_level, date.today().isoformat()
+
+    @staticmethod
+    def _templates_dir(report: BaseReport) -> str:
+        return f"{settings.REPOSITORY.TEMPLATES_DIR}/{templates_name(type(report).__name__)}"
+
+    def _write_reports_archive(self, stream: BinaryIO, reports: List[BaseReport], compression_level: int):
+        """Запись архива отчетов в порядке их готовности, манифест записывается последним"""
+        manifest: list[dict] = []
+        archived_names: set[str] = set()
+        with ZipFile(stream, 'w') as archive, ThreadPoolExecutor(max_workers=settings.BATCH.WORKERS) as executor:
+            futures: dict[Future, int] = {
+                executor.submit(with_context(self._render_and_save_report), report, compression_level): n
+                for n, report in enumerate(reports)
+            }
+            for future in as_completed(futures):
+                n: int = futures[future]
+                item: dict = {'index': n, 'number': reports[n].number}
+                try:
+                    filename, doc = future.result()
+                except AppException as e:
+                    self.logger.exception(e.__doc__)
+                    item.update(status='error', detail=f"{e.__doc__}. {e.args[0] if e.args else ''}")
+                except Exception as e:
+                    self.logger.exception(e)
+                    item.update(status='error', detail="Непредвиденная ошибка сервера. Обратитесь к разработчику.")
+                else:
+                    if filename in archived_names:
+                        filename = f"{n}_{filename}"
+                    archived_names.add(filename)
+                    archive.writestr(filename, doc, compress_type=ZIP_STORED)
+                    item.update(status='ok', filename=filename)
+                manifest.append(item)
+            manifest.sort(key=lambda i: i['index'])
+            archive.writestr(
+                'manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2), compress_type=ZIP_DEFLATED
+            )
+        self.logger.info(f"Batch finished: {sum(item['status'] == 'ok' for item in manifest)}/{len(reports)} reports.")
+
+    def _stream_document(
+            self,
+            doc: AbstractDocumentDAO,
+            filename: str,
+            compression_level: Optional[int] = None,
+            cache_key: Optional[tuple] = None,
+            fragments: Optional[Iterable[Fragment]] = None
+    ) -> DocumentStreamingResponse:
+        """
+        Сериализация документа одновременно в ответ клиенту и в файл черновика.
+
+        Черновик заменяется только после успешной записи всего документа.
+        Если передан ключ кэша, сериализованный документ сохраняется в кэш отчетов.
+        Фрагменты `fragments` создаются и дописываются в конец документа по одному во время записи.
+        Если включена оптимизация документов, документ без фрагментов сериализуется целиком и оптимизируется
+        перед отправкой.
+        """
+        if compression_level is None:
+            compression_level = settings.STREAMING.COMPRESSION_LEVEL
+
+        def write(stream: BinaryIO):
+            if fragments is not None:
+                with doc.stream_writer(stream, compression_level) as writer:
+                    for fragment in fragments:
+                        writer.append_fragment(fragment)
+                return
+            if settings.OPTIMIZER.ENABLED:
+                serialized_doc = BytesIO()
+                doc.write(serialized_doc, compression_level)
+                optimized_doc: bytes = self._optimize_document(serialized_doc.getvalue(), filename)
+                stream.write(optimized_doc)
+                if cache_key is not None:
+                    self.render_cache.put(cache_key, optimized_doc)
+                return
+            if cache_key is None:
+                doc.write(stream, compression_level)
+                return
+            copying_stream = CopyingStream(stream)
+            doc.write(copying_stream, compression_level)
+            self.render_cache.put(cache_key, copying_stream.copy.getvalue())
+
+        self.logger.info(f'Streaming doc "{filename}".')
+        return DocumentStreamingResponse(
+            write,
+            filename=filename,
+            open_draft=lambda: self.storage.writer(filename),
+            chunk_size=settings.STREAMING.CHUNK_SIZE
+        )
+
+    def _optimize_document(self, doc: bytes, filename: str) -> bytes:
+        """
+        Оптимизация размера сериализованного документа, если она включена в настройках.
+
+        На оптимизацию отводится не больше времени, чем занимает загрузка клиентом ожидаемой экономии размера.
+        """
+        if not settings.OPTIMIZER.ENABLED or len(doc) < settings.OPTIMIZER.MIN_SIZE:
+            return doc
+        time_budget: float = min(
+            settings.OPTIMIZER.MAX_TIME, len(doc) * settings.OPTIMIZER.EXPECTED_SAVINGS / settings.OPTIMIZER.BANDWIDTH
+        )
+        with stage('optimize'):
+            optimized_doc, report = self.document_dao.optimize(
+                doc, time_budget, settings.OPTIMIZER.COMPRESSION_LEVEL, settings.OPTIMIZER.WORKERS
+            )
+        saved_time: float = (report.original_size - report.optimized_size) / settings.OPTIMIZER.BANDWIDTH
+        self.logger.info(
+            f'Doc "{filename}" optimized: {report.original_size} -> {report.optimized_size} bytes '
+            f'in {report.elapsed:.3f} s of {time_budget:.3f} s, download time saved {saved_time:.3f} s, '
+            f'steps {report.steps}' + (f', skipped {report.skipped}.' if report.skipped else '.')
+        )
+        return optimized_doc
+
+    def _stream_cached_document(self, doc: bytes, filename: str) -> DocumentStreamingResponse:
+        return DocumentStreamingResponse(
+            lambda stream: stream.write(doc),
+            filename=filename,
+            open_draft=lambda: self.storage.writer(filename),
+            chunk_size=settings.STREAMING.CHUNK_SIZE
         )
 
     def _build_report_name(self, report: BaseReport):
@@ -136,15 +524,19 @@ class AgentReportRepository:
                         f".{settings.DOC_TYPE}"
         return filename.replace('/', '')
 
-    def _fill_pictures_table(self, photos_table: Table, photos: list[Photo]) -> Table:
-        images: list[Image] = [
-            Image.open(photo.file).rotate(360 - photo.rotation, expand=True) for photo in photos if photo.file
-        ]
-        cells = [cell for n in range(2) for cell in photos_table.row_cells(n)]
-        for n, image in enumerate(images):
-            img_byte_array = BytesIO()
-            image.save(img_byte_array, format='PNG')
-            self.document_dao.insert_picture_into_cell(
-                cells[n], img_byte_array, width=photos_table.columns[0].width, height=photos_table.rows[0].height
-            )
+    def _fill_pictures_table(self, photos_table: Table, photos: list[PhotoInfo]) -> Table:
+        width: float = photos_table.columns[0].width - settings.PHOTOS.CELL_PADDING
+        height: float = photos_table.rows[0].height - settings.PHOTOS.CELL_PADDING
+        cells = [cell for row in photos_table.rows for cell in row.cells]
+        for cell, photo in zip(cells, photos):
+            try:
+                picture, picture_width, picture_height = render_photo(
+                    photo, width=width, height=height, dpi=settings.PHOTOS.DPI, quality=settings.PHOTOS.QUALITY
+                )
+            except PhotoCorruptedException as e:
+                # the document is already being sent, so the photo is replaced with a note instead of an error
+                self.logger.warning(f'{e.__doc__}: {e.args[0]}.')
+                cell.text = f'{e.__doc__}: {e.args[0]}'
+                continue
+            self.document_dao.insert_picture_into_cell(cell, picture, width=picture_width, height=picture_height)
         return photos_table
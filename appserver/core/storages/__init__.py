@@ -0,0 +1,2 @@
+from .abstract import AbstractReportStorage, StoredReport, StorageCompactor
+from .sharded import ShardedFileStorage
@@ -0,0 +1,87 @@
+import logging
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import BinaryIO, ContextManager, Optional
+
+
+@dataclass
+class StoredReport:
+    """Черновик отчета в хранилище"""
+    name: str
+    size: int
+    modified: float
+    archived: bool = False
+
+
+class AbstractReportStorage(ABC):
+    """Интерфейс хранилища черновиков отчетов, использующегося в репозитории бизнес-логики"""
+
+    @abstractmethod
+    def list(self) -> list[StoredReport]:
+        """Все черновики хранилища, включая архивные"""
+        ...
+
+    @abstractmethod
+    def exists(self, name: str) -> bool:
+        ...
+
+    @abstractmethod
+    def path(self, name: str) -> str:
+        """
+        Путь к файлу черновика в локальной файловой системе, архивный черновик восстанавливается.
+
+        :raises DraftDocumentNotFoundException:
+        """
+        ...
+
+    @abstractmethod
+    def writer(self, name: str) -> ContextManager[BinaryIO]:
+        """Файл для записи черновика, черновик заменяется только после успешного завершения записи"""
+        ...
+
+    def write(self, name: str, doc: bytes):
+        with self.writer(name) as draft:
+            draft.write(doc)
+
+    def compact(self, older_than: float) -> int:
+        """
+        Перенос черновиков, не использовавшихся `older_than` секунд, в архив.
+
+        :return: число перенесенных черновиков, хранилища без архива черновики не переносят
+        """
+        return 0
+
+
+class StorageCompactor:
+    """Фоновый поток переноса черновиков хранилища в архив каждые `interval` секунд"""
+
+    def __init__(self, storage: AbstractReportStorage, older_than: float, interval: float):
+        self.logger: logging.Logger = logging.getLogger("storage")
+        self.storage: AbstractReportStorage = storage
+        self.older_than: float = older_than
+        self.interval: float = interval
+        self._stopped: threading.Event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='storage-compactor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                archived: int = self.storage.compact(self.older_than)
+            except Exception as e:
+                self.logger.exception(e)
+            else:
+                if archived:
+                    self.logger.info(f'{archived} drafts moved to the archive.')
+            self._stopped.wait(self.interval)
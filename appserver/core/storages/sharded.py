@@ -0,0 +1,298 @@
+import hashlib
+import json
+import logging
+import lzma
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+from zipfile import BadZipFile, ZipFile, ZipInfo
+
+from ..exceptions import DraftDocumentNotFoundException
+from .abstract import AbstractReportStorage, StoredReport
+
+
+class ShardedFileStorage(AbstractReportStorage):
+    """
+    Хранилище черновиков в подкаталогах локального каталога по первым `shard_chars` символам SHA-256 имени.
+
+    Архив: части черновиков хранятся один раз для всех черновиков по SHA-256 содержимого со сжатием LZMA,
+    черновик заменяется манифестом своих частей и восстанавливается при обращении к нему.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            extension: str,
+            shard_chars: int = 2,
+            compression_level: int = 6,
+            archive_preset: int = 6
+    ):
+        self.logger: logging.Logger = logging.getLogger("storage")
+        self.directory: str = directory
+        self.extension: str = extension
+        self.shard_chars: int = shard_chars
+        self.compression_level: int = compression_level
+        self.archive_preset: int = archive_preset
+        self._drafts_dir: str = f"{directory}/drafts"
+        self._archive_dir: str = f"{directory}/archive"
+        self._objects_dir: str = f"{directory}/objects"
+        self._lock: threading.Lock = threading.Lock()
+        self._released: bool = True
+        self._archiving: set[str] = set()
+        self._interrupted: set[str] = set()
+        for tier_dir in (self._drafts_dir, self._archive_dir, self._objects_dir):
+            os.makedirs(tier_dir, exist_ok=True)
+        self._migrate()
+
+    def list(self) -> list[StoredReport]:
+        reports: list[StoredReport] = [
+            StoredReport(entry.name, stat.st_size, stat.st_mtime) for entry, stat in self._drafts()
+        ]
+        for manifest_path in self._manifests():
+            try:
+                manifest: dict = self._read_manifest(manifest_path)
+            except FileNotFoundError:
+                continue
+            reports.append(StoredReport(manifest['name'], manifest['size'], manifest['modified'], archived=True))
+        return reports
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self._draft_path(name)) or os.path.exists(self._manifest_path(name))
+
+    def path(self, name: str) -> str:
+        path: str = self._draft_path(name)
+        with self._lock:
+            try:
+                stat: os.stat_result = os.stat(path)
+            except FileNotFoundError:
+                pass
+            else:
+                os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+                self._use(name)
+                return path
+        self._restore(name, path)
+        return path
+
+    @contextmanager
+    def writer(self, name: str) -> Iterator[BinaryIO]:
+        path: str = self._draft_path(name)
+        tmp_path: str = f"{path}.{threading.get_ident()}.part"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with open(tmp_path, "wb") as draft:
+                yield draft
+        except BaseException:
+            _remove_file(tmp_path)
+            raise
+        with self._lock:
+            os.replace(tmp_path, path)
+            self._remove_manifest(name)
+            self._use(name)
+        self.logger.info(f'Doc saved to "{path}".')
+
+    def compact(self, older_than: float) -> int:
+        """Перенос черновиков в архив и удаление частей, на которые не ссылаются манифесты"""
+        threshold: float = time.time() - older_than
+        archived: int = 0
+        for entry, stat in self._drafts():
+            if max(stat.st_atime, stat.st_mtime) >= threshold:
+                continue
+            try:
+                archived += self._archive(entry.path, entry.name)
+            except BadZipFile:
+                self.logger.warning(f'Draft "{entry.path}" is not a document, it is not archived.')
+        if self._released:
+            self._collect_objects()
+        return archived
+
+    def _draft_path(self, name: str) -> str:
+        """
+        :raises DraftDocumentNotFoundException: the name is not a name of a draft
+        """
+        if '/' in name or '\\' in name or '\0' in name or name.startswith('.') or \
+                not name.endswith(f'.{self.extension}'):
+            raise DraftDocumentNotFoundException(f"Искомое имя: {name}")
+        return f"{self._drafts_dir}/{self._shard(name)}/{name}"
+
+    def _manifest_path(self, name: str) -> str:
+        key: str = hashlib.sha256(name.encode()).hexdigest()
+        return f"{self._archive_dir}/{key[:self.shard_chars]}/{key}.json"
+
+    def _object_path(self, key: str) -> str:
+        return f"{self._objects_dir}/{key[:2]}/{key}.xz"
+
+    def _shard(self, name: str) -> str:
+        return hashlib.sha256(name.encode()).hexdigest()[:self.shard_chars]
+
+    def _drafts(self) -> Iterator[tuple[os.DirEntry, os.stat_result]]:
+        for shard in os.scandir(self._drafts_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(f'.{self.extension}') and entry.is_file():
+                    try:
+                        yield entry, entry.stat()
+                    except FileNotFoundError:
+                        continue
+
+    def _manifests(self) -> Iterator[str]:
+        for shard in os.scandir(self._archive_dir):
+            if shard.is_dir():
+                yield from (entry.path for entry in os.scandir(shard.path) if entry.name.endswith('.json'))
+
+    @staticmethod
+    def _read_manifest(path: str) -> dict:
+        with open(path, encoding='utf-8') as manifest:
+            return json.load(manifest)
+
+    def _migrate(self):
+        """Перенос черновиков из корня каталога в подкаталоги"""
+        moved: int = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(f'.{self.extension}') and entry.is_file():
+                path: str = self._draft_path(entry.name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(entry.path, path)
+                moved += 1
+        if moved:
+            self.logger.info(f'{moved} drafts moved to subdirectories of "{self._drafts_dir}".')
+
+    def _use(self, name: str):
+        if name in self._archiving:
+            self._interrupted.add(name)
+
+    def _archive(self, path: str, name: str) -> bool:
+        """Замена черновика манифестом, черновик остается, если к нему обратились во время переноса"""
+        with self._lock:
+            self._archiving.add(name)
+        try:
+            return self._archive_entries(path, name)
+        finally:
+            with self._lock:
+                self._archiving.discard(name)
+                self._interrupted.discard(name)
+
+    def _archive_entries(self, path: str, name: str) -> bool:
+        stat: os.stat_result = os.stat(path)
+        entries: list[dict] = []
+        try:
+            with ZipFile(path) as package:
+                for info in package.infolist():
+                    data: bytes = package.read(info)
+                    key: str = hashlib.sha256(data).hexdigest()
+                    self._write_object(key, data)
+                    entries.append({
+                        'name': info.filename,
+                        'hash': key,
+                        'date_time': info.date_time,
+                        'compress_type': info.compress_type,
+                        'external_attr': info.external_attr
+                    })
+        except BaseException:
+            if entries:
+                self._released = True
+            raise
+        manifest_path: str = self._manifest_path(name)
+        tmp_path: str = f"{manifest_path}.{threading.get_ident()}.part"
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as manifest:
+            json.dump(
+                {'name': name, 'size': stat.st_size, 'modified': stat.st_mtime, 'entries': entries},
+                manifest, ensure_ascii=False
+            )
+
+        with self._lock:
+            if name in self._interrupted or not os.path.exists(path):
+                _remove_file(tmp_path)
+                self._released = True
+                return False
+            os.replace(tmp_path, manifest_path)
+            os.remove(path)
+        return True
+
+    def _write_object(self, key: str, data: bytes):
+        path: str = self._object_path(key)
+        if os.path.exists(path):
+            return
+        tmp_path: str = f"{path}.{threading.get_ident()}.part"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'wb') as stored_object:
+            stored_object.write(lzma.compress(data, preset=self.archive_preset))
+        os.replace(tmp_path, path)
+
+    def _restore(self, name: str, path: str):
+        """
+        Восстановление черновика из архива во временный файл без блокировки хранилища,
+        черновик, записанный или восстановленный за это время, не заменяется.
+
+        :raises DraftDocumentNotFoundException: черновика нет в архиве
+        """
+        manifest_path: str = self._manifest_path(name)
+        tmp_path: str = f"{path}.{threading.get_ident()}.part"
+        try:
+            manifest: dict = self._read_manifest(manifest_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with ZipFile(tmp_path, 'w') as package:
+                for entry in manifest['entries']:
+                    info = ZipInfo(entry['name'], date_time=tuple(entry['date_time']))
+                    info.compress_type = entry['compress_type']
+                    info.external_attr = entry['external_attr']
+                    with open(self._object_path(entry['hash']), 'rb') as stored_object:
+                        data: bytes = lzma.decompress(stored_object.read())
+                    package.writestr(info, data, compresslevel=self.compression_level)
+        except FileNotFoundError:
+            _remove_file(tmp_path)
+            if os.path.exists(path):
+                return
+            raise DraftDocumentNotFoundException(f"Искомое имя: {name}")
+        except BaseException:
+            _remove_file(tmp_path)
+            raise
+        with self._lock:
+            restored: bool = not os.path.exists(path) and os.path.exists(manifest_path)
+            if restored:
+                os.replace(tmp_path, path)
+                os.utime(path, (time.time(), manifest['modified']))
+                self._remove_manifest(name)
+        if not restored:
+            _remove_file(tmp_path)
+            if not os.path.exists(path):
+                raise DraftDocumentNotFoundException(f"Искомое имя: {name}")
+            return
+        self.logger.info(f'Doc "{name}" restored from the archive.')
+
+    def _remove_manifest(self, name: str):
+        try:
+            os.remove(self._manifest_path(name))
+        except FileNotFoundError:
+            return
+        self._released = True
+
+    def _collect_objects(self):
+        """Удаление частей, на которые не ссылаются манифесты, выполняется в потоке переноса черновиков"""
+        self._released = False
+        referenced: set[str] = set()
+        for manifest_path in self._manifests():
+            try:
+                referenced.update(entry['hash'] for entry in self._read_manifest(manifest_path)['entries'])
+            except FileNotFoundError:
+                continue
+        removed: int = 0
+        for shard in os.scandir(self._objects_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.xz') and entry.name[:-3] not in referenced:
+                    os.remove(entry.path)
+                    removed += 1
+        if removed:
+            self.logger.info(f'{removed} archived entries no longer used removed.')
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return
@@ -0,0 +1,171 @@
+import io
+import itertools
+import logging
+import queue
+import threading
+from contextlib import nullcontext
+from typing import BinaryIO, Callable, ContextManager, Iterator, Optional
+from urllib.parse import quote
+
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from fastapi.responses import StreamingResponse
+
+from .profiling import stage, with_context
+
+
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+
+class TeeStream(io.RawIOBase):
+    """
+    Write-only unseekable stream duplicating written bytes into a file and into a queue of chunks.
+
+    Zip archives written into unseekable streams are built with data descriptors, so the archive
+    can be sent to the client while it is still being serialized.
+    """
+
+    def __init__(self, file: Optional[BinaryIO], chunks: queue.Queue, chunk_size: int):
+        super().__init__()
+        self.file: Optional[BinaryIO] = file
+        self._chunks: queue.Queue = chunks
+        self._chunk_size: int = chunk_size
+        self._buffer: bytearray = bytearray()
+        self.detached: threading.Event = threading.Event()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self.file:
+            self.file.write(data)
+        if not self.detached.is_set():
+            self._buffer += data
+            if len(self._buffer) >= self._chunk_size:
+                self.push(bytes(self._buffer))
+                self._buffer.clear()
+        return len(data)
+
+    def flush(self):
+        if self.file:
+            self.file.flush()
+
+    def finish(self):
+        """Push the rest of buffered bytes to the queue"""
+        if self._buffer and not self.detached.is_set():
+            self.push(bytes(self._buffer))
+        self._buffer.clear()
+
+    def push(self, chunk: bytes):
+        while not self.detached.is_set():
+            try:
+                self._chunks.put(chunk, timeout=.1)
+                return
+            except queue.Full:
+                continue
+
+
+class CopyingStream(io.RawIOBase):
+    """Write-only unseekable stream writing bytes into the target stream and keeping a copy of them"""
+
+    def __init__(self, target: BinaryIO):
+        super().__init__()
+        self._target: BinaryIO = target
+        self.copy: io.BytesIO = io.BytesIO()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._target.write(data)
+        return self.copy.write(data)
+
+
+class DocumentStream:
+    """
+    Iterable of document bytes chunks.
+
+    Document serialization runs in a background thread writing into a TeeStream, so the first bytes reach
+    the client before the whole archive is built. The draft is written into the file opened by `open_draft`
+    which replaces the draft only when serialization succeeds. If the client disconnects the draft is still
+    written completely.
+    """
+    _END = object()
+
+    def __init__(
+            self,
+            write: Callable[[BinaryIO], None],
+            open_draft: Optional[Callable[[], ContextManager[BinaryIO]]] = None,
+            chunk_size: int = 64 * 1024,
+            queue_size: int = 16
+    ):
+        self.logger: logging.Logger = logging.getLogger("streaming")
+        self._write: Callable[[BinaryIO], None] = write
+        self._open_draft: Optional[Callable[[], ContextManager[BinaryIO]]] = open_draft
+        self._chunk_size: int = chunk_size
+        self._queue_size: int = queue_size
+
+    def __iter__(self) -> Iterator[bytes]:
+        chunks: queue.Queue = queue.Queue(maxsize=self._queue_size)
+        tee = TeeStream(None, chunks, self._chunk_size)
+        producer = threading.Thread(target=with_context(self._produce), args=(tee,), daemon=True)
+        producer.start()
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is self._END:
+                    return
+                if isinstance(chunk, BaseException):
+                    raise chunk
+                yield chunk
+        finally:
+            tee.detached.set()
+
+    def _produce(self, tee: TeeStream):
+        try:
+            with self._open_draft() if self._open_draft else nullcontext() as draft:
+                tee.file = draft
+                with stage('stream'):
+                    self._write(tee)
+                tee.finish()
+            tee.push(self._END)
+        except Exception as e:
+            self.logger.exception(e)
+            tee.push(e)
+
+
+class DocumentStreamingResponse(StreamingResponse):
+    """
+    Streaming response with a document attachment written by `write` callable.
+
+    When sent, the response waits for the first chunk of the document in a worker thread, so errors of preparing
+    the serialization (e.g. a corrupted template) are raised before the status is sent and reach the client
+    as error responses, and the event loop is not blocked meanwhile.
+    """
+
+    def __init__(
+            self,
+            write: Callable[[BinaryIO], None],
+            filename: str,
+            open_draft: Optional[Callable[[], ContextManager[BinaryIO]]] = None,
+            chunk_size: int = 64 * 1024,
+            media_type: str = DOCX_MEDIA_TYPE
+    ):
+        self._chunks: Iterator[bytes] = iter(DocumentStream(write, open_draft=open_draft, chunk_size=chunk_size))
+        super().__init__(
+            self._chunks,
+            media_type=media_type,
+            headers={"Content-Disposition": content_disposition(filename)}
+        )
+
+    async def __call__(self, scope, receive, send):
+        first_chunk: bytes = await run_in_threadpool(next, self._chunks, b'')
+        self.body_iterator = iterate_in_threadpool(itertools.chain([first_chunk], self._chunks))
+        await super().__call__(scope, receive, send)
+
+
+def content_disposition(filename: str) -> str:
+    """Content-Disposition header value in the same form as FileResponse uses"""
+    quoted_filename: str = quote(filename)
+    if quoted_filename != filename:
+        return f"attachment; filename*=utf-8''{quoted_filename}"
+    return f'attachment; filename="{filename}"'
@@ -0,0 +1,272 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+from dataclasses import asdict, dataclass, field
+from typing import Any, Final, Iterable, Optional, Type
+
+from pydantic import BaseModel
+
+from .document_daos import AbstractDocumentDAO, TableGrid
+from .exceptions import DocumentTemplateCorruptedException
+from .template_engine import TemplateEngine
+
+
+@dataclass
+class TemplateSpec:
+    """
+    Requirements of a report strategy to a document template.
+
+    :param tables: minimal number of tables
+    :param contexts: sources of values for '{{ key }}' keys of the tables: 'header' (report header dict),
+        'report' (report model) and 'transport_unit' (transport unit model of the report)
+    :param extra_keys: keys filled by the strategy itself
+    :param cargo_tables_offset: when set, paragraphs of the template are names of cargos and the table
+        of a cargo has index of its paragraph plus the offset
+    :param cargo_extra_tables: number of additional tables following the table of a cargo
+    :param optional_rows: rows with unknown keys are dropped by the strategy instead of being an error
+    """
+    tables: int = 1
+    contexts: tuple[str, ...] = ()
+    extra_keys: tuple[str, ...] = ()
+    cargo_tables_offset: Optional[int] = None
+    cargo_extra_tables: dict[str, int] = field(default_factory=dict)
+    optional_rows: bool = False
+
+
+@dataclass
+class CompiledTemplate:
+    """Result of template checks: signature of the file, its cargos, keys and cells texts of each table"""
+    file: str
+    sha256: str
+    tables: int
+    cargos: list[str]
+    keys: list[list[str]]
+    grids: list[TableGrid]
+
+    def __post_init__(self):
+        self.grids = [grid if isinstance(grid, TableGrid) else TableGrid(**grid) for grid in self.grids]
+
+
+class TemplateCompiler:
+    """
+    Ahead-of-time checks of document templates: tables, cargos and '{{ key }}' keys against report models.
+    Results are stored in `compiled.json` of the templates directory with report types they were checked for.
+    """
+    artifact_name: Final[str] = 'compiled.json'
+
+    def __init__(self, document_dao: Type[AbstractDocumentDAO], templates_dir: str, doc_type: str):
+        self.logger: logging.Logger = logging.getLogger("template_compiler")
+        self.document_dao: Type[AbstractDocumentDAO] = document_dao
+        self.templates_dir: str = templates_dir
+        self.doc_type: str = doc_type
+
+    def compile(
+            self, report_model: Type[BaseModel], templates: str, specs: dict[str, TemplateSpec]
+    ) -> tuple[dict[str, CompiledTemplate], list[str]]:
+        """
+        :return: compiled templates by template names and errors found in templates
+        """
+        compiled: dict[str, CompiledTemplate] = {}
+        errors: list[str] = []
+        for name, spec in specs.items():
+            path: str = self._template_path(templates, name)
+            try:
+                template: AbstractDocumentDAO = self.document_dao(path)
+            except Exception as e:
+                errors.append(f'{path}: шаблон не найден или не читается ({e})')
+                continue
+            template_errors: list[str] = []
+            compiled[name] = self._compile_template(report_model, path, template, spec, template_errors)
+            errors += [f'{path}: {error}' for error in template_errors]
+        return compiled, errors
+
+    def load(
+            self, report_model: Type[BaseModel], templates: str, specs: dict[str, TemplateSpec]
+    ) -> dict[str, CompiledTemplate]:
+        """
+        Compiled templates of the report type from the artifact, compiled anew and stored when the artifact
+        is stale or was not checked for the report type.
+
+        :raises DocumentTemplateCorruptedException: templates do not meet the requirements
+        """
+        artifact_path: str = self._artifact_path(templates)
+        stored, checks = self._read_artifact(artifact_path)
+        compiled: dict[str, CompiledTemplate] = {
+            name: stored[name] for name in specs
+            if name in stored and stored[name].sha256 == self._file_hash(self._template_path(templates, name))
+        }
+        if len(compiled) == len(specs) and checks.get(report_model.__name__) == _check_hash(specs, compiled):
+            return compiled
+        self.logger.warning(
+            f'Compiled templates "{artifact_path}" are missing or stale for {report_model.__name__}, compiling.'
+        )
+        compiled, errors = self.compile(report_model, templates, specs)
+        if errors:
+            raise DocumentTemplateCorruptedException('\n'.join(errors))
+        try:
+            self.write(report_model, templates, specs, compiled)
+        except OSError as e:
+            self.logger.warning(f'Compiled templates "{artifact_path}" are not stored: {e}.')
+        return compiled
+
+    def write(
+            self,
+            report_model: Type[BaseModel],
+            templates: str,
+            specs: dict[str, TemplateSpec],
+            compiled: dict[str, CompiledTemplate]
+    ) -> str:
+        """Add templates compiled for the report type to the artifact of their directory"""
+        artifact_path: str = self._artifact_path(templates)
+        stored, checks = self._read_artifact(artifact_path)
+        stored.update(compiled)
+        checks[report_model.__name__] = _check_hash(specs, compiled)
+        tmp_path: str = f'{artifact_path}.{os.getpid()}.part'
+        with open(tmp_path, 'w', encoding='utf-8') as artifact:
+            json.dump(
+                {
+                    'checks': dict(sorted(checks.items())),
+                    'templates': {name: asdict(template) for name, template in sorted(stored.items())}
+                },
+                artifact, ensure_ascii=False, indent=2
+            )
+        os.replace(tmp_path, artifact_path)
+        return artifact_path
+
+    def _compile_template(
+            self,
+            report_model: Type[BaseModel],
+            path: str,
+            template: AbstractDocumentDAO,
+            spec: TemplateSpec,
+            errors: list[str]
+    ) -> CompiledTemplate:
+        tables: list = list(template.get_tables())
+        cargos: list[str] = []
+        required_tables: int = spec.tables
+        if spec.cargo_tables_offset is not None:
+            cargos = [paragraph.lower().strip() for paragraph in template.get_paragraphs() if paragraph.strip()]
+            for number, cargo in enumerate(cargos):
+                last_table: int = number + spec.cargo_tables_offset + spec.cargo_extra_tables.get(cargo, 0)
+                if last_table >= len(tables):
+                    errors.append(f'отсутствует таблица {last_table + 1} для "{cargo}"')
+            required_tables = max(required_tables, len(cargos) + spec.cargo_tables_offset)
+        if len(tables) < required_tables:
+            errors.append(f'таблиц {len(tables)}, требуется не менее {required_tables}')
+
+        keys: list[list[str]] = []
+        for number, table in enumerate(tables):
+            table_keys: list[str] = sorted({
+                key[2:-2].strip()
+                for row in table.rows for cell in row.cells
+                for key in TemplateEngine.key_pattern.findall(cell.text)
+            })
+            for key in table_keys:
+                if not spec.optional_rows and not self._key_exists(report_model, spec, key):
+                    errors.append(f'таблица {number + 1}: неизвестный ключ "{{{{ {key} }}}}"')
+            keys.append(table_keys)
+        grids: list[TableGrid] = [self.document_dao.get_table_grid(table) for table in tables]
+        return CompiledTemplate(os.path.basename(path), self._file_hash(path), len(tables), cargos, keys, grids)
+
+    def _key_exists(self, report_model: Type[BaseModel], spec: TemplateSpec, key: str) -> bool:
+        if key in spec.extra_keys:
+            return True
+        for context in spec.contexts:
+            if context == 'header' and key.split('.')[0] in _header_keys(report_model):
+                return True
+            if context == 'report' and _model_has_path(report_model, key):
+                return True
+            transport_unit_model: Any = report_model.__fields__['transport_units'].type_
+            if context == 'transport_unit' and _model_has_path(transport_unit_model, key):
+                return True
+        return False
+
+    def _template_path(self, templates: str, name: str) -> str:
+        return f"{self.templates_dir}/{templates}/{name}.{self.doc_type}"
+
+    def _artifact_path(self, templates: str) -> str:
+        return f"{self.templates_dir}/{templates}/{self.artifact_name}"
+
+    @staticmethod
+    def _read_artifact(path: str) -> tuple[dict[str, CompiledTemplate], dict[str, str]]:
+        """
+        :return: compiled templates by names and hashes of checks by report types, empty if there is no artifact
+        """
+        try:
+            with open(path, encoding='utf-8') as artifact:
+                content: dict[str, Any] = json.load(artifact)
+            templates: dict[str, Any] = content['templates']
+            return {name: CompiledTemplate(**template) for name, template in templates.items()}, dict(content['checks'])
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            return {}, {}
+
+    @staticmethod
+    def _file_hash(path: str) -> Optional[str]:
+        try:
+            with open(path, 'rb') as template:
+                return hashlib.sha256(template.read()).hexdigest()
+        except FileNotFoundError:
+            return None
+
+
+def _check_hash(specs: dict[str, TemplateSpec], compiled: dict[str, CompiledTemplate]) -> str:
+    """Hash of requirements of a report type and of the template files they were checked against"""
+    return hashlib.sha256(json.dumps(
+        {name: [asdict(spec), compiled[name].sha256 if name in compiled else None] for name, spec in specs.items()},
+        sort_keys=True
+    ).encode()).hexdigest()
+
+
+def _model_has_path(model: Any, path: str) -> bool:
+    """Whether a dotted path of fields exists in the model, lists of models are looked through"""
+    for part in path.split('.'):
+        fields: Optional[dict] = getattr(model, '__fields__', None)
+        if fields is None or part not in fields:
+            return False
+        model = fields[part].type_
+    return True
+
+
+def _header_keys(report_model: Type[BaseModel]) -> set[str]:
+    """Keys of the report header computed for an empty report"""
+    empty_report = report_model.construct(**{**{name: None for name in report_model.__fields__}, 'transport_units': []})
+    return set(empty_report.header)
+
+
+def main(argv: Optional[Iterable[str]] = None) -> int:
+    """Compile templates of all report types: `python -m appserver.core.template_compiler`"""
+    from dynaconf import settings
+    from . import models
+    from .configuration import AgentReportRepositoryConfigurator
+    from .report_sections import report_sections, templates_name, templates_specs
+
+    parser = argparse.ArgumentParser(description='Проверка и компиляция шаблонов отчетов')
+    parser.add_argument('--templates-dir', default=settings.REPOSITORY.TEMPLATES_DIR, help='каталог шаблонов')
+    parser.add_argument('--check', action='store_true', help='только проверить шаблоны, не записывая результат')
+    args = parser.parse_args(argv)
+
+    compiler = TemplateCompiler(
+        AgentReportRepositoryConfigurator().documents_dao, args.templates_dir, settings.DOC_TYPE
+    )
+    failed: bool = False
+    for report_type in settings.REPORT_TYPES:
+        report_model: Type[BaseModel] = getattr(models, report_type)
+        templates: str = templates_name(report_type)
+        specs: dict[str, TemplateSpec] = templates_specs(report_sections(report_type))
+        compiled, errors = compiler.compile(report_model, templates, specs)
+        for error in errors:
+            print(error, file=sys.stderr)
+        if errors:
+            failed = True
+        elif not args.check:
+            print(compiler.write(report_model, templates, specs, compiled))
+        else:
+            print(f'{report_type}: OK')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
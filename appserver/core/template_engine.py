@@ -42,6 +42,8 @@ class TemplateEngine:
         :param cell_handler: callable object that will receive a Cell object after text replacement
         :return: processed table
         """
+        if isinstance(values, BaseModel):
+            values = values.dict()
         for row in table.rows:
             for cell in row.cells:
                 cell.text = cls.replace_text(cell.text, values)
@@ -0,0 +1,78 @@
+import hashlib
+import logging
+import os
+import threading
+from typing import Iterable, Optional, Type
+
+from .document_daos import AbstractDocumentDAO
+from .exceptions import DocumentTemplateNotFoundException
+from .template_compiler import CompiledTemplate
+
+
+class TemplatesCache:
+    """
+    Parsed document templates shared between report renderings.
+
+    Cached templates are read-only: tables taken from them have to be copied before filling.
+    A template is parsed again when its file modification time changes, its compilation result
+    is dropped then. Templates are files with the `extension` of documents.
+    """
+
+    def __init__(self, document_dao: Type[AbstractDocumentDAO], extension: str = 'docx'):
+        self.logger: logging.Logger = logging.getLogger("templates")
+        self.document_dao: Type[AbstractDocumentDAO] = document_dao
+        self.extension: str = extension
+        self._lock: threading.Lock = threading.Lock()
+        self._templates: dict[str, tuple[int, AbstractDocumentDAO]] = {}
+        self._compiled: dict[str, tuple[int, CompiledTemplate]] = {}
+
+    def get(self, path: str) -> AbstractDocumentDAO:
+        try:
+            mtime: int = os.stat(path).st_mtime_ns
+        except FileNotFoundError as e:
+            raise DocumentTemplateNotFoundException(path) from e
+        with self._lock:
+            cached = self._templates.get(path)
+            if cached and cached[0] == mtime:
+                return cached[1]
+            self.logger.debug(f'Parsing template "{path}".')
+            template: AbstractDocumentDAO = self.document_dao(path)
+            self._templates[path] = (mtime, template)
+            return template
+
+    def preload(self, directory: str, compiled: Iterable[CompiledTemplate]):
+        """Parse compiled templates of the directory in advance and keep results of their compilation"""
+        for template in compiled:
+            path: str = f"{directory}/{template.file}"
+            self.get(path)
+            with self._lock:
+                self._compiled[path] = (self._templates[path][0], template)
+
+    def compiled(self, path: str) -> Optional[CompiledTemplate]:
+        """Compilation result of the template if the template has not been changed since the compilation"""
+        with self._lock:
+            cached = self._compiled.get(path)
+        try:
+            return cached[1] if cached and cached[0] == os.stat(path).st_mtime_ns else None
+        except FileNotFoundError:
+            return None
+
+    def version(self, templates_dir: str) -> str:
+        """
+        Version of templates directory: changes when any template is added, removed or modified,
+        other files of the directory (e.g. the compilation artifact) do not count
+        """
+        try:
+            entries: list[os.DirEntry] = sorted(os.scandir(templates_dir), key=lambda entry: entry.name)
+        except FileNotFoundError as e:
+            raise DocumentTemplateNotFoundException(templates_dir) from e
+        signature: str = ';'.join(
+            f"{entry.name}:{entry.stat().st_mtime_ns}:{entry.stat().st_size}" for entry in entries
+            if entry.name.endswith(f'.{self.extension}') and entry.is_file()
+        )
+        return hashlib.sha1(signature.encode()).hexdigest()
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+            self._compiled.clear()
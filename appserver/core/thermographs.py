@@ -0,0 +1,405 @@
+import hashlib
+import math
+import re
+from binascii import a2b_base64
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from io import BytesIO
+from typing import Any, Final, Iterator, Optional
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from .exceptions import ReadingsCorruptedException
+
+
+class LoggerReadings:
+    """
+    Raw thermograph logger readings: CSV/TSV text with a timestamp and a temperature in each row.
+
+    Accepts plain text or a base64 data URL of a text file. Text is decoded on first access and parsed
+    in chunks, so rows are never held in memory as Python objects all at once.
+
+    Supported timestamps: `YYYY-MM-DD HH:MM[:SS]`, `DD.MM.YYYY HH:MM[:SS]`, `DD/MM/YYYY HH:MM[:SS]`
+    (date and time may be separate columns) and Unix time in seconds. Header rows, an index column
+    before the timestamp and columns after the temperature are ignored. Decimal comma is supported.
+    """
+    data_url_pattern: Final[re.Pattern] = re.compile(r"data:[\w/.+-]*;base64,")
+    date_time_value_pattern: Final[re.Pattern] = re.compile(
+        r"^[^\S\n]*(?:\d+[,;\t][^\S\n]*)?"
+        r"(?:(\d{4})-(\d{1,2})-(\d{1,2})|(\d{1,2})[./](\d{1,2})[./](\d{4}))"
+        r"[T ,;\t]+(\d{1,2}):(\d{2})(?::(\d{2}))?(?:\.\d+)?"
+        r"[^\S\n]*[,;\t][^\S\n]*([-+]?\d+(?:[.,]\d+)?)",
+        re.MULTILINE
+    )
+    unix_time_value_pattern: Final[re.Pattern] = re.compile(
+        r"^[^\S\n]*(\d{9,10})(?:\.\d+)?[^\S\n]*[,;\t][^\S\n]*([-+]?\d+(?:[.,]\d+)?)",
+        re.MULTILINE
+    )
+
+    def __init__(self, source: str = ''):
+        self._source: str = source
+        self._text: Optional[str] = None
+        self._digest: Optional[str] = None
+
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+
+    @classmethod
+    def __modify_schema__(cls, field_schema: dict):
+        field_schema.update(type='string', format='csv')
+
+    @classmethod
+    def validate(cls, value: Any) -> 'LoggerReadings':
+        if isinstance(value, cls):
+            return value
+        if not isinstance(value, str):
+            raise TypeError('readings text or base64 data URL required')
+        return cls(value)
+
+    @property
+    def text(self) -> str:
+        """
+        Decoded text of readings
+
+        :raises ReadingsCorruptedException: the data URL payload is not base64
+        """
+        if self._text is None:
+            header = self.data_url_pattern.match(self._source)
+            if not header:
+                self._text = self._source
+            else:
+                try:
+                    raw: bytes = a2b_base64(memoryview(self._source.encode('ascii'))[header.end():])
+                except ValueError as e:  # binascii.Error of malformed base64 and non-ASCII characters alike
+                    raise ReadingsCorruptedException('Данные показаний не в формате base64') from e
+                try:
+                    self._text = raw.decode('utf-8-sig')
+                except UnicodeDecodeError:
+                    self._text = raw.decode('cp1251')
+        return self._text
+
+    def digest(self) -> str:
+        if self._digest is None:
+            self._digest = hashlib.sha256(self._source.encode()).hexdigest()
+        return self._digest
+
+    def chunks(self, chunk_size: int = 4 * 1024 * 1024) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """
+        Parsed readings in chunks of about `chunk_size` characters of text.
+
+        :return: iterator of (unix times in seconds as int64 array, temperatures as float64 array)
+        """
+        text: str = self.text
+        pattern: Optional[re.Pattern] = None
+        start: int = 0
+        while start < len(text):
+            end: int = text.find('\n', start + chunk_size)
+            end = len(text) if end == -1 else end + 1
+            chunk: str = text[start:end]
+            start = end
+            if pattern is None:
+                pattern = self.date_time_value_pattern if self.date_time_value_pattern.search(chunk) \
+                    else self.unix_time_value_pattern
+            rows: list[tuple] = pattern.findall(chunk)
+            if not rows:
+                continue
+            columns: list[tuple[str, ...]] = list(zip(*rows))
+            if pattern is self.unix_time_value_pattern:
+                yield _parse_ints(columns[0]), _parse_floats(columns[1])
+            else:
+                yield _parse_date_times(columns), _parse_floats(columns[9])
+
+    def __bool__(self) -> bool:
+        return bool(self._source)
+
+    def __str__(self) -> str:
+        return self._source
+
+
+def _parse_ints(column: tuple[str, ...]) -> np.ndarray:
+    """Integer column with empty strings of unmatched optional groups read as zeros"""
+    if '' in column:
+        column = tuple(value or '0' for value in column)
+    return np.array(column, dtype=np.int64)
+
+
+def _parse_floats(column: tuple[str, ...]) -> np.ndarray:
+    try:
+        return np.array(column, dtype=np.float64)
+    except ValueError:
+        return np.array([value.replace(',', '.') for value in column], dtype=np.float64)
+
+
+def _parse_date_times(columns: list[tuple[str, ...]]) -> np.ndarray:
+    """Vectorized conversion of matched date and time columns to unix time in seconds"""
+    iso: np.ndarray = np.array(columns[0], dtype=bool)
+    year: np.ndarray = np.where(iso, _parse_ints(columns[0]), _parse_ints(columns[5]))
+    month: np.ndarray = np.where(iso, _parse_ints(columns[1]), _parse_ints(columns[4]))
+    day: np.ndarray = np.where(iso, _parse_ints(columns[2]), _parse_ints(columns[3]))
+    return _days_from_civil(year, month, day) * 86400 + \
+        _parse_ints(columns[6]) * 3600 + _parse_ints(columns[7]) * 60 + _parse_ints(columns[8])
+
+
+def _days_from_civil(year: np.ndarray, month: np.ndarray, day: np.ndarray) -> np.ndarray:
+    """Days since 1970-01-01 of proleptic Gregorian dates"""
+    year = year - (month <= 2)
+    era: np.ndarray = year // 400
+    year_of_era: np.ndarray = year - era * 400
+    day_of_year: np.ndarray = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    day_of_era: np.ndarray = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+def min_max_decimate(times: np.ndarray, values: np.ndarray, max_points: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Reduce series to at most `max_points` points keeping minimum and maximum of each group of points.
+
+    Peaks survive decimation, so the series can be reduced repeatedly while reading chunks.
+    """
+    if len(values) <= max_points:
+        return times, values
+    group: int = math.ceil(len(values) / (max_points // 2))
+    groups: int = len(values) // group
+    tail: int = groups * group
+    grouped_values: np.ndarray = values[:tail].reshape(groups, group)
+    rows: np.ndarray = np.arange(groups)[:, None]
+    extremes: np.ndarray = np.sort(
+        np.stack((grouped_values.argmin(axis=1), grouped_values.argmax(axis=1)), axis=1), axis=1
+    ) + rows * group
+    indices: np.ndarray = np.concatenate((extremes.ravel(), np.arange(tail, len(values))))
+    return times[indices], values[indices]
+
+
+def lttb(times: np.ndarray, values: np.ndarray, points: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Largest-Triangle-Three-Buckets downsampling to `points` points.
+
+    Bucket averages are computed vectorized, the selection loop runs once per bucket.
+    """
+    n: int = len(values)
+    if points >= n or points < 3:
+        return times, values
+    x: np.ndarray = (times - times[0]).astype(np.float64)
+    y: np.ndarray = values
+    edges: np.ndarray = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    x_sums: np.ndarray = np.concatenate(([0.], np.cumsum(x)))
+    y_sums: np.ndarray = np.concatenate(([0.], np.cumsum(y)))
+    counts: np.ndarray = np.diff(edges)
+    x_averages: np.ndarray = np.append((x_sums[edges[1:]] - x_sums[edges[:-1]]) / counts, x[-1])
+    y_averages: np.ndarray = np.append((y_sums[edges[1:]] - y_sums[edges[:-1]]) / counts, y[-1])
+
+    selected: np.ndarray = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous: int = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_x, next_y = x_averages[bucket + 1], y_averages[bucket + 1]
+        areas: np.ndarray = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous]) -
+            (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(areas.argmax())
+        selected[bucket + 1] = previous
+    return times[selected], values[selected]
+
+
+@dataclass
+class Excursions:
+    """Temperature excursions of a thermograph: durations are in seconds, temperatures in °C"""
+    readings: int = 0
+    duration: float = 0.
+    time_above: float = 0.
+    time_below: float = 0.
+    longest: float = 0.
+    minimum: Optional[float] = None
+    maximum: Optional[float] = None
+    mean_kinetic_temperature: Optional[float] = None
+
+    @property
+    def violated(self) -> bool:
+        return self.time_above > 0 or self.time_below > 0
+
+
+class ExcursionAnalyzer:
+    """
+    Streaming analysis of temperature excursions beyond `lower` and `upper` thresholds.
+
+    Readings are fed in time ordered chunks. Each reading holds until the next one, so the time of an interval
+    is counted as above or below the thresholds by its first reading. An excursion continuing at the end of a chunk
+    is carried to the next one. Mean kinetic temperature is time weighted with activation energy in kJ/mol.
+    """
+    GAS_CONSTANT: Final[float] = 8.314462618e-3
+
+    def __init__(self, lower: float, upper: float, activation_energy: float = 83.144):
+        self.lower: float = lower
+        self.upper: float = upper
+        self._energy_over_gas_constant: float = activation_energy / self.GAS_CONSTANT
+        self._excursions: Excursions = Excursions()
+        self._last: Optional[tuple[int, float]] = None
+        self._current: float = 0.
+        self._weighted_sum: float = 0.
+
+    def feed(self, times: np.ndarray, values: np.ndarray):
+        if not len(values):
+            return
+        excursions: Excursions = self._excursions
+        excursions.readings += len(values)
+        minimum, maximum = float(values.min()), float(values.max())
+        excursions.minimum = minimum if excursions.minimum is None else min(excursions.minimum, minimum)
+        excursions.maximum = maximum if excursions.maximum is None else max(excursions.maximum, maximum)
+        if self._last is not None:
+            times = np.concatenate(([self._last[0]], times))
+            values = np.concatenate(([self._last[1]], values))
+        self._last = int(times[-1]), float(values[-1])
+        if len(values) < 2:
+            return
+
+        durations: np.ndarray = np.maximum(np.diff(times), 0).astype(np.float64)
+        states: np.ndarray = values[:-1]
+        above: np.ndarray = states > self.upper
+        below: np.ndarray = states < self.lower
+        out: np.ndarray = above | below
+        excursions.duration += float(durations.sum())
+        excursions.time_above += float(durations[above].sum())
+        excursions.time_below += float(durations[below].sum())
+        self._weighted_sum += float((durations * np.exp(-self._energy_over_gas_constant / (states + 273.15))).sum())
+
+        runs: np.ndarray = np.cumsum(~out)
+        runs_durations: np.ndarray = np.bincount(runs[out], weights=durations[out], minlength=int(runs[-1]) + 1)
+        if out[0]:
+            runs_durations[0] += self._current
+        excursions.longest = max(excursions.longest, float(runs_durations.max()))
+        self._current = float(runs_durations[runs[-1]]) if out[-1] else 0.
+
+    def result(self) -> Excursions:
+        excursions: Excursions = self._excursions
+        if excursions.duration > 0 and self._weighted_sum > 0:
+            excursions.mean_kinetic_temperature = \
+                self._energy_over_gas_constant / -math.log(self._weighted_sum / excursions.duration) - 273.15
+        elif excursions.readings:
+            excursions.mean_kinetic_temperature = self._last[1]
+        return excursions
+
+
+def downsample_readings(
+        readings: LoggerReadings,
+        points: int,
+        max_points: int,
+        chunk_size: int,
+        analyzer: Optional[ExcursionAnalyzer] = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Read all chunks of readings keeping at most `max_points` points in memory and downsample them to `points`.
+
+    :param analyzer: excursion analyzer fed with every chunk, so readings are parsed once for both
+    """
+    times: np.ndarray = np.empty(0, dtype=np.int64)
+    values: np.ndarray = np.empty(0, dtype=np.float64)
+    for chunk_times, chunk_values in readings.chunks(chunk_size):
+        if analyzer:
+            analyzer.feed(chunk_times, chunk_values)
+        times = np.concatenate((times, chunk_times))
+        values = np.concatenate((values, chunk_values))
+        times, values = min_max_decimate(times, values, max_points)
+    order: np.ndarray = np.argsort(times, kind='stable')
+    return lttb(times[order], values[order], points)
+
+
+def render_chart(
+        times: np.ndarray,
+        values: np.ndarray,
+        width: int,
+        height: int,
+        lower: Optional[float] = None,
+        upper: Optional[float] = None,
+        title: str = ''
+) -> BytesIO:
+    """
+    Draw temperature chart as a palette PNG image of `width` x `height` pixels.
+
+    :param times: unix times in seconds
+    :param values: temperatures
+    :param lower: lower temperature threshold drawn as a red line
+    :param upper: upper temperature threshold drawn as a red line
+    :param title: chart title
+    """
+    scale: float = height / 400
+    font = _font(max(10, int(13 * scale)))
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    left, right, top, bottom = int(60 * scale), width - int(20 * scale), int(30 * scale), height - int(40 * scale)
+
+    if len(values):
+        t0, t1 = int(times.min()), int(times.max())
+        v0, v1 = float(values.min()), float(values.max())
+    else:
+        t0, t1, v0, v1 = 0, 1, 0., 1.
+    thresholds: list[float] = [threshold for threshold in (lower, upper) if threshold is not None]
+    v0, v1 = min([v0, *thresholds]), max([v1, *thresholds])
+    t1 = max(t1, t0 + 1)
+    padding: float = max((v1 - v0) * .05, .5)
+    v0, v1 = v0 - padding, v1 + padding
+
+    def x_of(t):
+        return left + (t - t0) / (t1 - t0) * (right - left)
+
+    def y_of(v):
+        return bottom - (v - v0) / (v1 - v0) * (bottom - top)
+
+    value_step: float = _nice_step((v1 - v0) / 6)
+    for tick in np.arange(math.ceil(v0 / value_step) * value_step, v1, value_step):
+        y = y_of(tick)
+        draw.line([(left, y), (right, y)], fill=(220, 220, 220))
+        _draw_text(draw, (left - 5 * scale, y), f"{tick:g}", font, anchor='rm')
+
+    time_step: int = _time_step(t1 - t0)
+    for tick in range(math.ceil(t0 / time_step) * time_step, t1 + 1, time_step):
+        x = x_of(tick)
+        draw.line([(x, top), (x, bottom)], fill=(220, 220, 220))
+        label_format: str = '%d.%m' if time_step >= 86400 else '%d.%m %H:%M'
+        label: str = (datetime(1970, 1, 1) + timedelta(seconds=tick)).strftime(label_format)
+        _draw_text(draw, (x, bottom + 5 * scale), label, font, anchor='mt')
+
+    for threshold in thresholds:
+        draw.line([(left, y_of(threshold)), (right, y_of(threshold))], fill=(200, 0, 0), width=max(1, int(scale)))
+    draw.rectangle([left, top, right, bottom], outline='black')
+    if len(values) > 1:
+        points: list = np.column_stack((x_of(times), y_of(values))).ravel().tolist()
+        draw.line(points, fill=(0, 70, 160), width=max(1, int(2 * scale)), joint='curve')
+    if title:
+        _draw_text(draw, (width / 2, top / 2), f"{title}, °C", font, anchor='mm')
+
+    chart = BytesIO()
+    image.quantize(colors=16).save(chart, format='PNG', optimize=True)
+    chart.seek(0)
+    return chart
+
+
+def _nice_step(raw_step: float) -> float:
+    magnitude: float = 10 ** math.floor(math.log10(raw_step)) if raw_step > 0 else 1
+    return next((step * magnitude for step in (1, 2, 5, 10) if step * magnitude >= raw_step), 10 * magnitude)
+
+
+def _time_step(duration: int) -> int:
+    steps: tuple[int, ...] = (900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400, 2 * 86400, 7 * 86400)
+    return next((step for step in steps if duration / step <= 8), math.ceil(duration / 8 / 86400) * 86400)
+
+
+def _draw_text(draw: ImageDraw.ImageDraw, xy: tuple[float, float], text: str, font, anchor: str):
+    """Draw text aligned by `anchor`: horizontal 'l', 'm' or 'r' and vertical 't' or 'm'"""
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    x: float = xy[0] - left - {'l': 0, 'm': (right - left) / 2, 'r': right - left}[anchor[0]]
+    y: float = xy[1] - top - {'t': 0, 'm': (bottom - top) / 2}[anchor[1]]
+    draw.text((x, y), text, fill='black', font=font)
+
+
+def _font(size: int):
+    try:
+        return ImageFont.truetype('DejaVuSans.ttf', size)
+    except OSError:
+        try:
+            return ImageFont.load_default(size)
+        except TypeError:
+            return ImageFont.load_default()
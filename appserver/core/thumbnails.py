@@ -0,0 +1,132 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+from io import BytesIO
+from typing import Final
+
+from PIL import Image, UnidentifiedImageError, features
+
+from .exceptions import PhotoCorruptedException, ThumbnailNotFoundException
+from .photos import EXIF_ORIENTATION_TAG, EXIF_ORIENTATION_TRANSPOSITIONS
+
+
+class ThumbnailsCache:
+    """
+    On-disk cache of image thumbnails of fixed sizes keyed by SHA-256 of the source image.
+
+    Thumbnails of all sizes and formats are created at once from a single decoding of the image: each size
+    is downscaled from the previous larger one. Files are placed in subdirectories by the first two characters
+    of the key. Least recently used thumbnails are evicted when the total size exceeds `max_size`,
+    the time of the last use is kept as the file modification time.
+    """
+    key_pattern: Final[re.Pattern] = re.compile(r"[0-9a-f]{64}")
+    extensions: Final[dict[str, str]] = {'webp': 'webp', 'jpeg': 'jpg'}
+
+    def __init__(self, directory: str, sizes: list[int], formats: list[str], max_size: int, quality: int = 80):
+        self.logger: logging.Logger = logging.getLogger("thumbnails")
+        self.directory: str = directory
+        self.sizes: list[int] = sorted(sizes)
+        self.formats: list[str] = [
+            image_format for image_format in formats if image_format != 'webp' or features.check('webp')
+        ] or ['jpeg']
+        self.max_size: int = max_size
+        self.quality: int = quality
+        self._lock: threading.Lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size: int = sum(stat.st_size for _, stat in self._files())
+
+    def add(self, image: bytes) -> str:
+        """Create thumbnails of the image if they are not cached yet and return the key of the image"""
+        key: str = hashlib.sha256(image).hexdigest()
+        paths: list[str] = [self._path(key, size, image_format) for size in self.sizes for image_format in self.formats]
+        if all(os.path.exists(path) for path in paths):
+            for path in paths:
+                self._touch(path)
+            return key
+
+        try:
+            source = Image.open(BytesIO(image))
+            if source.format == 'JPEG':
+                source.draft('RGB', (self.sizes[-1], self.sizes[-1]))
+            orientation: int = source.getexif().get(EXIF_ORIENTATION_TAG, 1)
+            transparent: bool = 'A' in source.getbands() or 'transparency' in source.info
+            thumbnail = source.convert('RGBA' if transparent else 'RGB')
+        except (UnidentifiedImageError, OSError, SyntaxError) as e:
+            raise PhotoCorruptedException from e
+        for transposition in EXIF_ORIENTATION_TRANSPOSITIONS.get(orientation, ()):
+            thumbnail = thumbnail.transpose(transposition)
+
+        os.makedirs(os.path.dirname(paths[0]), exist_ok=True)
+        written: int = 0
+        for size in reversed(self.sizes):
+            thumbnail.thumbnail((size, size), Image.LANCZOS, reducing_gap=2.)
+            for image_format in self.formats:
+                written += self._write(thumbnail, self._path(key, size, image_format), image_format)
+        with self._lock:
+            self._size += written
+        self._evict()
+        return key
+
+    def get(self, key: str, size: int, image_format: str) -> str:
+        """
+        Path to the thumbnail of the image in the closest size not less than `size`.
+
+        :raises ThumbnailNotFoundException: the image was not added or its thumbnails were evicted
+        """
+        if not self.key_pattern.fullmatch(key) or image_format not in self.formats:
+            raise ThumbnailNotFoundException(key)
+        size = next((cached_size for cached_size in self.sizes if cached_size >= size), self.sizes[-1])
+        path: str = self._path(key, size, image_format)
+        if not os.path.exists(path):
+            raise ThumbnailNotFoundException(key)
+        self._touch(path)
+        return path
+
+    def _path(self, key: str, size: int, image_format: str) -> str:
+        return f"{self.directory}/{key[:2]}/{key}_{size}.{self.extensions[image_format]}"
+
+    def _write(self, thumbnail: Image.Image, path: str, image_format: str) -> int:
+        """Atomic write of a thumbnail, returns the size of the file"""
+        if image_format == 'jpeg' and thumbnail.mode == 'RGBA':
+            background = Image.new('RGB', thumbnail.size, 'white')
+            background.paste(thumbnail, mask=thumbnail.getchannel('A'))
+            thumbnail = background
+        tmp_path: str = f"{path}.{threading.get_ident()}.part"
+        thumbnail.save(tmp_path, format=image_format.upper(), quality=self.quality)
+        os.replace(tmp_path, path)
+        return os.path.getsize(path)
+
+    @staticmethod
+    def _touch(path: str):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def _files(self) -> list[tuple[str, os.stat_result]]:
+        files: list[tuple[str, os.stat_result]] = []
+        for shard in os.scandir(self.directory):
+            if shard.is_dir():
+                files += [(entry.path, entry.stat()) for entry in os.scandir(shard.path) if entry.is_file()]
+        return files
+
+    def _evict(self):
+        """Remove least recently used thumbnails until the cache takes no more than 90% of `max_size`"""
+        with self._lock:
+            if self._size <= self.max_size:
+                return
+            files: list[tuple[str, os.stat_result]] = sorted(self._files(), key=lambda file: file[1].st_mtime_ns)
+            self._size = sum(stat.st_size for _, stat in files)
+            evicted: int = 0
+            for path, stat in files:
+                if self._size <= self.max_size * .9:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                self._size -= stat.st_size
+                evicted += 1
+            self.logger.info(f"Evicted {evicted} thumbnails, cache size is {self._size} bytes.")
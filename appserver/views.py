@@ -1,24 +1,207 @@
-from typing import List, Union
+import hmac
+from typing import List, Optional, Union
 
-from fastapi import Body, APIRouter, UploadFile, File
-from fastapi.responses import FileResponse
+from dynaconf import settings
+from fastapi import Body, APIRouter, Depends, Header, UploadFile, File, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from starlette.routing import BaseRoute
 
+from .core.admission import MemoryBudget
 from .core.configuration import AgentReportRepositoryConfigurator
+from .core.exceptions import AdminAccessDeniedException
 from .core.models import SelfImportReport, SelfImportOnAutoReport, PickupFromSupplierReport
+from .core.profiling import SamplingProfiler
 
 REPOSITORY = AgentReportRepositoryConfigurator().repository()
+MEMORY_BUDGET = MemoryBudget(
+    limit=settings.ADMISSION.MEMORY_BUDGET,
+    queue_size=settings.ADMISSION.QUEUE_SIZE,
+    queue_timeout=settings.ADMISSION.QUEUE_TIMEOUT,
+    retry_after=settings.ADMISSION.RETRY_AFTER,
+    trace_memory=settings.ADMISSION.TRACE_MEMORY
+)
+PROFILER = SamplingProfiler(
+    directory=settings.REPOSITORY.PROFILES_DIR,
+    interval=settings.PROFILER.INTERVAL,
+    max_depth=settings.PROFILER.MAX_DEPTH,
+    max_files=settings.PROFILER.MAX_FILES
+)
 
 report_api: APIRouter = APIRouter()
 
 
+def check_admin_token(x_admin_token: str = Header('', title="Токен администратора")):
+    """Доступ только с токеном администратора из настроек, без токена в настройках доступ закрыт"""
+    token: str = settings.PROFILER.ADMIN_TOKEN
+    if not token or not hmac.compare_digest(x_admin_token.encode(), token.encode()):
+        raise AdminAccessDeniedException
+
+
+def admin_routes(routes: list[BaseRoute]) -> list[APIRoute]:
+    """Маршруты, доступные только с токеном администратора"""
+    return [
+        route for route in routes if isinstance(route, APIRoute) and
+        any(dependency.dependency is check_admin_token for dependency in route.dependencies)
+    ]
+
+
 @report_api.put("/", name="Создание отчета.")
 async def create_report(
         report_data: Union[SelfImportReport,
                            SelfImportOnAutoReport,
-                           PickupFromSupplierReport] = Body(..., title="Модель отчета с заполненной текстовой частью")
-) -> FileResponse:
+                           PickupFromSupplierReport] = Body(..., title="Модель отчета с заполненной текстовой частью"),
+        compression_level: Optional[int] = Query(None, ge=0, le=9, title="Уровень сжатия документа")
+) -> StreamingResponse:
     """Создание черновика отчета."""
-    return REPOSITORY.create_report(report_data)
+    return await run_in_threadpool(REPOSITORY.create_report, report_data, compression_level)
+
+
+@report_api.put("/batch", name="Пакетное создание отчетов.")
+async def create_reports(
+        reports_data: List[Union[SelfImportReport,
+                                 SelfImportOnAutoReport,
+                                 PickupFromSupplierReport]] = Body(..., title="Список моделей отчетов"),
+        compression_level: Optional[int] = Query(None, ge=0, le=9, title="Уровень сжатия документов")
+) -> StreamingResponse:
+    """Пакетное создание черновиков отчетов. Возвращает zip-архив отчетов и manifest.json со статусами."""
+    return REPOSITORY.create_reports(reports_data, compression_level)
+
+
+@report_api.post("/drafts", name="Сохранение данных отчета")
+async def create_draft_state(
+        report_data: dict = Body(..., title="Модель отчета: SelfImportReport, SelfImportOnAutoReport или "
+                                            "PickupFromSupplierReport")
+) -> dict:
+    """Сохранить данные отчета на сервере. Возвращает идентификатор и версию данных черновика."""
+    return REPOSITORY.create_draft_state(report_data)
+
+
+@report_api.get("/drafts/{draft_id}", name="Данные отчета")
+async def get_draft_state(draft_id: str) -> dict:
+    """Сохраненные данные отчета с версией."""
+    return REPOSITORY.get_draft_state(draft_id)
+
+
+@report_api.patch("/drafts/{draft_id}", name="Изменение данных отчета")
+async def update_draft_state(
+        draft_id: str,
+        operations: List[dict] = Body(..., title="Изменения данных отчета в формате JSON Patch"),
+        version: Optional[int] = Query(None, title="Версия данных, для которой сделаны изменения")
+) -> dict:
+    """Изменить сохраненные данные отчета. Возвращает новую версию данных."""
+    return REPOSITORY.update_draft_state(draft_id, operations, version)
+
+
+@report_api.delete("/drafts/{draft_id}", name="Удаление данных отчета")
+async def delete_draft_state(draft_id: str):
+    """Удалить сохраненные данные отчета, файл черновика не удаляется."""
+    REPOSITORY.delete_draft_state(draft_id)
+
+
+@report_api.put("/drafts/{draft_id}/document", name="Создание отчета по сохраненным данным")
+async def create_draft_report(
+        draft_id: str,
+        compression_level: Optional[int] = Query(None, ge=0, le=9, title="Уровень сжатия документа")
+) -> StreamingResponse:
+    """Создание черновика отчета по сохраненным данным."""
+    return await run_in_threadpool(REPOSITORY.create_report, REPOSITORY.draft_report(draft_id), compression_level)
+
+
+@report_api.patch("/drafts/{draft_id}/photos", name="Добавление фотографий по сохраненным данным")
+async def add_draft_photos(
+        draft_id: str,
+        compression_level: Optional[int] = Query(None, ge=0, le=9, title="Уровень сжатия документа")
+) -> StreamingResponse:
+    """Добавить к отчету фотографии из сохраненных данных."""
+    return REPOSITORY.add_pictures(REPOSITORY.draft_report(draft_id), compression_level)
+
+
+@report_api.patch("/drafts/{draft_id}/section/{section_name}", name="Обновление раздела по сохраненным данным")
+async def update_draft_section(
+        draft_id: str,
+        section_name: str,
+        containers: List[str] = Query([], title="Номера ТЕ, по умолчанию все"),
+        compression_level: Optional[int] = Query(None, ge=0, le=9, title="Уровень сжатия документа")
+) -> StreamingResponse:
+    """Заполнить раздел черновика заново по сохраненным данным."""
+    return await run_in_threadpool(
+        REPOSITORY.update_section, REPOSITORY.draft_report(draft_id), section_name, containers, compression_level
+    )
+
+
+@report_api.get("/drafts/{draft_id}/preview", name="Просмотр отчета по сохраненным данным",
+                response_class=HTMLResponse)
+async def preview_draft_report(draft_id: str) -> HTMLResponse:
+    """HTML-просмотр отчета по сохраненным данным без создания документа."""
+    return HTMLResponse(REPOSITORY.preview_report(REPOSITORY.draft_report(draft_id), "../../thumbnails"))
+
+
+@report_api.post("/preview", name="Просмотр отчета", response_class=HTMLResponse)
+async def preview_report(
+        report_data: Union[SelfImportReport,
+                           SelfImportOnAutoReport,
+                           PickupFromSupplierReport] = Body(..., title="Модель отчета")
+) -> HTMLResponse:
+    """HTML-просмотр отчета без создания документа."""
+    return HTMLResponse(REPOSITORY.preview_report(report_data, "thumbnails"))
+
+
+@report_api.get("/cache/stats", name="Метрики кэша отчетов", dependencies=[Depends(check_admin_token)])
+async def render_cache_stats() -> dict:
+    """Размер кэша отчетов, количество попаданий, промахов и вытеснений."""
+    return REPOSITORY.render_cache_stats()
+
+
+@report_api.get("/memory/stats", name="Метрики бюджета памяти", dependencies=[Depends(check_admin_token)])
+async def memory_stats() -> dict:
+    """Бюджет памяти запросов: занятая память, очередь, отклоненные запросы и пиковая память последних запросов."""
+    return MEMORY_BUDGET.stats()
+
+
+@report_api.get("/profiler", name="Состояние профилировщика", dependencies=[Depends(check_admin_token)])
+async def profiler_status() -> dict:
+    """Режим профилирования и сохраненные профили запросов."""
+    return PROFILER.status()
+
+
+@report_api.put("/profiler", name="Включение профилировщика", dependencies=[Depends(check_admin_token)])
+async def configure_profiler(
+        requests: int = Query(0, ge=0, title="Профилировать следующие запросы"),
+        slower_than: Optional[float] = Query(None, gt=0, title="Сохранять профили запросов дольше, с")
+) -> dict:
+    """Профилирование следующих запросов и/или запросов дольше порога. Без параметров профилирование выключается."""
+    PROFILER.configure(requests, slower_than)
+    return PROFILER.status()
+
+
+@report_api.get("/profiler/{name}", name="Профиль запроса", dependencies=[Depends(check_admin_token)])
+async def get_profile(name: str) -> FileResponse:
+    """Профиль запроса в формате collapsed stacks для построения flame graph."""
+    return FileResponse(PROFILER.path(name), media_type="text/plain", filename=name)
+
+
+@report_api.post("/thumbnails", name="Создание миниатюр изображения")
+async def add_thumbnails(image_file: UploadFile = File(...)) -> dict:
+    """Создание миниатюр фотографии или графика датчика. Возвращает хэш изображения для запроса миниатюр."""
+    return REPOSITORY.add_thumbnails(image_file)
+
+
+@report_api.get("/thumbnails/{image_hash}", name="Миниатюра изображения")
+async def get_thumbnail(
+        image_hash: str,
+        size: int = Query(160, gt=0, title="Размер наибольшей стороны миниатюры"),
+        image_format: str = Query("webp", alias="format", title="Формат миниатюры: webp или jpeg")
+) -> FileResponse:
+    """Миниатюра изображения по его хэшу."""
+    return REPOSITORY.get_thumbnail(image_hash, size, image_format)
+
+
+@report_api.get("/{filename}/thumbnails", name="Миниатюры изображений отчета")
+async def get_draft_thumbnails(filename: str) -> List[dict]:
+    """Хэши миниатюр изображений черновика отчета."""
+    return REPOSITORY.get_draft_thumbnails(filename)
 
 
 @report_api.get("/{filename}", name="Отчеты в работе")
@@ -37,7 +220,21 @@ async def update_report(filename: str, report_file: UploadFile = File(...)) -> s
 async def add_photos(
         report_data: Union[SelfImportReport,
                            SelfImportOnAutoReport,
-                           PickupFromSupplierReport] = Body(..., title="Модель отчета c фотобазой транспортных единиц")
-) -> FileResponse:
+                           PickupFromSupplierReport] = Body(..., title="Модель отчета c фотобазой транспортных единиц"),
+        compression_level: Optional[int] = Query(None, ge=0, le=9, title="Уровень сжатия документа")
+) -> StreamingResponse:
     """Добавить фотографии к отчету."""
-    return REPOSITORY.add_pictures(report_data)
+    return REPOSITORY.add_pictures(report_data, compression_level)
+
+
+@report_api.patch("/section/{section_name}", name="Обновление раздела отчета")
+async def update_section(
+        section_name: str,
+        report_data: Union[SelfImportReport,
+                           SelfImportOnAutoReport,
+                           PickupFromSupplierReport] = Body(..., title="Модель отчета с измененными данными раздела"),
+        containers: List[str] = Query([], title="Номера ТЕ, по умолчанию все"),
+        compression_level: Optional[int] = Query(None, ge=0, le=9, title="Уровень сжатия документа")
+) -> StreamingResponse:
+    """Заполнить раздел черновика заново, не изменяя остальные части черновика."""
+    return await run_in_threadpool(REPOSITORY.update_section, report_data, section_name, containers, compression_level)
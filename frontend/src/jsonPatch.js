@@ -0,0 +1,47 @@
+// JSON Patch (RFC 6902) turning `before` into `after`: changed fields only, arrays are compared element by element.
+function diff(before, after, path = '') {
+  if (isObject(before) && isObject(after)) {
+    let operations = [];
+    for (const key of Object.keys(before)) {
+      if (!(key in after)) {
+        operations.push({op: 'remove', path: `${path}/${escape(key)}`});
+      }
+    }
+    for (const key of Object.keys(after)) {
+      if (key in before) {
+        operations = operations.concat(diff(before[key], after[key], `${path}/${escape(key)}`));
+      } else {
+        operations.push({op: 'add', path: `${path}/${escape(key)}`, value: after[key]});
+      }
+    }
+    return operations;
+  }
+  if (Array.isArray(before) && Array.isArray(after)) {
+    let operations = [];
+    const common = Math.min(before.length, after.length);
+    for (let index = 0; index < common; index++) {
+      operations = operations.concat(diff(before[index], after[index], `${path}/${index}`));
+    }
+    for (let index = before.length - 1; index >= common; index--) {
+      operations.push({op: 'remove', path: `${path}/${index}`});
+    }
+    for (let index = common; index < after.length; index++) {
+      operations.push({op: 'add', path: `${path}/-`, value: after[index]});
+    }
+    return operations;
+  }
+  if (before === after) {
+    return [];
+  }
+  return [{op: 'replace', path: path, value: after}];
+}
+
+function isObject(value) {
+  return value !== null && typeof value === 'object' && !Array.isArray(value);
+}
+
+function escape(key) {
+  return key.replace(/~/g, '~0').replace(/\//g, '~1');
+}
+
+export { diff };
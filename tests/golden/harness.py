@@ -0,0 +1,274 @@
+"""
+Golden outputs of reports.
+
+Payloads of `payloads/` are rendered through AgentReportRepository and compared part by part with approved
+outputs of `approved/`. Parts are compared in a canonical form, so zip metadata and serialization details
+do not count: XML parts with sorted attributes, relationships identified by their type and target instead of
+numbering, drawings numbered in document order and the current date replaced with `{{ today }}`; media parts
+are named and compared by SHA-256 of their content. SHA-256 hashes of canonical parts are approved, canonical XML
+is kept only for the document body and relationships, where a readable diff of changes matters.
+
+    python -m tests.golden.harness [--approve] [case ...]
+"""
+import argparse
+import asyncio
+import difflib
+import hashlib
+import json
+import os
+import posixpath
+import shutil
+import sys
+import tempfile
+from datetime import date
+from io import BytesIO
+from pathlib import Path
+from typing import Iterable, Optional
+from urllib.parse import unquote
+from zipfile import ZipFile
+
+from lxml import etree
+
+GOLDEN_DIR: Path = Path(__file__).parent
+PAYLOADS_DIR: Path = GOLDEN_DIR / 'payloads'
+APPROVED_DIR: Path = GOLDEN_DIR / 'approved'
+
+os.environ.setdefault('ROOT_PATH_FOR_DYNACONF', str(GOLDEN_DIR.parent.parent / 'resources'))
+
+from appserver.core import models  # noqa: E402
+from appserver.core.document_daos import DocxDocumentDAO  # noqa: E402
+from appserver.core.repository import AgentReportRepository  # noqa: E402
+from appserver.core.storages import ShardedFileStorage  # noqa: E402
+
+RELATIONSHIPS_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+WORDPROCESSING_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+CONTENT_TYPES_NS = 'http://schemas.openxmlformats.org/package/2006/content-types'
+DRAWING_IDS = frozenset(('docPr', 'cNvPr'))
+READABLE_PARTS = frozenset(('word/document.xml',))
+
+
+def cases() -> list[str]:
+    return sorted(path.stem for path in PAYLOADS_DIR.glob('*.json'))
+
+
+def repository(directory: str) -> AgentReportRepository:
+    """Repository keeping drafts in `directory`"""
+    return AgentReportRepository(DocxDocumentDAO, ShardedFileStorage(directory, extension='docx'))
+
+
+def payload_report(case: str) -> models.BaseReport:
+    """Report data of the case"""
+    with open(PAYLOADS_DIR / f'{case}.json', encoding='utf-8') as payload:
+        data: dict = json.load(payload)
+    return getattr(models, data['model']).parse_obj(data['report'])
+
+
+def render_case(report_repository: AgentReportRepository, case: str) -> bytes:
+    """
+    Draft of the report of the case: created and, if the case has `"photos": true`, with photos added,
+    the same way as by PUT and PATCH requests
+    """
+    with open(PAYLOADS_DIR / f'{case}.json', encoding='utf-8') as payload:
+        data: dict = json.load(payload)
+    report: models.BaseReport = payload_report(case)
+    consume(report_repository.create_report(report))
+    if data.get('photos'):
+        consume(report_repository.add_pictures(report))
+    with open(report_repository.draft_path(report), 'rb') as draft:
+        return draft.read()
+
+
+def canonical_parts(doc: bytes, today: Optional[str] = None) -> dict[str, bytes]:
+    """Parts of the document in the canonical form by their canonical names"""
+    today = today or date.today().strftime('%d.%m.%Y')
+    with ZipFile(BytesIO(doc)) as package:
+        parts: dict[str, bytes] = {
+            info.filename: package.read(info) for info in package.infolist() if not info.is_dir()
+        }
+    trees: dict[str, etree._Element] = {
+        name: etree.fromstring(data) for name, data in parts.items() if name.endswith(('.xml', '.rels'))
+    }
+    names: dict[str, str] = {name: name for name in trees}
+    for name, data in parts.items():
+        if name not in trees:
+            extension: str = posixpath.splitext(name)[1]
+            names[name] = f"{posixpath.dirname(name)}/{hashlib.sha256(data).hexdigest()[:16]}{extension}".lstrip('/')
+
+    for rels_name in [name for name in trees if name.endswith('.rels')]:
+        source: str = _source_part(rels_name)
+        _canonicalize_relationships(trees[rels_name], trees.get(source), source, names)
+    if '[Content_Types].xml' in trees:
+        _canonicalize_content_types(trees['[Content_Types].xml'], names)
+
+    canonical: dict[str, bytes] = {}
+    for name, data in parts.items():
+        if name not in trees:
+            canonical[names[name]] = data
+            continue
+        _normalize(trees[name])
+        text: str = etree.tostring(trees[name], pretty_print=True, encoding='unicode')
+        canonical[name] = text.replace(today, '{{ today }}').encode('utf-8')
+    return canonical
+
+
+def compare(case: str, parts: dict[str, bytes], max_lines: int = 40) -> list[str]:
+    """Differences of canonical parts from the approved ones, empty if the output is approved"""
+    approved_dir: Path = APPROVED_DIR / case
+    try:
+        approved: dict[str, str] = json.loads((approved_dir / 'parts.json').read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        return [f'{case}: no approved output']
+    hashes: dict[str, str] = _hashes(parts)
+    differences: list[str] = []
+    for name in sorted(approved.keys() - hashes.keys()):
+        differences.append(f'{case}: missing part {name}')
+    for name in sorted(hashes.keys() - approved.keys()):
+        differences.append(f'{case}: extra part {name} ({len(parts[name])} bytes)')
+    for name in sorted(name for name in hashes.keys() & approved.keys() if hashes[name] != approved[name]):
+        approved_path: Path = approved_dir / 'xml' / name
+        if not approved_path.exists():
+            differences.append(f'{case}: changed part {name} ({len(parts[name])} bytes)')
+            continue
+        diff: list[str] = list(difflib.unified_diff(
+            approved_path.read_text(encoding='utf-8').splitlines(),
+            parts[name].decode('utf-8').splitlines(),
+            f'approved/{name}', f'rendered/{name}', n=2, lineterm=''
+        ))
+        differences.append(f'{case}: changed part {name}')
+        differences += diff[:max_lines] + ([f'... {len(diff) - max_lines} more lines'] if len(diff) > max_lines else [])
+    return differences
+
+
+def approve(case: str, parts: dict[str, bytes]):
+    """Replace approved output of the case with the rendered one"""
+    approved_dir: Path = APPROVED_DIR / case
+    shutil.rmtree(approved_dir, ignore_errors=True)
+    for name, data in parts.items():
+        if name in READABLE_PARTS or name.endswith('.rels'):
+            path: Path = approved_dir / 'xml' / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+    (approved_dir / 'parts.json').write_text(
+        json.dumps(_hashes(parts), indent=2, sort_keys=True) + '\n', encoding='utf-8'
+    )
+
+
+def document_text(doc: bytes) -> str:
+    """Text of the document body, paragraphs on separate lines"""
+    with ZipFile(BytesIO(doc)) as package:
+        body: etree._Element = etree.fromstring(package.read('word/document.xml'))
+    return '\n'.join(
+        ''.join(paragraph.itertext()) for paragraph in body.iter(f'{{{WORDPROCESSING_NS}}}p')
+    )
+
+
+def consume(response):
+    """Reading of the streamed response, the draft is saved when the response is read"""
+    async def read():
+        async for _ in response.body_iterator:
+            pass
+    asyncio.run(read())
+
+
+def _hashes(parts: dict[str, bytes]) -> dict[str, str]:
+    return {name: hashlib.sha256(data).hexdigest() for name, data in parts.items()}
+
+
+def _source_part(rels_name: str) -> str:
+    """Part of a relationships part, '' is the package itself"""
+    directory, name = posixpath.split(rels_name)
+    return posixpath.join(posixpath.dirname(directory), name[:-len('.rels')])
+
+
+def _canonicalize_relationships(
+        rels: etree._Element, source: Optional[etree._Element], source_name: str, names: dict[str, str]
+):
+    """
+    Relationships are identified by type and canonical target, relationships of the same type and target
+    are numbered in the order of references in the source part
+    """
+    references: dict[str, int] = {}
+    if source is not None:
+        for element in source.iter():
+            for attribute, value in element.attrib.items():
+                if etree.QName(attribute).namespace == RELATIONSHIPS_NS:
+                    references.setdefault(value, len(references))
+
+    keys: dict[str, str] = {}
+    for relationship in rels:
+        target: str = relationship.get('Target')
+        if relationship.get('TargetMode') != 'External':
+            target_name: str = posixpath.normpath(
+                posixpath.join(posixpath.dirname(source_name), unquote(target))
+            ) if not target.startswith('/') else unquote(target).lstrip('/')
+            target = '/' + names.get(target_name, target_name)
+            relationship.set('Target', target)
+        keys[relationship.get('Id')] = f"{relationship.get('Type').rsplit('/', 1)[-1]}:{target}"
+    ids: dict[str, str] = {}
+    counters: dict[str, int] = {}
+    for relationship_id in sorted(keys, key=lambda key: (references.get(key, len(references)), key)):
+        counters[keys[relationship_id]] = counters.get(keys[relationship_id], 0) + 1
+        ids[relationship_id] = f'{keys[relationship_id]}#{counters[keys[relationship_id]]}'
+
+    for relationship in rels:
+        relationship.set('Id', ids[relationship.get('Id')])
+    rels[:] = sorted(rels, key=lambda relationship: relationship.get('Id'))
+    if source is not None:
+        for element in source.iter():
+            for attribute, value in element.attrib.items():
+                if etree.QName(attribute).namespace == RELATIONSHIPS_NS and value in ids:
+                    element.set(attribute, ids[value])
+
+
+def _canonicalize_content_types(content_types: etree._Element, names: dict[str, str]):
+    for override in content_types.iter(f'{{{CONTENT_TYPES_NS}}}Override'):
+        name: str = override.get('PartName').lstrip('/')
+        override.set('PartName', '/' + names.get(name, name))
+    content_types[:] = sorted(
+        content_types, key=lambda element: (etree.QName(element).localname, element.get('PartName') or '',
+                                            (element.get('Extension') or '').lower())
+    )
+
+
+def _normalize(root: etree._Element):
+    """Attributes sorted, whitespace between elements removed, drawings numbered in document order"""
+    drawing_id: int = 0
+    for element in root.iter():
+        if len(element) and element.text and not element.text.strip():
+            element.text = None
+        if element.tail and not element.tail.strip():
+            element.tail = None
+        if not isinstance(element.tag, str):
+            continue
+        if etree.QName(element).localname in DRAWING_IDS and element.get('id') is not None:
+            drawing_id += 1
+            element.set('id', str(drawing_id))
+        attributes: list[tuple[str, str]] = sorted(element.attrib.items())
+        element.attrib.clear()
+        element.attrib.update(attributes)
+
+
+def main(argv: Optional[Iterable[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Сравнение отчетов с утвержденными образцами')
+    parser.add_argument('cases', nargs='*', help='имена примеров из payloads, по умолчанию все')
+    parser.add_argument('--approve', action='store_true', help='утвердить созданные отчеты как образцы')
+    parser.add_argument('--max-lines', type=int, default=40, help='строк различий в одной части')
+    args = parser.parse_args(argv)
+
+    failed: bool = False
+    with tempfile.TemporaryDirectory() as directory:
+        report_repository: AgentReportRepository = repository(directory)
+        for case in args.cases or cases():
+            parts: dict[str, bytes] = canonical_parts(render_case(report_repository, case))
+            if args.approve:
+                approve(case, parts)
+                print(f'{case}: approved')
+                continue
+            differences: list[str] = compare(case, parts, args.max_lines)
+            failed = failed or bool(differences)
+            print('\n'.join(differences) if differences else f'{case}: OK')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
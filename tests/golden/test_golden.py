@@ -0,0 +1,51 @@
+import json
+import tempfile
+
+import pytest
+
+from appserver.core.cache import canonical_hash
+from tests.golden import harness
+
+
+@pytest.fixture(scope='module')
+def repository():
+    with tempfile.TemporaryDirectory() as directory:
+        yield harness.repository(directory)
+
+
+@pytest.mark.parametrize('case', harness.cases())
+def test_golden_output(repository, case: str):
+    """Reports are rendered the same as approved ones, `python -m tests.golden.harness --approve` approves changes"""
+    differences: list[str] = harness.compare(case, harness.canonical_parts(harness.render_case(repository, case)))
+    assert not differences, '\n'.join(differences)
+
+
+def test_section_rerendered(repository):
+    """A section filled again in a draft is the same as in the created draft, English cargos from settings"""
+    def report():
+        case_report = harness.payload_report('self_import_letter_of_protest')
+        for unit in case_report.transport_units:
+            unit.cargo_in_english = []
+        return case_report
+
+    harness.consume(repository.create_report(report()))
+    with open(repository.draft_path(report()), 'rb') as draft:
+        created: str = harness.document_text(draft.read())
+    harness.consume(repository.update_section(report(), 'letter_of_protest'))
+    with open(repository.draft_path(report()), 'rb') as draft:
+        assert harness.document_text(draft.read()) == created
+    assert '«Apple»' in created
+
+
+def test_draft_report_not_changed_by_rendering(repository):
+    """Rendering of a report of saved draft data does not change the saved data"""
+    with open(harness.PAYLOADS_DIR / 'self_import_containers.json', encoding='utf-8') as payload:
+        data: dict = json.load(payload)['report']
+    for unit in data['transport_units']:
+        unit['cargo_in_english'] = []
+    draft_id: str = repository.create_draft_state(data)['id']
+    report_hash: str = canonical_hash(repository.draft_report(draft_id))
+    harness.consume(repository.create_report(repository.draft_report(draft_id)))
+    harness.consume(repository.add_pictures(repository.draft_report(draft_id)))
+    assert canonical_hash(repository.draft_report(draft_id)) == report_hash
+    assert all(not unit.cargo_in_english for unit in repository.draft_states.get(draft_id).report.transport_units)
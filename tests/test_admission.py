@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+from starlette.routing import Route
+
+from appserver.core.admission import MemoryAdmissionMiddleware, MemoryBudget
+from appserver.core.exceptions import RequestsQueueFullException, ServerOverloadedException
+
+
+def budget(limit: int = 100, queue_size: int = 2, queue_timeout: float = 1.) -> MemoryBudget:
+    return MemoryBudget(limit=limit, queue_size=queue_size, queue_timeout=queue_timeout, retry_after=3)
+
+
+class TestMemoryBudget:
+    """Admission of requests through the global memory budget"""
+
+    def test_waiting_admitted_in_order(self):
+        async def scenario():
+            memory = budget()
+            first = await memory.reserve('first', 70)
+            admitted: list[str] = []
+
+            async def wait(name: str, estimate: int):
+                await memory.reserve(name, estimate)
+                admitted.append(name)
+
+            waiting = [asyncio.create_task(wait('second', 50)), asyncio.create_task(wait('third', 10))]
+            await asyncio.sleep(0)
+            assert admitted == [] and memory.stats()['queued'] == 2
+            first.release()
+            await asyncio.gather(*waiting)
+            assert admitted == ['second', 'third'] and memory.used == 60
+        asyncio.run(scenario())
+
+    def test_large_request_runs_alone(self):
+        async def scenario():
+            memory = budget(queue_timeout=.05)
+            large = await memory.reserve('large', 1000)
+            assert (large.cost, large.estimate, memory.used) == (100, 1000, 100)
+            with pytest.raises(ServerOverloadedException):
+                await memory.reserve('small', 1)
+            large.release()
+            large.release()
+            assert memory.used == 0
+        asyncio.run(scenario())
+
+    def test_rejected(self):
+        async def scenario():
+            memory = budget(queue_size=1, queue_timeout=.05)
+            await memory.reserve('first', 100)
+            waiting = asyncio.create_task(memory.reserve('second', 10))
+            await asyncio.sleep(0)
+            with pytest.raises(RequestsQueueFullException) as error:
+                await memory.reserve('third', 10)
+            assert (error.value.status_code, error.value.headers) == (429, {'Retry-After': '3'})
+            with pytest.raises(ServerOverloadedException) as error:
+                await waiting
+            assert error.value.status_code == 503
+            assert memory.stats()['queued'] == 0 and memory.rejected == 2
+        asyncio.run(scenario())
+
+    def test_grow(self):
+        async def scenario():
+            memory = budget()
+            reservation = await memory.reserve('request', 30)
+            reservation.grow(50)
+            assert (reservation.cost, memory.used) == (80, 80)
+            reservation.grow(50)
+            assert (reservation.cost, reservation.estimate) == (100, 130)
+            reservation.release()
+            other = await memory.reserve('other', 50)
+            reservation = await memory.reserve('request', 30)
+            with pytest.raises(ServerOverloadedException):
+                reservation.grow(30)
+            reservation.release()
+            other.release()
+            assert memory.used == 0
+        asyncio.run(scenario())
+
+    def test_cancelled_waiter_does_not_block_queue(self):
+        async def scenario():
+            memory = budget()
+            first = await memory.reserve('first', 100)
+            cancelled = asyncio.create_task(memory.reserve('cancelled', 50))
+            waiting = asyncio.create_task(memory.reserve('waiting', 50))
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            await asyncio.sleep(0)
+            first.release()
+            await waiting
+            assert memory.used == 50 and memory.stats()['active'] == 1
+        asyncio.run(scenario())
+
+
+class TestMemoryAdmissionMiddleware:
+    """Requests with a body admitted through the budget, admin routes are exempt"""
+
+    def test_admin_routes_exempt(self):
+        async def app(scope, receive, send):
+            await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        async def request(middleware: MemoryAdmissionMiddleware, method: str, path: str) -> int:
+            messages: list[dict] = []
+
+            async def send(message: dict):
+                messages.append(message)
+
+            scope: dict = {'type': 'http', 'method': method, 'path': path, 'headers': [(b'content-length', b'10')]}
+            await middleware(scope, None, send)
+            return messages[0]['status']
+
+        async def scenario():
+            memory = budget(queue_size=0)
+            middleware = MemoryAdmissionMiddleware(app, memory, exempt_routes=[
+                Route('/report/profiler', lambda request: None, methods=['PUT'])
+            ])
+            await memory.reserve('running', 100)
+            assert await request(middleware, 'PUT', '/report/profiler') == 200
+            assert await request(middleware, 'PUT', '/report/') == 429
+            assert await request(middleware, 'POST', '/report/profiler') == 429
+            assert memory.used == 100
+        asyncio.run(scenario())
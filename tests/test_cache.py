@@ -0,0 +1,60 @@
+import base64
+from io import BytesIO
+
+from appserver.core.cache import LRUCache, canonical_hash
+from appserver.core.models import Photo
+
+
+class TestLRUCache:
+    """Cache limited by the total size of values"""
+
+    def test_least_recently_used_evicted(self):
+        cache = LRUCache(max_size=6)
+        cache.put('a', b'aa')
+        cache.put('b', b'bb')
+        cache.put('c', b'cc')
+        assert cache.get('a') == b'aa'
+        cache.put('d', b'dd')
+        assert cache.get('b') is None
+        assert [cache.get(key) for key in 'acd'] == [b'aa', b'cc', b'dd']
+        assert cache.stats() == {'entries': 3, 'size': 6, 'max_size': 6, 'hits': 4, 'misses': 1, 'evictions': 1}
+
+    def test_sizes(self):
+        cache = LRUCache(max_size=10)
+        cache.put('large', b'x', size=11)
+        assert cache.get('large') is None
+        cache.put('key', b'xxxx')
+        cache.put('key', b'xx', size=8)
+        assert cache.size == 8
+        cache.discard('key')
+        cache.discard('missing')
+        assert cache.size == 0 and cache.stats()['entries'] == 0
+
+
+class TestCanonicalHash:
+    """Hashes of report data independent of keys order and photos encoding"""
+
+    def test_keys_order(self):
+        assert canonical_hash({'a': 1, 'b': [1, 2]}) == canonical_hash({'b': [1, 2], 'a': 1})
+        assert canonical_hash({'a': 1}) != canonical_hash({'a': 2})
+
+    def test_photos_by_content(self):
+        content: str = base64.b64encode(b'photo content').decode()
+        first = Photo(id=1, file=f'data:image/jpeg;base64,{content}')
+        second = Photo(id=1, file=f'data:image/png;base64,{content}')
+        assert canonical_hash(first) == canonical_hash(second)
+        assert canonical_hash(first) != canonical_hash(Photo(id=2, file=f'data:image/jpeg;base64,{content}'))
+        assert canonical_hash([BytesIO(b'data')]) == canonical_hash([BytesIO(b'data')])
+
+    def test_photos_by_decoded_content(self):
+        content: bytes = bytes(range(256)) * 4
+        encoded: str = base64.b64encode(content).decode()
+        wrapped: str = '\n'.join(encoded[start:start + 76] for start in range(0, len(encoded), 76))
+        expected: str = canonical_hash(Photo(id=1, file=BytesIO(content)))
+        assert canonical_hash(Photo(id=1, file=f'data:image/jpeg;base64,{encoded}')) == expected
+        assert canonical_hash(Photo(id=1, file=f'data:image/jpeg;base64,{wrapped}')) == expected
+        for payload in (encoded, wrapped):
+            photo = Photo(id=1, file=f'data:image/jpeg;base64,{payload}')
+            photo.file.digest_chunk_size = 100
+            assert canonical_hash(photo) == expected
+        assert Photo(id=1, file='data:image/jpeg;base64,QUJDR').file.digest()
@@ -0,0 +1,50 @@
+import os
+from io import BytesIO
+from pathlib import Path
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+import docx
+import pytest
+from PIL import Image
+
+from appserver.core.document_daos import DocxDocumentDAO
+
+TEMPLATES_DIR: Path = Path(__file__).parent.parent / 'resources'
+IMAGES_DIR: Path = Path(__file__).parent / 'images'
+
+
+@pytest.fixture
+def document() -> bytes:
+    doc = DocxDocumentDAO(str(TEMPLATES_DIR / 'SelfImportReport' / 'header_template.docx'))
+    for n in range(20):
+        doc.append_paragraph(f'Параграф {n}')
+    with open(IMAGES_DIR / 'test_pic_1.jpg', 'rb') as picture:
+        doc.append_picture(picture, 4, 6)
+    noise = BytesIO()
+    Image.frombytes('L', (64, 64), os.urandom(64 * 64)).save(noise, format='PNG')
+    doc.append_picture(noise, 2, 2)
+    stream = BytesIO()
+    doc.write(stream, compression_level=1)
+    return stream.getvalue()
+
+
+class TestDocxOptimizer:
+    """Repacked documents are valid zip archives with the same content"""
+
+    def test_round_trip(self, document: bytes):
+        optimized, report = DocxDocumentDAO.optimize(document, time_budget=60, compression_level=9, workers=2)
+        assert not report.skipped and report.steps['folded_runs'] > 0
+        assert report.optimized_size == len(optimized) < len(document)
+        with ZipFile(BytesIO(optimized)) as package:
+            assert package.testzip() is None
+            infos = package.infolist()
+            assert infos[0].filename == '[Content_Types].xml'
+            assert {info.compress_type for info in infos} == {ZIP_DEFLATED, ZIP_STORED}
+            assert all(len(package.read(info)) == info.file_size for info in infos)
+        paragraphs: list[str] = [paragraph.text for paragraph in docx.Document(BytesIO(optimized)).paragraphs]
+        assert paragraphs == [paragraph.text for paragraph in docx.Document(BytesIO(document)).paragraphs]
+
+    def test_not_smaller_kept(self, document: bytes):
+        optimized, report = DocxDocumentDAO.optimize(document, time_budget=0)
+        assert optimized is document
+        assert report.optimized_size == report.original_size and 'repack' in report.skipped
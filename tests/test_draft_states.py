@@ -0,0 +1,97 @@
+import json
+from copy import deepcopy
+from pathlib import Path
+
+import pytest
+
+from appserver.core.cache import canonical_hash
+from appserver.core.draft_states import DraftState, DraftStateStore, _json_size
+from appserver.core.exceptions import (
+    DraftStateConflictException, DraftStateNotFoundException, ReportDataInvalidException
+)
+from appserver.core.models import PickupFromSupplierReport, SelfImportOnAutoReport, SelfImportReport
+
+PAYLOADS_DIR: Path = Path(__file__).parent / 'golden' / 'payloads'
+
+
+@pytest.fixture
+def data() -> dict:
+    with open(PAYLOADS_DIR / 'self_import_containers.json', encoding='utf-8') as payload:
+        return json.load(payload)['report']
+
+
+@pytest.fixture
+def store() -> DraftStateStore:
+    return DraftStateStore([SelfImportReport, SelfImportOnAutoReport, PickupFromSupplierReport], max_size=1 << 24)
+
+
+class TestDraftStateStore:
+    """Report data of drafts changed by JSON Patch"""
+
+    def test_create(self, store: DraftStateStore, data: dict):
+        state: DraftState = store.create(data)
+        assert type(state.report) is SelfImportReport and state.version == 1
+        assert store.get(state.draft_id) is state
+        with pytest.raises(ReportDataInvalidException):
+            store.create([])
+
+    def test_size_of_parsed_model_counted(self, store: DraftStateStore, data: dict):
+        state: DraftState = store.create(data)
+        assert state.size > _json_size(data)
+        patched: DraftState = store.patch(state.draft_id, [
+            {'op': 'replace', 'path': '/order', 'value': 'O-2'},
+            {'op': 'replace', 'path': '/transport_units/1/pallets', 'value': 9},
+        ])
+        assert patched.size == store.create(patched.data).size
+
+    def test_unit_patched(self, store: DraftStateStore, data: dict):
+        state: DraftState = store.create(data)
+        patched: DraftState = store.patch(state.draft_id, [
+            {'op': 'replace', 'path': '/transport_units/1/pallets', 'value': 9},
+            {'op': 'replace', 'path': '/order', 'value': 'O-2'},
+        ], version=1)
+        assert patched.version == 2 and store.get(state.draft_id) is patched
+        assert patched.report.transport_units[0].temperature is state.report.transport_units[0].temperature
+        assert (patched.report.transport_units[1].pallets, patched.report.order) == (9, 'O-2')
+        assert canonical_hash(patched.report) == canonical_hash(SelfImportReport.parse_obj(patched.data))
+        assert state.data == data
+
+    def test_units_moved(self, store: DraftStateStore, data: dict):
+        state: DraftState = store.create(data)
+        unit: dict = deepcopy(data['transport_units'][0])
+        unit['number'] = 'NEW0000001'
+        patched: DraftState = store.patch(state.draft_id, [
+            {'op': 'move', 'from': '/transport_units/0', 'path': '/transport_units/-'},
+            {'op': 'add', 'path': '/transport_units/0', 'value': unit},
+        ])
+        assert [unit.number for unit in patched.report.transport_units] == ['NEW0000001', 'MSKU0000002', 'MSKU0000001']
+        assert canonical_hash(patched.report) == canonical_hash(SelfImportReport.parse_obj(patched.data))
+        assert patched.size == DraftStateStore([SelfImportReport], 1 << 24).create(patched.data).size
+
+    @pytest.mark.parametrize('path', ['', '/transport_units'])
+    def test_all_units_replaced(self, store: DraftStateStore, data: dict, path: str):
+        state: DraftState = store.create(data)
+        replaced: dict = deepcopy(data)
+        for unit in replaced['transport_units']:
+            unit['pallets'] = 7
+        value = replaced if path == '' else replaced['transport_units']
+        patched: DraftState = store.patch(state.draft_id, [{'op': 'replace', 'path': path, 'value': value}])
+        assert [unit.pallets for unit in patched.report.transport_units] == [7, 7]
+        assert canonical_hash(patched.report) == canonical_hash(SelfImportReport.parse_obj(replaced))
+
+    def test_rejected(self, store: DraftStateStore, data: dict):
+        state: DraftState = store.create(data)
+        store.patch(state.draft_id, [{'op': 'replace', 'path': '/order', 'value': 'O-2'}])
+        with pytest.raises(DraftStateConflictException):
+            store.patch(state.draft_id, [{'op': 'replace', 'path': '/order', 'value': 'O-3'}], version=1)
+        with pytest.raises(ReportDataInvalidException, match='transport_units.1.pallets'):
+            store.patch(state.draft_id, [{'op': 'replace', 'path': '/transport_units/1/pallets', 'value': 'x'}])
+        with pytest.raises(ReportDataInvalidException):
+            store.patch(state.draft_id, [{'op': 'remove', 'path': '/transport_units/5'}])
+        assert store.get(state.draft_id).version == 2
+
+    def test_not_found(self, store: DraftStateStore, data: dict):
+        state: DraftState = store.create(data)
+        store.delete(state.draft_id)
+        with pytest.raises(DraftStateNotFoundException):
+            store.patch(state.draft_id, [])
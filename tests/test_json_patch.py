@@ -0,0 +1,70 @@
+import pytest
+
+from appserver.core.json_patch import JsonPatchError, apply_patch, parse_pointer
+
+
+def changes(document, operations: list[dict]) -> tuple[object, list[tuple[str, list[str]]]]:
+    changed: list[tuple[str, list[str]]] = []
+    return apply_patch(document, operations, lambda kind, path: changed.append((kind, path))), changed
+
+
+class TestParsePointer:
+    """JSON Pointers of RFC 6901"""
+
+    def test_tokens(self):
+        assert parse_pointer('') == []
+        assert parse_pointer('/a~1b/~01/') == ['a/b', '~1', '']
+
+    def test_not_pointer(self):
+        with pytest.raises(JsonPatchError):
+            parse_pointer('a/b')
+
+
+class TestApplyPatch:
+    """Operations of RFC 6902 applied without changing the original document"""
+
+    def test_operations(self):
+        document: dict = {'a': {'b': [1, 2, 3]}, 'c': 'x', 'd': {'e': 1}}
+        patched, changed = changes(document, [
+            {'op': 'add', 'path': '/a/b/1', 'value': 9},
+            {'op': 'add', 'path': '/a/b/-', 'value': 4},
+            {'op': 'remove', 'path': '/a/b/0'},
+            {'op': 'replace', 'path': '/c', 'value': 'y'},
+            {'op': 'move', 'from': '/c', 'path': '/f'},
+            {'op': 'copy', 'from': '/a/b', 'path': '/g'},
+            {'op': 'test', 'path': '/g', 'value': [9, 2, 3, 4]},
+        ])
+        assert patched == {'a': {'b': [9, 2, 3, 4]}, 'd': {'e': 1}, 'f': 'y', 'g': [9, 2, 3, 4]}
+        assert changed == [
+            ('add', ['a', 'b', '1']), ('add', ['a', 'b', '4']), ('remove', ['a', 'b', '0']), ('replace', ['c']),
+            ('remove', ['c']), ('add', ['f']), ('add', ['g'])
+        ]
+
+    def test_original_not_changed_and_shared(self):
+        document: dict = {'a': {'b': [1]}, 'd': {'e': [1]}}
+        patched = apply_patch(document, [{'op': 'add', 'path': '/a/b/-', 'value': 2}])
+        assert document == {'a': {'b': [1]}, 'd': {'e': [1]}}
+        assert patched['a']['b'] == [1, 2] and patched['d'] is document['d']
+
+    def test_root(self):
+        patched, changed = changes({'a': 1}, [{'op': 'replace', 'path': '', 'value': {'b': 2}}])
+        assert (patched, changed) == ({'b': 2}, [('replace', [])])
+        with pytest.raises(JsonPatchError):
+            apply_patch({'a': 1}, [{'op': 'remove', 'path': ''}])
+
+    @pytest.mark.parametrize('operation', [
+        {'op': 'remove', 'path': '/a/5'},
+        {'op': 'add', 'path': '/a/01', 'value': 1},
+        {'op': 'replace', 'path': '/missing', 'value': 1},
+        {'op': 'add', 'path': '/b/c', 'value': 1},
+        {'op': 'move', 'from': '/a', 'path': '/a/0'},
+        {'op': 'test', 'path': '/b', 'value': 2},
+        {'op': 'copy', 'path': '/c'},
+        {'op': 'unknown', 'path': '/b'},
+        'not an operation',
+    ])
+    def test_errors(self, operation):
+        document: dict = {'a': [1, 2], 'b': 1}
+        with pytest.raises(JsonPatchError, match='^Operation 1: '):
+            apply_patch(document, [{'op': 'add', 'path': '/c', 'value': 1}, operation])
+        assert document == {'a': [1, 2], 'b': 1}
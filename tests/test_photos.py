@@ -0,0 +1,76 @@
+import base64
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from appserver.core.exceptions import PhotoCorruptedException
+from appserver.core.models import Photo
+from appserver.core.photos import PhotoInfo, plan_photos_pages, probe_photo, render_photo
+
+
+def photo(size: tuple[int, int], orientation: int = 1, rotation: int = 0, photo_id: int = 1) -> Photo:
+    image = BytesIO()
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    Image.new('RGB', size, (200, 30, 30)).save(image, format='JPEG', exif=exif.tobytes())
+    return Photo(
+        id=photo_id, file=f'data:image/jpeg;base64,{base64.b64encode(image.getvalue()).decode()}', rotation=rotation
+    )
+
+
+def infos(kinds: str) -> list[PhotoInfo]:
+    kinds_names: dict[str, str] = {'l': 'landscape', 'p': 'portrait', 't': 'thumbnail'}
+    return [PhotoInfo(photo((8, 8), photo_id=n), 8, 8, kind=kinds_names[kind]) for n, kind in enumerate(kinds)]
+
+
+class TestProbePhoto:
+    """Dimensions and orientation of photos read from headers"""
+
+    @pytest.mark.parametrize('size, orientation, rotation, kind', [
+        ((1200, 900), 1, 0, 'landscape'),
+        ((1200, 900), 6, 0, 'portrait'),
+        ((1200, 900), 1, 90, 'portrait'),
+        ((1200, 900), 6, 270, 'landscape'),
+        ((900, 1200), 3, 180, 'portrait'),
+        ((300, 200), 1, 0, 'thumbnail'),
+    ])
+    def test_kind(self, size: tuple[int, int], orientation: int, rotation: int, kind: str):
+        info: PhotoInfo = probe_photo(photo(size, orientation, rotation), 65536, 800)
+        assert info.kind == kind
+        assert (info.width > info.height) == (kind == 'landscape') or kind == 'thumbnail'
+
+    @pytest.mark.parametrize('file', ['data:image/jpeg;base64,abcde', 'data:image/jpeg;base64,AAAA'])
+    def test_corrupted(self, file: str):
+        with pytest.raises(PhotoCorruptedException):
+            probe_photo(Photo(id=1, file=file), 65536, 800)
+
+    def test_render_fits_box(self):
+        info: PhotoInfo = probe_photo(photo((1200, 900), 6), 65536, 800)
+        picture, width, height = render_photo(info, width=10, height=10, dpi=100, quality=80)
+        assert (width, height) == pytest.approx((7.5, 10))
+        assert Image.open(picture).size == (round(7.5 / 2.54 * 100), round(10 / 2.54 * 100))
+
+
+class TestPlanPhotosPages:
+    """Distribution of photos among pages"""
+
+    def test_grids_by_kind(self):
+        pages = plan_photos_pages(infos('llllpp' + 't' * 9))
+        assert [(page.rows, page.columns, len(page.photos)) for page in pages] == [(2, 2, 4), (1, 2, 2), (3, 3, 9)]
+
+    def test_leftovers_merged(self):
+        pages = plan_photos_pages(infos('lllllpt'))
+        assert [(page.rows, page.columns, len(page.photos)) for page in pages] == [(2, 2, 4), (2, 2, 3)]
+
+    def test_leftovers_not_merged_when_too_many(self):
+        pages = plan_photos_pages(infos('lllp' + 'tt'))
+        assert [(page.rows, page.columns, len(page.photos)) for page in pages] == [(2, 2, 3), (1, 2, 1), (3, 3, 2)]
+
+    def test_order_kept(self):
+        photos: list[PhotoInfo] = infos('lplplplp')
+        pages = plan_photos_pages(photos)
+        assert [info.photo.id for page in pages for info in page.photos] == [0, 2, 4, 6, 1, 3, 5, 7]
+
+    def test_no_photos(self):
+        assert plan_photos_pages([]) == []
@@ -0,0 +1,47 @@
+import asyncio
+import time
+
+from appserver.core.profiling import SamplingProfiler, current_capture, stage
+
+
+def busy_profiled():
+    started: float = time.monotonic()
+    while time.monotonic() - started < .01:
+        pass
+
+
+def busy_other():
+    started: float = time.monotonic()
+    while time.monotonic() - started < .01:
+        pass
+
+
+class TestSamplingProfiler:
+    """Samples of the event loop thread attributed to the request of the running task"""
+
+    def test_concurrent_requests_not_mixed(self, tmp_path):
+        profiler = SamplingProfiler(str(tmp_path), interval=.001)
+        profiler.configure(requests=1)
+
+        async def profiled():
+            current_capture.set(capture)
+            with stage('request'):
+                for _ in range(20):
+                    busy_profiled()
+                    await asyncio.sleep(0)
+
+        async def other():
+            for _ in range(20):
+                busy_other()
+                await asyncio.sleep(0)
+
+        async def scenario():
+            await asyncio.gather(profiled(), other())
+
+        capture = profiler.begin('profiled')
+        asyncio.run(scenario())
+        stacks: list[str] = [';'.join(stack) for stack in capture.samples]
+        profiler.finish(capture)
+        assert any('busy_profiled' in stack for stack in stacks)
+        assert not any('busy_other' in stack for stack in stacks)
+        assert all(stack.startswith('request;') for stack in stacks)
@@ -0,0 +1,108 @@
+import os
+import time
+from typing import BinaryIO, Union
+from zipfile import ZipFile
+
+import pytest
+
+from appserver.core.exceptions import DraftDocumentNotFoundException
+from appserver.core.storages import ShardedFileStorage
+
+OLD: float = time.time() - 40 * 86400
+
+
+def document(file: Union[str, BinaryIO], text: str):
+    with ZipFile(file, 'w') as package:
+        package.writestr('word/document.xml', text)
+        package.writestr('word/media/image1.png', b'template image' * 100)
+
+
+def contents(path: str) -> dict[str, bytes]:
+    with ZipFile(path) as package:
+        return {name: package.read(name) for name in package.namelist()}
+
+
+def objects(storage: ShardedFileStorage) -> int:
+    return sum(len(files) for _, _, files in os.walk(storage._objects_dir))
+
+
+@pytest.fixture
+def storage(tmp_path) -> ShardedFileStorage:
+    document(str(tmp_path / 'flat.docx'), 'flat')
+    return ShardedFileStorage(str(tmp_path), 'docx')
+
+
+def archive(storage: ShardedFileStorage) -> int:
+    for report in storage.list():
+        if not report.archived:
+            os.utime(storage._draft_path(report.name), (OLD, OLD))
+    return storage.compact(30 * 86400)
+
+
+class TestShardedFileStorage:
+    """Drafts in subdirectories and the archive of their entries"""
+
+    def test_flat_layout_migrated(self, storage: ShardedFileStorage, tmp_path):
+        assert not os.path.exists(tmp_path / 'flat.docx')
+        assert storage.path('flat.docx') == f'{tmp_path}/drafts/{storage._shard("flat.docx")}/flat.docx'
+        assert [report.name for report in storage.list()] == ['flat.docx']
+
+    def test_names(self, storage: ShardedFileStorage):
+        for name in ('../flat.docx', '.docx', 'a/b.docx', 'settings.toml', 'missing.docx'):
+            with pytest.raises(DraftDocumentNotFoundException):
+                storage.path(name)
+
+    def test_failed_write_keeps_draft(self, storage: ShardedFileStorage):
+        with pytest.raises(RuntimeError):
+            with storage.writer('flat.docx') as draft:
+                draft.write(b'partial')
+                raise RuntimeError
+        path: str = storage.path('flat.docx')
+        assert contents(path)['word/document.xml'] == b'flat'
+        assert os.listdir(os.path.dirname(path)) == ['flat.docx']
+
+    def test_archive_and_restore(self, storage: ShardedFileStorage):
+        expected: dict[str, bytes] = contents(storage.path('flat.docx'))
+        with storage.writer('other.docx') as draft:
+            document(draft, 'other')
+        assert archive(storage) == 2
+        assert all(report.archived for report in storage.list())
+        assert objects(storage) == 3
+
+        path: str = storage.path('flat.docx')
+        assert contents(path) == expected
+        assert os.stat(path).st_mtime == pytest.approx(OLD, abs=1)
+        assert sorted((report.name, report.archived) for report in storage.list()) == [
+            ('flat.docx', False), ('other.docx', True)
+        ]
+
+    def test_restore_without_storage_lock(self, storage: ShardedFileStorage, monkeypatch):
+        archive(storage)
+        read_manifest = storage._read_manifest
+        monkeypatch.setattr(storage, '_read_manifest', lambda path: (
+            pytest.fail('restored under the lock') if storage._lock.locked() else read_manifest(path)
+        ))
+        assert contents(storage.path('flat.docx'))['word/document.xml'] == b'flat'
+
+    def test_missing_objects(self, storage: ShardedFileStorage):
+        archive(storage)
+        for directory, _, files in os.walk(storage._objects_dir):
+            for file in files:
+                os.remove(os.path.join(directory, file))
+        with pytest.raises(DraftDocumentNotFoundException):
+            storage.path('flat.docx')
+        assert not os.path.exists(storage._draft_path('flat.docx'))
+        assert not os.listdir(os.path.dirname(storage._draft_path('flat.docx')))
+
+    def test_interrupted_archive_collected(self, storage: ShardedFileStorage, monkeypatch):
+        write_object = storage._write_object
+
+        def used_while_archived(key: str, data: bytes):
+            write_object(key, data)
+            storage.path('flat.docx')
+
+        storage.compact(30 * 86400)
+        monkeypatch.setattr(storage, '_write_object', used_while_archived)
+        assert archive(storage) == 0
+        assert not storage.list()[0].archived
+        assert objects(storage) == 0
@@ -0,0 +1,59 @@
+import asyncio
+import time
+from typing import BinaryIO
+
+import pytest
+
+from appserver.core.exceptions import DocumentTemplateCorruptedException
+from appserver.core.streaming import DocumentStreamingResponse
+
+
+async def send_response(response: DocumentStreamingResponse) -> list[dict]:
+    messages: list[dict] = []
+
+    async def receive() -> dict:
+        await asyncio.sleep(10)
+        return {'type': 'http.disconnect'}
+
+    async def send(message: dict):
+        messages.append(message)
+
+    await response({'type': 'http', 'method': 'GET', 'path': '/'}, receive, send)
+    return messages
+
+
+class TestDocumentStreamingResponse:
+    """Documents sent while they are serialized in a worker thread"""
+
+    def test_first_chunk_awaited_without_blocking(self):
+        def write(stream: BinaryIO):
+            time.sleep(.2)
+            stream.write(b'document')
+
+        async def scenario() -> tuple[list[dict], int]:
+            ticks: int = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(.01)
+                    ticks += 1
+
+            ticker = asyncio.create_task(tick())
+            messages: list[dict] = await send_response(DocumentStreamingResponse(write, 'report.docx'))
+            ticker.cancel()
+            return messages, ticks
+
+        messages, ticks = asyncio.run(scenario())
+        assert ticks > 5
+        assert messages[0]['status'] == 200
+        assert b''.join(message.get('body', b'') for message in messages[1:]) == b'document'
+
+    def test_error_raised_before_response_start(self):
+        def write(stream: BinaryIO):
+            raise DocumentTemplateCorruptedException('header_template')
+
+        messages: list[dict] = []
+        with pytest.raises(DocumentTemplateCorruptedException):
+            messages = asyncio.run(send_response(DocumentStreamingResponse(write, 'report.docx')))
+        assert not messages
@@ -0,0 +1,82 @@
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+from appserver.core.document_daos import DocxDocumentDAO
+from appserver.core.exceptions import DocumentTemplateCorruptedException
+from appserver.core.models import SelfImportOnAutoReport, SelfImportReport
+from appserver.core.template_compiler import TemplateCompiler, TemplateSpec
+from appserver.core.templates import TemplatesCache
+
+TEMPLATES_DIR: Path = Path(__file__).parent.parent / 'resources'
+SPECS: dict[str, TemplateSpec] = {
+    'header_template': TemplateSpec(contexts=('header',), optional_rows=True),
+    'temperature_template': TemplateSpec(contexts=('report', 'transport_unit')),
+}
+
+
+@pytest.fixture
+def compiler(tmp_path) -> TemplateCompiler:
+    os.makedirs(tmp_path / 'SelfImportReport')
+    for name in SPECS:
+        shutil.copy(TEMPLATES_DIR / 'SelfImportReport' / f'{name}.docx', tmp_path / 'SelfImportReport')
+    return TemplateCompiler(DocxDocumentDAO, str(tmp_path), 'docx')
+
+
+class TestTemplateCompiler:
+    """Compiled templates stored next to templates"""
+
+    def test_compiled_once(self, compiler: TemplateCompiler, monkeypatch):
+        compiled = compiler.load(SelfImportReport, 'SelfImportReport', SPECS)
+        assert os.path.exists(f'{compiler.templates_dir}/SelfImportReport/compiled.json')
+        assert compiled['temperature_template'].grids
+
+        monkeypatch.setattr(compiler, 'compile', lambda *args: pytest.fail('compiled again'))
+        assert compiler.load(SelfImportReport, 'SelfImportReport', SPECS) == compiled
+
+    def test_shared_by_report_types(self, compiler: TemplateCompiler):
+        compiler.load(SelfImportReport, 'SelfImportReport', SPECS)
+        compiler.load(SelfImportOnAutoReport, 'SelfImportReport', SPECS)
+        stored, checks = compiler._read_artifact(f'{compiler.templates_dir}/SelfImportReport/compiled.json')
+        assert set(checks) == {'SelfImportReport', 'SelfImportOnAutoReport'} and set(stored) == set(SPECS)
+
+    def test_changed_template_compiled_again(self, compiler: TemplateCompiler, monkeypatch):
+        compiler.load(SelfImportReport, 'SelfImportReport', SPECS)
+        compiler.load(SelfImportOnAutoReport, 'SelfImportReport', SPECS)
+        template_path: str = f'{compiler.templates_dir}/SelfImportReport/temperature_template.docx'
+        shutil.copy(TEMPLATES_DIR / 'SelfImportReport' / 'conclusion_template.docx', template_path)
+        compiled = compiler.load(SelfImportReport, 'SelfImportReport', SPECS)
+        assert compiled['temperature_template'].sha256 == compiler._file_hash(template_path)
+        stored, checks = compiler._read_artifact(f'{compiler.templates_dir}/SelfImportReport/compiled.json')
+        assert stored['temperature_template'] == compiled['temperature_template']
+        assert set(checks) == {'SelfImportReport', 'SelfImportOnAutoReport'}
+
+        compiled_for: list = []
+        compile_templates = compiler.compile
+        monkeypatch.setattr(compiler, 'compile', lambda model, *args: compiled_for.append(model) or compile_templates(
+            model, *args
+        ))
+        compiler.load(SelfImportOnAutoReport, 'SelfImportReport', SPECS)
+        assert compiled_for == [SelfImportOnAutoReport]
+
+    def test_errors(self, compiler: TemplateCompiler):
+        specs: dict[str, TemplateSpec] = {'temperature_template': TemplateSpec(tables=5, contexts=('report',))}
+        with pytest.raises(DocumentTemplateCorruptedException):
+            compiler.load(SelfImportReport, 'SelfImportReport', specs)
+        assert not os.path.exists(f'{compiler.templates_dir}/SelfImportReport/compiled.json')
+
+
+class TestTemplatesCache:
+    """Parsed templates and versions of templates directories"""
+
+    def test_version_of_templates_only(self, compiler: TemplateCompiler):
+        templates = TemplatesCache(DocxDocumentDAO, extension='docx')
+        directory: str = f'{compiler.templates_dir}/SelfImportReport'
+        version: str = templates.version(directory)
+        compiler.load(SelfImportReport, 'SelfImportReport', SPECS)
+        assert templates.version(directory) == version
+
+        shutil.copy(TEMPLATES_DIR / 'SelfImportReport' / 'conclusion_template.docx', directory)
+        assert templates.version(directory) != version
@@ -0,0 +1,121 @@
+import base64
+
+import numpy as np
+import pytest
+
+from appserver.core.exceptions import ReadingsCorruptedException
+from appserver.core.thermographs import ExcursionAnalyzer, LoggerReadings, downsample_readings, lttb, min_max_decimate
+
+
+def readings_text(rows: int) -> str:
+    start: int = 1_700_000_000
+    values: np.ndarray = 4 + 5 * np.sin(np.arange(rows) / 50)
+    return 'Time;Temperature\n' + ''.join(
+        f'{start + n * 600};{value:.2f}\n'.replace('.', ',') for n, value in enumerate(values)
+    )
+
+
+def concatenated(readings: LoggerReadings, chunk_size: int) -> tuple[np.ndarray, np.ndarray]:
+    chunks: list[tuple[np.ndarray, np.ndarray]] = list(readings.chunks(chunk_size))
+    return np.concatenate([times for times, _ in chunks]), np.concatenate([values for _, values in chunks])
+
+
+class TestLoggerReadings:
+    """Parsing of logger readings"""
+
+    def test_formats(self):
+        text: str = 'No;Date;Time;Value\n1;01.02.2024;10:00;3,5\n2;2024-02-01 10:10:30;-1.25\n3;01/02/2024 10:20;4\n'
+        times, values = concatenated(LoggerReadings(text), 1 << 20)
+        assert times.tolist() == [1706781600, 1706782230, 1706782800]
+        assert values.tolist() == [3.5, -1.25, 4.]
+
+    def test_data_url(self):
+        encoded: str = base64.b64encode('Дата;Значение\n01.02.2024 10:00;3,5\n'.encode('cp1251')).decode()
+        assert LoggerReadings(f'data:text/csv;base64,{encoded}').text == 'Дата;Значение\n01.02.2024 10:00;3,5\n'
+
+    @pytest.mark.parametrize('payload', ['QUJDR', 'данные'])
+    def test_corrupted_data_url(self, payload: str):
+        readings = LoggerReadings(f'data:text/csv;base64,{payload}')
+        with pytest.raises(ReadingsCorruptedException):
+            next(readings.chunks())
+
+    @pytest.mark.parametrize('chunk_size', [1, 100, 4096])
+    def test_chunk_size_invariance(self, chunk_size: int):
+        readings = LoggerReadings(readings_text(2000))
+        whole_times, whole_values = concatenated(readings, 1 << 24)
+        times, values = concatenated(readings, chunk_size)
+        assert len(whole_times) == 2000
+        assert np.array_equal(times, whole_times) and np.array_equal(values, whole_values)
+
+
+class TestExcursionAnalyzer:
+    """Excursions and mean kinetic temperature of readings"""
+
+    def test_durations(self):
+        analyzer = ExcursionAnalyzer(lower=0, upper=7)
+        analyzer.feed(np.array([0, 60, 120, 180, 240]), np.array([5., 10., 10., -1., 5.]))
+        excursions = analyzer.result()
+        assert (excursions.readings, excursions.duration) == (5, 240)
+        assert (excursions.time_above, excursions.time_below, excursions.longest) == (120, 60, 180)
+        assert (excursions.minimum, excursions.maximum) == (-1, 10)
+
+    def test_known_mean_kinetic_temperature(self):
+        """Equal time at 20 °C and 30 °C with activation energy 83.144 kJ/mol gives MKT of 26.26 °C"""
+        analyzer = ExcursionAnalyzer(lower=-100, upper=100, activation_energy=83.144)
+        analyzer.feed(np.array([0, 3600, 7200]), np.array([20., 30., 30.]))
+        assert analyzer.result().mean_kinetic_temperature == pytest.approx(26.26, abs=.01)
+
+    def test_constant_temperature(self):
+        analyzer = ExcursionAnalyzer(lower=2, upper=6)
+        analyzer.feed(np.arange(0, 6000, 600), np.full(10, 4.))
+        excursions = analyzer.result()
+        assert excursions.mean_kinetic_temperature == pytest.approx(4.)
+        assert not excursions.violated
+
+    @pytest.mark.parametrize('chunk_size', [1, 3, 7, 1000])
+    def test_chunk_size_invariance(self, chunk_size: int):
+        times: np.ndarray = np.arange(0, 1000 * 600, 600)
+        values: np.ndarray = 4 + 5 * np.sin(np.arange(1000) / 30)
+        whole = ExcursionAnalyzer(lower=2, upper=6)
+        whole.feed(times, values)
+        chunked = ExcursionAnalyzer(lower=2, upper=6)
+        for start in range(0, len(times), chunk_size):
+            chunked.feed(times[start:start + chunk_size], values[start:start + chunk_size])
+        expected, result = whole.result(), chunked.result()
+        assert result.longest == expected.longest > 0
+        assert (result.readings, result.duration, result.time_above, result.time_below) == \
+            (expected.readings, expected.duration, expected.time_above, expected.time_below)
+        assert result.mean_kinetic_temperature == pytest.approx(expected.mean_kinetic_temperature)
+
+
+class TestDownsampling:
+    """Downsampling of readings for charts"""
+
+    def test_min_max_decimate_keeps_extremes(self):
+        times: np.ndarray = np.arange(10000)
+        values: np.ndarray = np.zeros(10000)
+        values[1234], values[8765] = 50., -50.
+        decimated_times, decimated_values = min_max_decimate(times, values, 100)
+        assert len(decimated_values) <= 100
+        assert 1234 in decimated_times and 8765 in decimated_times
+        assert np.all(np.diff(decimated_times) >= 0)
+
+    def test_lttb(self):
+        times: np.ndarray = np.arange(1000)
+        values: np.ndarray = np.zeros(1000)
+        values[500] = 10.
+        sampled_times, sampled_values = lttb(times, values, 50)
+        assert len(sampled_times) == 50
+        assert (sampled_times[0], sampled_times[-1]) == (0, 999)
+        assert 500 in sampled_times
+        assert lttb(times, values, 2000)[0] is times
+
+    def test_downsample_readings_chunk_size_invariance(self):
+        readings = LoggerReadings(readings_text(3000))
+        expected = downsample_readings(readings, points=200, max_points=100000, chunk_size=1 << 24)
+        whole = ExcursionAnalyzer(lower=2, upper=6)
+        downsample_readings(readings, points=200, max_points=100000, chunk_size=1 << 24, analyzer=whole)
+        chunked = ExcursionAnalyzer(lower=2, upper=6)
+        times, values = downsample_readings(readings, points=200, max_points=100000, chunk_size=500, analyzer=chunked)
+        assert np.array_equal(times, expected[0]) and np.array_equal(values, expected[1])
+        assert chunked.result() == whole.result()
@@ -0,0 +1,57 @@
+import os
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from appserver.core.exceptions import PhotoCorruptedException, ThumbnailNotFoundException
+from appserver.core.thumbnails import ThumbnailsCache
+
+
+def jpeg(size: tuple[int, int], orientation: int = 1, color: tuple[int, int, int] = (200, 30, 30)) -> bytes:
+    image = BytesIO()
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    Image.new('RGB', size, color).save(image, format='JPEG', exif=exif.tobytes())
+    return image.getvalue()
+
+
+@pytest.fixture
+def thumbnails(tmp_path) -> ThumbnailsCache:
+    return ThumbnailsCache(str(tmp_path), sizes=[160, 320], formats=['jpeg'], max_size=1 << 20)
+
+
+class TestThumbnailsCache:
+    """Thumbnails of images kept on disk"""
+
+    def test_sizes_and_orientation(self, thumbnails: ThumbnailsCache):
+        key: str = thumbnails.add(jpeg((800, 600), orientation=6))
+        assert Image.open(thumbnails.get(key, 160, 'jpeg')).size == (120, 160)
+        assert Image.open(thumbnails.get(key, 200, 'jpeg')).size == (240, 320)
+        assert Image.open(thumbnails.get(key, 1000, 'jpeg')).size == (240, 320)
+
+    def test_same_image_same_key(self, thumbnails: ThumbnailsCache):
+        image: bytes = jpeg((400, 300))
+        assert thumbnails.add(image) == thumbnails.add(image)
+
+    def test_not_found(self, thumbnails: ThumbnailsCache):
+        key: str = thumbnails.add(jpeg((400, 300)))
+        for wrong_key, image_format in (('0' * 64, 'jpeg'), ('../' + key[3:], 'jpeg'), (key, 'webp')):
+            with pytest.raises(ThumbnailNotFoundException) as error:
+                thumbnails.get(wrong_key, 160, image_format)
+            assert error.value.status_code == 404
+
+    def test_corrupted(self, thumbnails: ThumbnailsCache):
+        with pytest.raises(PhotoCorruptedException):
+            thumbnails.add(b'not an image')
+
+    def test_eviction(self, tmp_path):
+        thumbnails = ThumbnailsCache(str(tmp_path), sizes=[160], formats=['jpeg'], max_size=1 << 20)
+        first: str = thumbnails.add(jpeg((400, 300), color=(10, 10, 10)))
+        first_path: str = thumbnails.get(first, 160, 'jpeg')
+        thumbnails.max_size = os.path.getsize(first_path) * 3 // 2
+        os.utime(first_path, (0, 0))
+        second: str = thumbnails.add(jpeg((400, 300), color=(250, 250, 250)))
+        with pytest.raises(ThumbnailNotFoundException):
+            thumbnails.get(first, 160, 'jpeg')
+        assert os.path.exists(thumbnails.get(second, 160, 'jpeg'))